@@ -15,7 +15,8 @@ SETTABLE_PROPERTIES = {
     'info.headername': "Dion's",
     'info.placeholder': 'What is the best side effect of using an AI assistant?',
     'restricted.message': 'Contact alex@komoroske.com for a token',
-    'restricted.count': True
+    'restricted.count': True,
+    'admin_token': 'sk-SECRET-admin-token'
 }
 
 BOOLEAN_STRINGS = {
@@ -37,7 +38,7 @@ def generate_token_for_user(user_id):
 def save_config_file(data, access_file=DEFAULT_CONFIG_FILE):
     with open(access_file, 'w') as f:
         json.dump(data, f, indent='\t')
-    print(f"Don't forget to redeploy with the updated {access_file}")
+    print(f"Hosts running from this directory pick up the change within a few seconds. Don't forget to redeploy with the updated {access_file}")
 
 
 def load_config_file(access_file=DEFAULT_CONFIG_FILE):
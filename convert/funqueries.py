@@ -0,0 +1,72 @@
+import argparse
+import os
+
+import openai
+from dotenv import load_dotenv
+
+from polymath import get_embedding, load_libraries
+from polymath.config.json import JSONConfigStore
+from polymath.config.types import HostConfig
+from polymath.precompute import PrecomputedQueries, precomputed_filename, stand_in_embedding
+
+# Embeds the fun_queries in host.SECRET.json and stores how each of them ranks
+# the bits of the library, so that the host can answer them without scoring
+# every bit.
+#
+# Embeddings already in the output file are reused, so rerunning this only
+# fetches embeddings for new queries. Without an OpenAI key (or with
+# --offline) queries that aren't cached yet get a stand-in embedding; rerun
+# online later to replace them.
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--library', help='The library file the host serves. Defaults to LIBRARY_FILENAME, or all the libraries in libraries/.', default=os.getenv('LIBRARY_FILENAME', ''))
+parser.add_argument(
+    '--output', help='Where to store the precomputed queries. Defaults to next to the library.', default='')
+parser.add_argument(
+    '--config', help='The host config file to read fun_queries from', default=None)
+parser.add_argument('--offline', action='store_true',
+                    help='If set, will not fetch embeddings and will use stand-ins for queries that are not cached')
+args = parser.parse_args()
+
+offline = args.offline or not openai.api_key
+output_filename = args.output if args.output else precomputed_filename(args.library)
+
+host_config = JSONConfigStore().load(HostConfig, args.config)
+fun_queries = host_config.info.fun_queries
+
+library = load_libraries(args.library, True)
+
+precomputed = PrecomputedQueries.load(output_filename)
+if precomputed is None:
+    precomputed = PrecomputedQueries()
+
+for query in precomputed.queries:
+    if query not in fun_queries:
+        print(f'Removing "{query}" which is no longer a fun query')
+        precomputed.remove(query)
+
+for query in fun_queries:
+    cached = precomputed.embedding(query) is not None
+    if cached and not precomputed.is_stand_in(query):
+        continue
+    embedding = None
+    if not offline:
+        print(f'Fetching embedding for "{query}"')
+        embedding = get_embedding(query)
+    if embedding is not None:
+        precomputed.set_embedding(query, embedding)
+    elif not cached:
+        print(f'Using a stand-in embedding for "{query}"')
+        precomputed.set_embedding(query, stand_in_embedding(query), stand_in=True)
+
+precomputed.rank(library)
+precomputed.save(output_filename)
+
+stand_in_count = len([query for query in precomputed.queries if precomputed.is_stand_in(query)])
+print(f'Saved {len(precomputed.queries)} precomputed queries to {output_filename}')
+if stand_in_count:
+    print(f'{stand_in_count} of them use stand-in embeddings. Rerun with an OPENAI_API_KEY to fetch real ones.')
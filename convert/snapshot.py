@@ -0,0 +1,31 @@
+import argparse
+import os
+
+from polymath import LIBRARY_DIR, library_filenames, load_libraries
+from polymath.snapshot import load_snapshot, snapshot_filename, write_snapshot
+
+# Writes a snapshot of the library the host serves: its fully loaded and
+# prepared state, which the host restores at startup instead of loading the
+# library files again, as long as they haven't changed since.
+#
+# Rerun this whenever the libraries change; a stale snapshot is ignored.
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--library', help='The library file the host serves. Defaults to LIBRARY_FILENAME, or all the libraries in libraries/.', default=os.getenv('LIBRARY_FILENAME', ''))
+parser.add_argument(
+    '--output', help='Where to write the snapshot. Defaults to where the host looks for it.', default='')
+args = parser.parse_args()
+
+sources = library_filenames(args.library)
+if not sources:
+    raise Exception('There are no libraries to snapshot.')
+output_filename = args.output if args.output else snapshot_filename(args.library, LIBRARY_DIR)
+
+library = load_libraries(args.library, True)
+prepared = library.prepare()
+write_snapshot(library, output_filename, sources)
+
+if load_snapshot(output_filename, sources) is None:
+    raise Exception(f'Could not read back {output_filename}')
+print(f'Saved a snapshot of {prepared["bits"]} bits from {len(sources)} files to {output_filename}')
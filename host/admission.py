@@ -0,0 +1,108 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Union
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request can't be admitted in time. retry_after is how many
+    seconds the client should wait before trying again.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits how many queries run at once, so that bursts fail fast instead of
+    making every request slow.
+
+    Args:
+        max_concurrent: How many queries may run at once. 0 disables the limit.
+        max_queued: How many queries may wait for a free slot. Further
+            queries are rejected immediately.
+        timeout: How many seconds a query may wait for a slot before it is
+            rejected.
+        fair_share: The fraction of max_concurrent that queries sharing one
+            key (e.g. one access token) may hold at once. Queries without a
+            key are only subject to the overall limit.
+        retry_after: The number of seconds rejected clients are told to wait.
+    """
+
+    def __init__(self, max_concurrent: int = 0, max_queued: int = 0, timeout: float = 5, fair_share: float = 1, retry_after: int = 1):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.max_concurrent_per_key = max(1, math.ceil(max_concurrent * fair_share))
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._running_by_key = dict[str, int]()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    def _can_run(self, key: Union[str, None]) -> bool:
+        if self._running >= self.max_concurrent:
+            return False
+        if key is None:
+            return True
+        return self._running_by_key.get(key, 0) < self.max_concurrent_per_key
+
+    def _acquire(self, key: Union[str, None]):
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            if not self._can_run(key):
+                if self._waiting >= self.max_queued:
+                    raise Overloaded(
+                        'The host is overloaded, retry later', self.retry_after)
+                self._waiting += 1
+                try:
+                    while not self._can_run(key):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Overloaded(
+                                'Timed out waiting for the host, retry later', self.retry_after)
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._running += 1
+            if key is not None:
+                self._running_by_key[key] = self._running_by_key.get(key, 0) + 1
+
+    def _release(self, key: Union[str, None]):
+        with self._condition:
+            self._running -= 1
+            if key is not None:
+                self._running_by_key[key] -= 1
+                if not self._running_by_key[key]:
+                    del self._running_by_key[key]
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, key: Union[str, None] = None) -> Iterator[None]:
+        """
+        Waits for a slot to run a query in, raising Overloaded if none frees
+        up in time.
+        """
+        if not self.enabled:
+            yield
+            return
+        self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def stats(self) -> dict[str, int]:
+        with self._condition:
+            return {
+                'running': self._running,
+                'waiting': self._waiting
+            }
@@ -0,0 +1,181 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, TypeVar, Union
+
+import polymath
+
+from .coalesce import SingleFlight
+
+T = TypeVar('T')
+
+LEGAL_COLLECTION_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+
+class ResultCache(Generic[T]):
+    """
+    Keeps the most recently used results by key, up to size of them. A size
+    of 0 disables the cache.
+    """
+
+    def __init__(self, size: int = 0):
+        self.size = size
+        self._lock = threading.Lock()
+        self._results = OrderedDict[str, T]()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, key: Union[str, None]) -> Union[T, None]:
+        if key is None or not self.size:
+            return None
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+            return result
+
+    def put(self, key: Union[str, None], result: T):
+        if key is None or not self.size:
+            return
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+class Collection:
+    """
+    A library served by a host under a name, along with the results of
+    recent queries against it.
+    """
+
+    def __init__(self, name: str, library: polymath.Library, memory_bytes: int, result_cache_size: int = 0):
+        self.name = name
+        self.library = library
+        # A rough estimate of how much memory the library takes.
+        self.memory_bytes = memory_bytes
+        self.results = ResultCache[polymath.Library](result_cache_size)
+
+
+class CollectionCatalog:
+    """
+    The collections a host can serve: every library file (named after the
+    file, without .json) and every directory of library files (named after
+    the directory) directly inside directory.
+
+    Collections are loaded the first time they're queried. Once the loaded
+    collections take more than memory_budget bytes, the least recently used
+    ones are evicted, to be loaded again when they're next queried.
+
+    Args:
+        directory: Where the collections are.
+        load: Loads a library given a library file, or '' and a directory of
+            library files.
+        memory_budget: How many bytes loaded collections may take, as
+            estimated from the size of their embeddings and files. 0 means
+            there is no limit.
+        result_cache_size: How many query results to keep per collection.
+    """
+
+    def __init__(self, directory: str, load: Callable[[str, str], polymath.Library], memory_budget: int = 0, result_cache_size: int = 0):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.result_cache_size = result_cache_size
+        self.load_count = 0
+        self.eviction_count = 0
+        self._load = load
+        self._lock = threading.Lock()
+        self._collections = OrderedDict[str, Collection]()
+        self._loading = SingleFlight[Collection]()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def names(self) -> list[str]:
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        result = []
+        for entry in sorted(os.listdir(self.directory)):
+            name = entry.removesuffix('.json')
+            if LEGAL_COLLECTION_NAME.match(name) and self._location(name):
+                result.append(name)
+        return result
+
+    def _location(self, name: str) -> Union[tuple[str, str], None]:
+        """
+        Returns the (library file, directory) that name is loaded from, or
+        None if there is no such collection.
+        """
+        filename = os.path.join(self.directory, name + '.json')
+        if os.path.isfile(filename):
+            return (filename, '')
+        directory = os.path.join(self.directory, name)
+        if os.path.isdir(directory):
+            return ('', directory)
+        return None
+
+    def get(self, name: str) -> Collection:
+        if not self.enabled:
+            raise Exception('This host does not serve collections')
+        if not LEGAL_COLLECTION_NAME.match(name):
+            raise Exception(f'Illegal collection name: {name}')
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None:
+                self._collections.move_to_end(name)
+                return collection
+        # Concurrent first queries of a collection share one load.
+        collection, _ = self._loading.do(name, lambda: self._load_collection(name))
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = collection
+                self.load_count += 1
+            self._collections.move_to_end(name)
+            self._evict(keep=name)
+        return collection
+
+    def _load_collection(self, name: str) -> Collection:
+        location = self._location(name)
+        if location is None:
+            raise Exception(f'Unknown collection: {name}')
+        library_filename, library_dir = location
+        library = self._load(library_filename, library_dir)
+        prepared = library.prepare()
+        file_bytes = sum(
+            os.path.getsize(filename)
+            for filename in polymath.library_filenames(library_filename, library_dir))
+        return Collection(name, library, prepared['embedding_bytes'] + file_bytes, self.result_cache_size)
+
+    def _evict(self, keep: str):
+        # Must be called with self._lock held.
+        if not self.memory_budget:
+            return
+        while self.memory_bytes > self.memory_budget:
+            name = next(iter(self._collections))
+            if name == keep:
+                break
+            del self._collections[name]
+            self.eviction_count += 1
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(collection.memory_bytes for collection in list(self._collections.values()))
+
+    @property
+    def loaded(self) -> list[str]:
+        """
+        The names of the loaded collections, least recently used first.
+        """
+        return list(self._collections.keys())
+
+    def clear_results(self):
+        for collection in list(self._collections.values()):
+            collection.results.clear()
@@ -0,0 +1,79 @@
+import json
+import threading
+from typing import Callable, Generic, TypeVar, Union
+
+from polymath.access import permitted_access
+from polymath.library import TRUTHY_ARGUMENT_VALUES
+
+T = TypeVar('T')
+
+
+def query_key(args: dict[str, Union[str, int]]) -> Union[str, None]:
+    """
+    Returns a key that is the same for any two queries that are guaranteed to
+    produce the same result, or None if the query shouldn't be shared (e.g.
+    one without a query_embedding, which asks for random bits, a paginated
+    one, whose cursor would outlive the ranking it points into, or one asking
+    for debug_timings, which are only true of the run that produced them).
+
+    The access_token itself isn't part of the key, only the access tags it
+    grants, so that clients with equivalent tokens share results too.
+    """
+    if not args.get('query_embedding'):
+        return None
+    if args.get('cursor') or str(args.get('paginate', '')).lower() in TRUTHY_ARGUMENT_VALUES:
+        return None
+    if str(args.get('debug_timings', '')).lower() in TRUTHY_ARGUMENT_VALUES:
+        return None
+    normalized = {
+        key: str(value) for key, value in args.items() if key != 'access_token'
+    }
+    access_tags = sorted(permitted_access(str(args.get('access_token', ''))))
+    return json.dumps([normalized, access_tags], sort_keys=True)
+
+
+class _Call(Generic[T]):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Union[T, None] = None
+        self.error: Union[Exception, None] = None
+
+
+class SingleFlight(Generic[T]):
+    """
+    Makes concurrent calls with the same key wait on one in-flight call and
+    share its result, instead of each doing the work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict[str, _Call[T]]()
+
+    def do(self, key: Union[str, None], fn: Callable[[], T]) -> tuple[T, bool]:
+        """
+        Returns the result of fn, and whether it was shared with an identical
+        call already in flight. A key of None is never shared.
+        """
+        if key is None:
+            return fn(), False
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = _Call[T]()
+                self._calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return (call.result, True)  # type: ignore
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,2 @@
+# Host tests use the same default HostConfig as the library's tests.
+from polymath.conftest import host_config  # noqa: F401
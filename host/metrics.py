@@ -0,0 +1,165 @@
+import os
+import resource
+import threading
+from typing import Callable, Iterable, Union
+
+# A tiny, dependency-free implementation of the Prometheus text exposition
+# format (https://prometheus.io/docs/instrumenting/exposition_formats/).
+#
+# Metrics live in the memory of each process, so when running under gunicorn
+# with several workers every worker reports its own values.
+
+METRICS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from 100µs to 10s.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ''
+    items = ','.join(
+        f'{name}="{value}"' for name, value in labels)
+    return '{' + items + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[str]:
+        raise Exception('samples must be overridden')
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.type}',
+            *self.samples()
+        ]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values = dict[Labels, float]()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_format_labels(labels)} {_format_value(value)}'
+
+
+class Gauge(Metric):
+    """
+    A gauge whose value is computed by calling getter at scrape time.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, description: str, getter: Callable[[], Union[float, None]]):
+        super().__init__(name, description)
+        self._getter = getter
+
+    def samples(self) -> Iterable[str]:
+        value = self._getter()
+        if value is None:
+            return
+        yield f'{self.name} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self._buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # labels to (per-bucket counts, sum, count)
+        self._values = dict[Labels, tuple[list[int], float, int]]()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self._buckets), 0.0, 0))
+            for index, bound in enumerate(self._buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, (list(counts), total, count))
+                      for labels, (counts, total, count) in self._values.items()]
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(
+                    labels, (('le', _format_value(bound)),))
+                yield f'{self.name}_bucket{bucket_labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(labels)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = list[Metric]()
+
+    def counter(self, name: str, description: str) -> Counter:
+        metric = Counter(name, description)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, description: str, getter: Callable[[], Union[float, None]]) -> Gauge:
+        metric = Gauge(name, description, getter)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, description, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+def resident_memory_bytes() -> Union[float, None]:
+    """
+    Returns the current resident set size of this process, if it can be
+    determined (Linux only).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def max_resident_memory_bytes() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
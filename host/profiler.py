@@ -0,0 +1,98 @@
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+from typing import Any, Callable, TypeVar, Union
+
+T = TypeVar('T')
+
+LEGAL_PROFILE_SORTS = set(['tottime', 'cumtime'])
+
+
+class QueryProfiler:
+    """
+    Profiles a random sample of calls with cProfile and aggregates the
+    results, so hot functions can be found under production traffic without
+    attaching a profiler to a live instance.
+
+    Args:
+        rate: The fraction of calls to profile, between 0 (disabled) and 1.
+        directory: If set, aggregated stats are periodically written here as
+            pstats files, readable with `python -m pstats <file>`.
+        interval: Seconds between writes to directory.
+    """
+
+    def __init__(self, rate: float = 0, directory: str = '', interval: float = 300):
+        self.rate = rate
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stats: Union[pstats.Stats, None] = None
+        self._sample_count = 0
+        self._last_dump = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    @property
+    def sample_count(self) -> int:
+        return self._sample_count
+
+    def profile(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Calls fn with args, profiling the call if it's picked for sampling.
+        """
+        if not self.enabled or random.random() >= self.rate:
+            return fn(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            self._add(profiler)
+
+    def _add(self, profiler: cProfile.Profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+            self._sample_count += 1
+            if self.directory and time.monotonic() - self._last_dump >= self.interval:
+                self._dump()
+
+    def _dump(self):
+        # Must be called with self._lock held.
+        assert self._stats is not None
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(
+            self.directory, f'query-{os.getpid()}-{int(time.time())}.pstats')
+        self._stats.dump_stats(filename)
+        self._last_dump = time.monotonic()
+
+    def top(self, count: int = 20, sort: str = 'tottime') -> list[dict[str, Union[str, int, float]]]:
+        """
+        Returns the count functions that took the most time across all
+        profiled calls, by their own time (tottime) or including the
+        functions they called (cumtime).
+        """
+        if sort not in LEGAL_PROFILE_SORTS:
+            raise Exception(
+                f'sort {sort} is not one of the legal options: {LEGAL_PROFILE_SORTS}')
+        with self._lock:
+            if self._stats is None:
+                return []
+            # pstats doesn't declare its stats attribute.
+            raw_stats = dict(getattr(self._stats, 'stats'))
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in raw_stats.items():
+            rows.append({
+                'function': f'{filename}:{line}({name})',
+                'calls': calls,
+                'tottime': tottime,
+                'cumtime': cumtime
+            })
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows[:count]
@@ -1,42 +1,298 @@
 import argparse
+import threading
+import time
+
+# Taken before the heavier imports below, for the startup log.
+startup_began = time.perf_counter()
+
 import traceback
 
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request
 from flask_compress import Compress
 from flask_cors import CORS
 
-from typing import Union
+from typing import Iterable, Union
 
 import polymath
-from polymath.config.json import JSONConfigStore
+from polymath.access import access_token_id, add_host_config_listener, get_host_config, is_admin_token, permitted_access
+from polymath.binary import BINARY_MIMETYPE
+from polymath.snapshot import load_snapshot, snapshot_filename
+from polymath.precompute import load_precomputed_queries, precomputed_filename
+from polymath.timing import DeadlineExceeded, StageTimer
 from polymath.config.env import EnvConfigStore
 from polymath.config.types import EnvironmentConfig, HostConfig
 
+from .admission import AdmissionController, Overloaded
+from .catalog import CollectionCatalog, ResultCache
+from .coalesce import SingleFlight, query_key
+from .metrics import METRICS_MIMETYPE, Registry, max_resident_memory_bytes, resident_memory_bytes
+from .profiler import QueryProfiler
+from .slowlog import SlowQueryLog
+from .startup import BackgroundLoader, NotReady
+
 DEFAULT_TOKEN_COUNT = 1000
 
+JSON_MIMETYPE = 'application/json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+startup_timer = StageTimer()
+startup_timer.add('imports', time.perf_counter() - startup_began)
+
 app = Flask(__name__)
+# Query results are streamed, and compressing a stream means buffering all of
+# it first. App Engine's frontend compresses responses for us anyway.
+app.config['COMPRESS_STREAMS'] = False
 CORS(app)
 Compress(app)
 
-env_config = EnvConfigStore().load(EnvironmentConfig)
-host_config = JSONConfigStore().load(HostConfig)
+with startup_timer.stage('config'):
+    env_config = EnvConfigStore().load(EnvironmentConfig)
+    # Loaded now so that a broken host.SECRET.json fails at startup. It's
+    # reloaded when it changes, so always go through get_host_config().
+    get_host_config()
+
+
+def format_timings(timer: StageTimer) -> str:
+    return ', '.join(
+        f'{stage} {duration * 1000:.1f}ms' for stage, duration in timer.durations.items())
+
+
+def load_serving_library(timer: StageTimer, library_filename: str = '', library_dir: str = polymath.LIBRARY_DIR) -> polymath.Library:
+    """
+    Loads the library in library_filename (or in library_dir, if there's no
+    filename) from its snapshot if it's fresh, along with its precomputed
+    queries.
+    """
+    library = None
+    sources = polymath.library_filenames(library_filename, library_dir)
+    if sources:
+        with timer.stage('snapshot'):
+            library = load_snapshot(
+                snapshot_filename(library_filename, library_dir), sources)
+    if library is None:
+        with timer.stage('library'):
+            library = polymath.load_libraries(library_filename, True, library_dir)
+    with timer.stage('precomputed_queries'):
+        load_precomputed_queries(
+            library, precomputed_filename(library_filename, library_dir))
+    library.use_search_threads(int(env_config.search_threads))
+    library.use_search_blocks(int(env_config.search_block_rows))
+    library.use_cursor_cache(
+        int(env_config.cursor_cache_size), float(env_config.cursor_ttl))
+    return library
+
+
+def load_library(timer: StageTimer) -> polymath.Library:
+    library = load_serving_library(timer, env_config.library_filename)
+    ready_after = time.perf_counter() - startup_began
+    print(f'Library loaded ({format_timings(timer)}), ready to query after {ready_after * 1000:.1f}ms', flush=True)
+    return library
+
+
+# Loading the library takes most of startup, so it happens in the background
+# and queries wait for it (up to library_load_timeout). Everything else can be
+# served as soon as the port is bound.
+library_loader = BackgroundLoader(
+    load_library, timeout=float(env_config.library_load_timeout))
+library_results = ResultCache[polymath.Library](int(env_config.result_cache_size))
+
+# Other libraries, served by name and loaded when they're first queried.
+catalog = CollectionCatalog(
+    env_config.collections_dir,
+    lambda library_filename, library_dir: load_serving_library(
+        StageTimer(), library_filename, library_dir),
+    memory_budget=int(float(env_config.collections_memory_budget) * 1024 * 1024),
+    result_cache_size=int(env_config.result_cache_size))
+
+profiler = QueryProfiler(
+    rate=float(env_config.profile_rate),
+    directory=env_config.profile_dir,
+    interval=float(env_config.profile_interval))
+
+admission = AdmissionController(
+    max_concurrent=int(env_config.max_concurrent_queries),
+    max_queued=int(env_config.max_queued_queries),
+    timeout=float(env_config.query_queue_timeout),
+    fair_share=float(env_config.token_fair_share))
+
+# How many seconds a query may take, including waiting for admission, or 0.
+query_timeout = float(env_config.query_timeout)
+
+# Identical queries in flight at the same time share one computation.
+in_flight_queries = SingleFlight[polymath.Library]()
 
-library = polymath.load_libraries(env_config.library_filename, True)
+slow_query_log = SlowQueryLog(
+    threshold=float(env_config.slow_query_threshold),
+    size=int(env_config.slow_query_log_size),
+    filename=env_config.slow_query_log_file)
+
+metrics = Registry()
+request_count = metrics.counter(
+    'polymath_requests_total', 'Number of query requests received.')
+error_count = metrics.counter(
+    'polymath_request_errors_total', 'Number of query requests that returned an error.')
+coalesced_count = metrics.counter(
+    'polymath_requests_coalesced_total', 'Number of query requests answered by an identical query already in flight.')
+cached_count = metrics.counter(
+    'polymath_requests_cached_total', 'Number of query requests answered from the result cache.')
+overloaded_count = metrics.counter(
+    'polymath_requests_overloaded_total', 'Number of query requests rejected because the host was overloaded.')
+request_duration = metrics.histogram(
+    'polymath_request_duration_seconds', 'Time to answer a query request, including serialization.')
+stage_duration = metrics.histogram(
+    'polymath_query_stage_duration_seconds', 'Time spent in each stage of answering a query request.')
+config_reload_count = metrics.counter(
+    'polymath_config_reloads_total', 'Number of times host.SECRET.json was reloaded after it changed.')
+metrics.gauge('polymath_library_ready', 'Whether the library has finished loading.',
+              lambda: 1 if library_loader.ready else 0)
+
+
+def library_bits() -> Union[float, None]:
+    library = library_loader.value
+    return len(library.bits) if library is not None else None
+
+
+def library_embedding_bytes() -> Union[float, None]:
+    library = library_loader.value
+    # Not computed here, since every scrape would go through every bit.
+    return library.embedding_bytes if library is not None else None
+
+
+metrics.gauge('polymath_library_bits', 'Number of bits in the library.',
+              library_bits)
+metrics.gauge('polymath_library_embedding_bytes', 'Bytes used by decoded embeddings.',
+              library_embedding_bytes)
+metrics.gauge('polymath_collections_loaded', 'Number of collections loaded right now.',
+              lambda: len(catalog.loaded))
+metrics.gauge('polymath_collections_memory_bytes', 'Estimated memory used by loaded collections.',
+              lambda: catalog.memory_bytes)
+metrics.gauge('polymath_collections_loads', 'Number of times a collection was loaded.',
+              lambda: catalog.load_count)
+metrics.gauge('polymath_collections_evictions', 'Number of times a collection was evicted to stay within the memory budget.',
+              lambda: catalog.eviction_count)
+metrics.gauge('polymath_queries_running', 'Number of queries running right now.',
+              lambda: admission.stats()['running'])
+metrics.gauge('polymath_queries_waiting', 'Number of queries waiting to be admitted.',
+              lambda: admission.stats()['waiting'])
+metrics.gauge('polymath_process_resident_memory_bytes', 'Resident memory of this process.',
+              resident_memory_bytes)
+metrics.gauge('polymath_process_max_resident_memory_bytes', 'Peak resident memory of this process.',
+              max_resident_memory_bytes)
+
+
+
+def on_host_config_reloaded(host_config: HostConfig):
+    config_reload_count.inc()
+    # Results depend on the config, e.g. on what each token grants.
+    library_results.clear()
+    catalog.clear_results()
+    print(f'Reloaded host config ({len(host_config.tokens)} tokens)', flush=True)
+
+
+add_host_config_listener(on_host_config_reloaded)
+
+startup_timer.add('setup', time.perf_counter() - startup_began - startup_timer.total)
+library_loader.start()
+print(f'Host started ({format_timings(startup_timer)}), loading the library in the background', flush=True)
 
 
 class Endpoint:
-    def __init__(self, library : polymath.Library):
+    def __init__(self, library : polymath.Library, results: ResultCache[polymath.Library], collection: str = ''):
         self.library = library
+        self.results = results
+        self.collection = collection
+        self.timer = StageTimer()
+        self.start = time.perf_counter()
+        self.args = dict[str, Union[str, int]]()
+        self.bits_returned = 0
+        self.response_size = 0
+
+    def _observe(self):
+        duration = time.perf_counter() - self.start
+        for stage, stage_duration_value in self.timer.durations.items():
+            stage_duration.observe(stage_duration_value, stage=stage)
+        request_duration.observe(duration)
+        slow_query_log.record(duration, self.args, {
+            'scored_bits': self.timer.counts.get('scored_bits', 0),
+            'bits_returned': self.bits_returned,
+            'response_size': self.response_size
+        }, self.timer.durations)
+
+    def _serialize(self, chunks: Iterable):
+        # The response is streamed, so serialization happens as the client
+        # reads it. Only time producing each chunk, not sending it.
+        chunks = iter(chunks)
+        while True:
+            with self.timer.stage('serialize'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            self.response_size += len(chunk)
+            yield chunk
+        self._observe()
+
+    def _run_query(self, args: dict[str, Union[str, int]]) -> polymath.Library:
+        token_id = access_token_id(str(args.get('access_token', '')))
+        waiting_since = time.perf_counter()
+        with admission.admit(token_id):
+            self.timer.add('admission', time.perf_counter() - waiting_since)
+            if query_timeout:
+                self.timer.deadline = self.start + query_timeout
+            try:
+                return profiler.profile(self.library.query, args, self.timer)
+            except DeadlineExceeded as e:
+                raise Overloaded(
+                    f'Timed out running the query, retry later ({e})', admission.retry_after)
+            finally:
+                # Serializing the result is timed too, and must not fail.
+                self.timer.deadline = None
 
     def query(self, args: dict[str, Union[str, int]]):
-        result = self.library.query(args)
-        return jsonify(result.serializable())
+        self.args = args
+        # The shared result is only ever read from, so it's safe for each
+        # request to serialize it on its own.
+        key = query_key(args)
+        if key is not None:
+            key = self.collection + '\n' + key
+        with self.timer.stage('cache'):
+            result = self.results.get(key)
+        if result is not None:
+            cached_count.inc()
+        else:
+            result, shared = in_flight_queries.do(
+                key, lambda: self._run_query(args))
+            if shared:
+                coalesced_count.inc()
+            else:
+                self.results.put(key, result)
+        self.bits_returned = len(result.bits)
+        mimetype = request.accept_mimetypes.best_match(
+            [JSON_MIMETYPE, NDJSON_MIMETYPE, BINARY_MIMETYPE], default=JSON_MIMETYPE)
+        # Clients and federated hosts that haven't updated yet get the format
+        # they understand.
+        version = polymath.result_version(args)
+        if mimetype == NDJSON_MIMETYPE:
+            return Response(self._serialize(result.serialized_lines(version=version)), mimetype=NDJSON_MIMETYPE)
+        if mimetype == BINARY_MIMETYPE:
+            embedding_dtype = str(args.get('embedding_dtype', 'float32'))
+            return Response(self._serialize(result.serialized_binary(embedding_dtype, version=version)), mimetype=BINARY_MIMETYPE)
+        return Response(self._serialize(result.serialized_chunks(version=version)), mimetype=JSON_MIMETYPE)
+
+
+def query_endpoint(collection_name: str, args: dict[str, Union[str, int]]) -> Endpoint:
+    if not collection_name:
+        collection_name = str(args.get('library', ''))
+    if not collection_name:
+        return Endpoint(library_loader.get(), library_results)
+    collection = catalog.get(collection_name)
+    return Endpoint(collection.library, collection.results, collection_name)
 
 
 @app.route("/", methods=["POST"])
-def index():
+@app.route("/collections/<collection_name>", methods=["POST"])
+def index(collection_name: str = ''):
+    request_count.inc()
     try:
-        endpoint = Endpoint(library)
         content_type = request.headers.get('Content-Type')
         if (content_type == 'application/json'):
             json = request.json
@@ -44,29 +300,175 @@ def index():
                 return jsonify({
                     "error": "No arguments provided"
                 })
-            return endpoint.query({
+            args = {
                 'count': DEFAULT_TOKEN_COUNT,
                 **json
-            })
+            }
         else:
-            return endpoint.query({
+            args = {
                 'count': DEFAULT_TOKEN_COUNT,
                 **request.form.to_dict()
-            })
+            }
+        return query_endpoint(collection_name, args).query(args)
+
+    except Overloaded as e:
+        overloaded_count.inc()
+        return unavailable(e, e.retry_after, overloaded=True)
+
+    except NotReady as e:
+        return unavailable(e, e.retry_after, overloaded=False)
 
     except Exception as e:
+        error_count.inc()
         return jsonify({
             "error": f"{e}\n{traceback.format_exc()}"
         })
 
 
+def unavailable(error: Exception, retry_after: int, overloaded: bool):
+    response = jsonify({
+        "error": f"{error}",
+        "overloaded": overloaded,
+        "retry_after": retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 @app.route("/", methods=["GET"])
 def render_index():
-    return render_template("query.html", config=host_config)
+    return render_template("query.html", config=get_host_config())
+
+@app.route('/metrics', methods=["GET"])
+def render_metrics():
+    return Response(metrics.render(), mimetype=METRICS_MIMETYPE)
+
+
+@app.route('/ready', methods=["GET"])
+def render_ready():
+    status = {
+        "ready": library_loader.ready,
+        "startup": {
+            stage: round(duration * 1000, 3)
+            for stage, duration in {**startup_timer.durations, **library_loader.timer.durations}.items()
+        }
+    }
+    if library_loader.error is not None:
+        status["error"] = library_loader.error
+    return jsonify(status), 200 if library_loader.ready else 503
+
+
+def is_admin_request() -> bool:
+    supplied_token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not supplied_token:
+        supplied_token = request.args.get('admin_token', '')
+    return is_admin_token(supplied_token)
+
+
+def admin_forbidden():
+    return jsonify({
+        "error": "A valid admin_token is required"
+    }), 403
+
+
+@app.route('/admin/profile', methods=["GET"])
+def render_profile():
+    if not is_admin_request():
+        return admin_forbidden()
+    try:
+        count = int(request.args.get('top', 20))
+        sort = request.args.get('sort', 'tottime')
+        return jsonify({
+            "enabled": profiler.enabled,
+            "rate": profiler.rate,
+            "samples": profiler.sample_count,
+            "functions": profiler.top(count, sort)
+        })
+    except Exception as e:
+        return jsonify({
+            "error": f"{e}"
+        })
+
+
+@app.route('/admin/collections', methods=["GET"])
+def render_collections():
+    if not is_admin_request():
+        return admin_forbidden()
+    return jsonify({
+        "enabled": catalog.enabled,
+        "collections": catalog.names(),
+        "loaded": catalog.loaded,
+        "memory_bytes": catalog.memory_bytes,
+        "memory_budget": catalog.memory_budget,
+        "loads": catalog.load_count,
+        "evictions": catalog.eviction_count
+    })
+
+
+@app.route('/admin/slow_queries', methods=["GET"])
+def render_slow_queries():
+    if not is_admin_request():
+        return admin_forbidden()
+    return jsonify({
+        "enabled": slow_query_log.enabled,
+        "threshold": slow_query_log.threshold,
+        "queries": slow_query_log.entries()
+    })
+
+
+def warm_up() -> dict:
+    """
+    Builds everything queries need up front, so that the first real queries
+    don't pay for it, then runs a synthetic query for each set of access
+    tags a token can grant. Returns a summary of what was prepared.
+    """
+    timer = StageTimer()
+    with timer.stage('load'):
+        # Warmup requests are allowed to take a while, so wait for loading
+        # to finish however long it takes.
+        library = library_loader.get(timeout=None)
+    with timer.stage('prepare'):
+        prepared = library.prepare()
+    # One token for each distinct set of access tags, keyed by what the token
+    # actually permits, so a token without tags shares the anonymous query.
+    access_tokens = {permitted_access(None): ''}
+    for record in get_host_config().tokens.values():
+        access_tokens.setdefault(permitted_access(record.token), record.token)
+    with timer.stage('synthetic_queries'):
+        for access_token in access_tokens.values():
+            library.query({
+                'version': polymath.CURRENT_VERSION,
+                'query_embedding_model': polymath.EMBEDDINGS_MODEL_ID,
+                'count': DEFAULT_TOKEN_COUNT,
+                'access_token': access_token
+            })
+    return {
+        'ready': True,
+        'prepared': {
+            **prepared,
+            'precomputed_queries': len(library.precomputed.queries) if library.precomputed else 0,
+            'synthetic_queries': len(access_tokens)
+        },
+        'timings': {
+            stage: round(duration * 1000, 3)
+            for stage, duration in timer.durations.items()
+        },
+        'duration': round(timer.total * 1000, 3)
+    }
+
+
+warm_up_status = None
+warm_up_lock = threading.Lock()
+
 
 @app.route('/_ah/warmup')
 def warmup():
-    return ('', 204)
+    global warm_up_status
+    with warm_up_lock:
+        if warm_up_status is None:
+            warm_up_status = warm_up()
+    return jsonify(warm_up_status)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -0,0 +1,74 @@
+import collections
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Union
+
+SlowQueryEntry = dict[str, Any]
+
+
+def hash_query_embedding(raw_query_embedding: Union[str, int, None]) -> str:
+    """
+    Returns a short, stable stand-in for a query embedding, so that repeated
+    queries can be spotted without storing what was asked.
+    """
+    if not raw_query_embedding:
+        return ''
+    return hashlib.sha256(str(raw_query_embedding).encode()).hexdigest()[:16]
+
+
+class SlowQueryLog:
+    """
+    Keeps the most recent requests that took longer than a threshold, in a
+    bounded ring buffer and optionally appended to a JSONL file.
+
+    Args:
+        threshold: Requests taking at least this many seconds are recorded.
+            0 disables the log.
+        size: How many entries to keep in memory.
+        filename: If set, every entry is also appended to this file.
+    """
+
+    def __init__(self, threshold: float = 0, size: int = 100, filename: str = ''):
+        self.threshold = threshold
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._entries = collections.deque[SlowQueryEntry](maxlen=size)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def record(self, duration: float, args: dict[str, Union[str, int]], stats: dict[str, int], timings: dict[str, float]) -> bool:
+        """
+        Records the request if it was slow. Returns True if it was recorded.
+        """
+        if not self.enabled or duration < self.threshold:
+            return False
+        entry = {
+            'time': time.time(),
+            'duration': round(duration * 1000, 3),
+            'count': args.get('count'),
+            'count_type': args.get('count_type', 'token'),
+            'omit': args.get('omit', 'embedding'),
+            'query_embedding': hash_query_embedding(args.get('query_embedding')),
+            **stats,
+            'timings': {
+                stage: round(stage_duration * 1000, 3)
+                for stage, stage_duration in timings.items()
+            }
+        }
+        with self._lock:
+            self._entries.append(entry)
+            if self.filename:
+                with open(self.filename, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+        return True
+
+    def entries(self) -> list[SlowQueryEntry]:
+        """
+        Returns the recorded entries, most recent first.
+        """
+        with self._lock:
+            return list(reversed(self._entries))
@@ -0,0 +1,81 @@
+import threading
+import traceback
+from typing import Callable, Generic, TypeVar, Union
+
+from polymath.timing import StageTimer
+
+T = TypeVar('T')
+
+
+class NotReady(Exception):
+    """
+    Raised when a request needs something that is still loading. retry_after
+    is how many seconds the client should wait before trying again.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BackgroundLoader(Generic[T]):
+    """
+    Runs load on a background thread, so that the host can start serving (and
+    answer requests that don't need the result) while it's still running.
+
+    load is passed a StageTimer to record how long each part of loading took.
+
+    Args:
+        load: Produces the value.
+        timeout: How many seconds get() waits for load to finish before
+            raising NotReady.
+        retry_after: The number of seconds rejected clients are told to wait.
+    """
+
+    def __init__(self, load: Callable[[StageTimer], T], timeout: float = 10, retry_after: int = 1):
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.timer = StageTimer()
+        self.error: Union[str, None] = None
+        self._load = load
+        self._value: Union[T, None] = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='background-loader', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._value = self._load(self.timer)
+        except Exception as e:
+            self.error = f'{e}'
+            traceback.print_exc()
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self.error is None
+
+    @property
+    def value(self) -> Union[T, None]:
+        """
+        The loaded value, or None if it isn't ready. Never waits.
+        """
+        return self._value if self.ready else None
+
+    def get(self, timeout: Union[float, None] = -1) -> T:
+        """
+        Returns the loaded value, waiting up to timeout seconds for it (the
+        loader's timeout by default, forever if None).
+        """
+        if timeout is not None and timeout < 0:
+            timeout = self.timeout
+        if not self._done.wait(timeout):
+            raise NotReady('The host is still starting up', self.retry_after)
+        if self.error is not None:
+            raise Exception(f'The host failed to start: {self.error}')
+        assert self._value is not None
+        return self._value
@@ -0,0 +1,86 @@
+import threading
+import time
+from contextlib import ExitStack
+
+import pytest
+
+from host.admission import AdmissionController, Overloaded
+
+
+def test_disabled_admits_everything():
+    controller = AdmissionController()
+    assert not controller.enabled
+    with ExitStack() as stack:
+        for _ in range(100):
+            stack.enter_context(controller.admit())
+    assert controller.stats() == {'running': 0, 'waiting': 0}
+
+
+def test_rejects_when_the_queue_is_full():
+    controller = AdmissionController(max_concurrent=2, max_queued=0, retry_after=3)
+    with ExitStack() as stack:
+        stack.enter_context(controller.admit())
+        stack.enter_context(controller.admit())
+        assert controller.stats() == {'running': 2, 'waiting': 0}
+        with pytest.raises(Overloaded) as error:
+            with controller.admit():
+                pass
+        assert error.value.retry_after == 3
+    assert controller.stats() == {'running': 0, 'waiting': 0}
+    with controller.admit():
+        pass
+
+
+def test_waiting_times_out():
+    controller = AdmissionController(max_concurrent=1, max_queued=1, timeout=0.05)
+    with controller.admit():
+        start = time.monotonic()
+        with pytest.raises(Overloaded, match='Timed out'):
+            with controller.admit():
+                pass
+        assert time.monotonic() - start >= 0.05
+    assert controller.stats() == {'running': 0, 'waiting': 0}
+
+
+def test_waiting_query_runs_when_a_slot_frees_up():
+    controller = AdmissionController(max_concurrent=1, max_queued=1, timeout=10)
+    admitted = threading.Event()
+
+    def wait():
+        with controller.admit():
+            admitted.set()
+    with controller.admit():
+        thread = threading.Thread(target=wait)
+        thread.start()
+        while controller.stats()['waiting'] == 0:
+            time.sleep(0.001)
+        assert not admitted.is_set()
+    thread.join(10)
+    assert admitted.is_set()
+
+
+def test_one_key_cant_take_every_slot():
+    controller = AdmissionController(max_concurrent=4, max_queued=0, fair_share=0.5)
+    assert controller.max_concurrent_per_key == 2
+    with ExitStack() as stack:
+        stack.enter_context(controller.admit('greedy'))
+        stack.enter_context(controller.admit('greedy'))
+        with pytest.raises(Overloaded):
+            with controller.admit('greedy'):
+                pass
+        # Other keys, and queries without one, still get the rest.
+        stack.enter_context(controller.admit('other'))
+        stack.enter_context(controller.admit())
+        with pytest.raises(Overloaded):
+            with controller.admit('other'):
+                pass
+    assert controller._running_by_key == {}
+
+
+def test_released_on_error():
+    controller = AdmissionController(max_concurrent=1)
+    with pytest.raises(ValueError):
+        with controller.admit('key'):
+            raise ValueError()
+    assert controller.stats() == {'running': 0, 'waiting': 0}
+    assert controller._running_by_key == {}
@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from host.catalog import CollectionCatalog, ResultCache
+from polymath.conftest import library_data
+from polymath.library import Library
+
+
+def test_result_cache_evicts_least_recently_used():
+    cache = ResultCache[str](2)
+    cache.put('a', 'A')
+    cache.put('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.put('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert len(cache) == 2
+    # Queries without a key are never cached.
+    cache.put(None, 'D')
+    assert cache.get(None) is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_disabled_result_cache():
+    cache = ResultCache[str](0)
+    cache.put('a', 'A')
+    assert cache.get('a') is None
+
+
+def _catalog(tmp_path, memory_budget: int = 0) -> tuple[CollectionCatalog, list[str]]:
+    for name in ('first', 'second'):
+        with open(os.path.join(tmp_path, name + '.json'), 'w') as f:
+            json.dump(library_data(4), f)
+    os.makedirs(os.path.join(tmp_path, 'third'))
+    with open(os.path.join(tmp_path, 'third', 'part.json'), 'w') as f:
+        json.dump(library_data(4), f)
+    with open(os.path.join(tmp_path, '.hidden.json'), 'w') as f:
+        f.write('{}')
+    loads = []
+
+    def load(library_filename: str, library_dir: str) -> Library:
+        loads.append(library_filename or library_dir)
+        if library_filename:
+            return Library(filename=library_filename)
+        return Library(filename=os.path.join(library_dir, 'part.json'))
+    return CollectionCatalog(str(tmp_path), load, memory_budget, result_cache_size=3), loads
+
+
+def test_collections_are_loaded_once(tmp_path):
+    catalog, loads = _catalog(tmp_path)
+    assert catalog.names() == ['first', 'second', 'third']
+    first = catalog.get('first')
+    assert catalog.get('first') is first
+    assert len(first.library.bits) == 4
+    assert first.results.size == 3
+    assert catalog.get('third').name == 'third'
+    assert loads == [os.path.join(tmp_path, 'first.json'), os.path.join(tmp_path, 'third')]
+    assert catalog.loaded == ['first', 'third']
+    with pytest.raises(Exception, match='Unknown collection'):
+        catalog.get('fourth')
+    with pytest.raises(Exception, match='Illegal collection name'):
+        catalog.get('../first')
+
+
+def test_least_recently_used_collections_are_evicted(tmp_path):
+    catalog, loads = _catalog(tmp_path)
+    # Room for about one collection.
+    catalog.memory_budget = catalog.get('first').memory_bytes
+    catalog.get('second')
+    assert catalog.loaded == ['second']
+    assert catalog.eviction_count == 1
+    catalog.get('first')
+    assert catalog.loaded == ['first']
+    assert catalog.load_count == 3
+    assert len(loads) == 3
+
+
+def test_disabled_catalog():
+    catalog = CollectionCatalog('', lambda filename, directory: Library())
+    assert catalog.names() == []
+    with pytest.raises(Exception):
+        catalog.get('first')
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from host.coalesce import SingleFlight, query_key
+from polymath.config.types import HostConfig
+from polymath.conftest import query_args
+
+
+def test_query_key_only_depends_on_the_result(host_config):
+    host_config(HostConfig({'tokens': {
+        'a@example.com': {'token': 'a', 'access_tags': ['team']},
+        'b@example.com': {'token': 'b', 'access_tags': ['team']},
+        'c@example.com': {'token': 'c', 'access_tags': ['other']},
+    }}))
+    assert query_key(query_args(count=10)) == query_key(query_args(count='10'))
+    assert query_key(query_args(count=10)) != query_key(query_args(count=11))
+    # Tokens granting the same access share results, others don't.
+    assert query_key(query_args(access_token='a')) == query_key(query_args(access_token='b'))
+    assert query_key(query_args(access_token='a')) != query_key(query_args(access_token='c'))
+    assert query_key(query_args(access_token='unknown')) == query_key(query_args())
+    # Queries without an embedding get random bits.
+    assert query_key(query_args(query_embedding='')) is None
+
+
+def test_queries_with_debug_timings_arent_shared():
+    # Their timings are of the run that produced them.
+    assert query_key(query_args(debug_timings='true')) is None
+    assert query_key(query_args(debug_timings='false')) is not None
+
+
+def _run_concurrently(flight: SingleFlight, key, fn, follower_fn):
+    """
+    Calls flight.do(key, fn) on one thread and, once that call is in flight,
+    flight.do(key, follower_fn) on another, then returns what each returned
+    or raised.
+    """
+    started = threading.Event()
+    release = threading.Event()
+    results = {}
+
+    def leader_fn():
+        started.set()
+        release.wait(10)
+        return fn()
+
+    def call(name, fn):
+        try:
+            results[name] = flight.do(key, fn)
+        except Exception as e:
+            results[name] = e
+    leader = threading.Thread(target=call, args=('leader', leader_fn))
+    leader.start()
+    assert started.wait(10)
+    # Let the leader finish once the follower is waiting on it.
+    in_flight = flight._calls[key]
+    wait = in_flight.done.wait
+
+    def follower_waits(timeout=None):
+        release.set()
+        return wait(timeout)
+    in_flight.done.wait = follower_waits
+    follower = threading.Thread(target=call, args=('follower', follower_fn))
+    follower.start()
+    leader.join(10)
+    follower.join(10)
+    return results['leader'], results['follower']
+
+
+def test_concurrent_identical_calls_share_one_result():
+    flight = SingleFlight[list]()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return ['result']
+    leader, follower = _run_concurrently(flight, 'key', fn, fn)
+    assert calls == [1]
+    assert leader == (['result'], False)
+    assert follower[1]
+    assert follower[0] is leader[0]
+    assert flight._calls == {}
+
+
+def test_concurrent_identical_calls_share_errors():
+    flight = SingleFlight[list]()
+
+    def fail():
+        raise ValueError('broken')
+    leader, follower = _run_concurrently(flight, 'key', fail, fail)
+    assert isinstance(leader, ValueError)
+    assert follower is leader
+    # The next call runs again rather than replaying the error.
+    assert flight.do('key', lambda: ['again']) == (['again'], False)
+
+
+def test_calls_without_a_key_are_never_shared():
+    flight = SingleFlight[int]()
+    assert flight.do(None, lambda: 1) == (1, False)
+    assert flight.do(None, lambda: 2) == (2, False)
+    with pytest.raises(KeyError):
+        flight._calls[None]
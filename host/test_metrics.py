@@ -0,0 +1,47 @@
+from host.metrics import METRICS_MIMETYPE, Registry, max_resident_memory_bytes, resident_memory_bytes
+
+
+def test_render_counters_and_gauges():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Number of requests.')
+    requests.inc()
+    requests.inc(2, stage='b', kind='a')
+    value = [1.5]
+    registry.gauge('things', 'Number of things.', lambda: value[0])
+    registry.gauge('missing', 'Not known yet.', lambda: None)
+    assert registry.render() == '\n'.join([
+        '# HELP requests_total Number of requests.',
+        '# TYPE requests_total counter',
+        'requests_total 1.0',
+        'requests_total{kind="a",stage="b"} 2.0',
+        '# HELP things Number of things.',
+        '# TYPE things gauge',
+        'things 1.5',
+        '# HELP missing Not known yet.',
+        '# TYPE missing gauge',
+    ]) + '\n'
+    # Gauges are read at render time.
+    value[0] = 3
+    assert 'things 3.0' in registry.render()
+
+
+def test_render_histograms():
+    registry = Registry()
+    durations = registry.histogram('duration_seconds', 'How long.', buckets=(0.1, 1.0))
+    durations.observe(0.05, stage='a')
+    durations.observe(0.5, stage='a')
+    durations.observe(5, stage='a')
+    assert registry.render().splitlines()[2:] == [
+        'duration_seconds_bucket{stage="a",le="0.1"} 1',
+        'duration_seconds_bucket{stage="a",le="1.0"} 2',
+        'duration_seconds_bucket{stage="a",le="+Inf"} 3',
+        'duration_seconds_sum{stage="a"} 5.55',
+        'duration_seconds_count{stage="a"} 3',
+    ]
+
+
+def test_memory():
+    assert METRICS_MIMETYPE.startswith('text/plain; version=0.0.4')
+    resident = resident_memory_bytes()
+    assert resident is None or resident > 0
+    assert max_resident_memory_bytes() > 0
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from host.profiler import QueryProfiler
+
+
+def _work(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+def test_disabled_profiler_just_calls():
+    profiler = QueryProfiler()
+    assert not profiler.enabled
+    assert profiler.profile(_work, 10) == 285
+    assert profiler.sample_count == 0
+    assert profiler.top() == []
+
+
+def test_samples_at_the_rate(monkeypatch):
+    profiler = QueryProfiler(rate=0.5)
+    draws = iter([0.1, 0.9, 0.4, 0.5])
+    monkeypatch.setattr('host.profiler.random.random', lambda: next(draws))
+    for _ in range(4):
+        assert profiler.profile(_work, 1000) == _work(1000)
+    assert profiler.sample_count == 2
+
+
+def test_top_functions():
+    profiler = QueryProfiler(rate=1)
+    profiler.profile(_work, 10000)
+    profiler.profile(_work, 10000)
+    top = profiler.top(count=50, sort='cumtime')
+    work = [row for row in top if row['function'].endswith('(_work)')]
+    assert len(work) == 1
+    assert work[0]['calls'] == 2
+    assert [row['cumtime'] for row in top] == sorted((row['cumtime'] for row in top), reverse=True)
+    assert len(profiler.top(count=1)) == 1
+    with pytest.raises(Exception):
+        profiler.top(sort='calls')
+
+
+def test_writes_stats_to_directory(tmp_path):
+    directory = os.path.join(tmp_path, 'profiles')
+    profiler = QueryProfiler(rate=1, directory=directory, interval=0)
+    profiler.profile(_work, 10)
+    assert len(os.listdir(directory)) == 1
+    assert os.listdir(directory)[0].endswith('.pstats')
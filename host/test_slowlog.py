@@ -0,0 +1,49 @@
+import json
+import os
+
+from host.slowlog import SlowQueryLog, hash_query_embedding
+
+
+def _record(log: SlowQueryLog, duration: float, count: int) -> bool:
+    return log.record(duration, {'count': count, 'query_embedding': 'AAAA'}, {'scored_bits': 3}, {'sort': 0.0015})
+
+
+def test_disabled_log_records_nothing():
+    log = SlowQueryLog()
+    assert not log.enabled
+    assert not _record(log, 100, 1)
+    assert log.entries() == []
+
+
+def test_keeps_the_most_recent_slow_queries():
+    log = SlowQueryLog(threshold=0.5, size=2)
+    assert not _record(log, 0.1, 1)
+    assert _record(log, 0.5, 2)
+    assert _record(log, 1, 3)
+    assert _record(log, 2, 4)
+    entries = log.entries()
+    assert [entry['count'] for entry in entries] == [4, 3]
+    entry = entries[0]
+    assert entry['duration'] == 2000
+    assert entry['count_type'] == 'token'
+    assert entry['scored_bits'] == 3
+    assert entry['timings'] == {'sort': 1.5}
+    # The embedding itself isn't kept.
+    assert entry['query_embedding'] == hash_query_embedding('AAAA') != 'AAAA'
+
+
+def test_appends_to_file(tmp_path):
+    filename = os.path.join(tmp_path, 'slow.jsonl')
+    log = SlowQueryLog(threshold=1, size=1, filename=filename)
+    _record(log, 1, 1)
+    _record(log, 2, 2)
+    with open(filename) as f:
+        assert [json.loads(line)['count'] for line in f] == [1, 2]
+
+
+def test_hash_query_embedding():
+    assert hash_query_embedding('') == ''
+    assert hash_query_embedding(None) == ''
+    assert hash_query_embedding('a') == hash_query_embedding('a')
+    assert hash_query_embedding('a') != hash_query_embedding('b')
+    assert len(hash_query_embedding('a')) == 16
@@ -0,0 +1,39 @@
+import threading
+
+import pytest
+
+from host.startup import BackgroundLoader, NotReady
+from polymath.timing import StageTimer
+
+
+def test_not_ready_until_loaded():
+    release = threading.Event()
+
+    def load(timer: StageTimer) -> str:
+        with timer.stage('load'):
+            release.wait(10)
+        return 'library'
+    loader = BackgroundLoader(load, timeout=0.01, retry_after=2)
+    loader.start()
+    assert not loader.ready
+    assert loader.value is None
+    with pytest.raises(NotReady) as error:
+        loader.get()
+    assert error.value.retry_after == 2
+    release.set()
+    assert loader.get(timeout=None) == 'library'
+    assert loader.ready
+    assert loader.value == 'library'
+    assert 'load' in loader.timer.durations
+
+
+def test_load_errors_are_reported():
+    def load(timer: StageTimer) -> str:
+        raise ValueError('no library')
+    loader = BackgroundLoader(load)
+    loader.start()
+    with pytest.raises(Exception, match='failed to start: no library'):
+        loader.get(timeout=10)
+    assert not loader.ready
+    assert loader.value is None
+    assert loader.error == 'no library'
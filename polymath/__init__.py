@@ -1,12 +1,21 @@
-from polymath.library import Library, Bit, CURRENT_VERSION, EMBEDDINGS_MODEL_ID
+from polymath.library import Library, Bit, CURRENT_VERSION, EMBEDDINGS_MODEL_ID, result_version
 from polymath.ask_embeddings import (
     LIBRARY_DIR,
     get_embedding,
     get_max_tokens_for_completion_model,
     load_libraries,
+    library_filenames,
     get_token_count,
     get_completion,
     get_completion_with_context,
     ask
 )
-from polymath.access import HOST_CONFIG
+from polymath.access import get_host_config
+
+
+def __getattr__(name: str):
+    # Loaded on first use so that importing polymath doesn't read
+    # host.SECRET.json.
+    if name == 'HOST_CONFIG':
+        return get_host_config()
+    raise AttributeError(f'module {__name__} has no attribute {name}')
@@ -1,34 +1,151 @@
+import secrets
+import threading
+
 from polymath.config.json import JSONConfigStore
 from polymath.config.types import HostConfig
+from polymath.config.watch import WatchedConfig
 
-from typing import Union
+from typing import Callable, NamedTuple, Union
 
 DEFAULT_PRIVATE_ACCESS_TAG = 'unpublished'
 
-HOST_CONFIG = JSONConfigStore().load(HostConfig)
+# How often, in seconds, host.SECRET.json is checked for changes.
+HOST_CONFIG_RELOAD_INTERVAL = 5
+
+NO_ACCESS: frozenset[str] = frozenset()
+
+
+class TokenAccess(NamedTuple):
+    # The key of the token's record in HostConfig.tokens
+    user_id: str
+    access_tags: frozenset[str]
+
 
-def permitted_access(access_token : Union[str, None]) -> set[str]:
+class AccessIndex:
     """
-    Returns the set of permitted access tags
+    Maps each access token in a HostConfig to what it grants, so resolving a
+    token is a single dict lookup however many tokens are configured.
+
+    The access tag sets are frozen and shared between lookups, so callers can
+    use them as dict keys or compare them cheaply.
     """
 
-    if not access_token:
-        return set([])
+    def __init__(self, host_config: HostConfig):
+        private_access_tag = host_config.default_private_access_tag or DEFAULT_PRIVATE_ACCESS_TAG
+        # Equal tag sets share one frozenset.
+        tag_sets = dict[frozenset[str], frozenset[str]]()
+        self._by_token = dict[str, TokenAccess]()
+        for user_id, record in host_config.tokens.items():
+            if not record.token or record.token in self._by_token:
+                # The first record with a given token wins, as it did when
+                # the records were scanned in order.
+                continue
+            tags = frozenset(record.access_tags if record.access_tags else [private_access_tag])
+            tags = tag_sets.setdefault(tags, tags)
+            self._by_token[record.token] = TokenAccess(user_id, tags)
+
+    def __len__(self) -> int:
+        return len(self._by_token)
 
+    def get(self, access_token: Union[str, None]) -> Union[TokenAccess, None]:
+        if not access_token:
+            return None
+        return self._by_token.get(access_token)
 
-    set_default_private_access_tag = HOST_CONFIG.default_private_access_tag
 
-    private_access_tag = set_default_private_access_tag if set_default_private_access_tag else DEFAULT_PRIVATE_ACCESS_TAG
+class _LoadedHostConfig(NamedTuple):
+    config: HostConfig
+    access: AccessIndex
 
-    token_record = None
-    for record in HOST_CONFIG.tokens.values():
-        if record.token == access_token:
-            token_record = record
-            break
 
-    if not token_record:
-        return set([])
+_host_config: Union[_LoadedHostConfig, None] = None
+_host_config_watch: Union[WatchedConfig[HostConfig], None] = None
+_host_config_lock = threading.Lock()
 
-    tags = token_record.access_tags if token_record.access_tags else [private_access_tag]
 
-    return set(tags)
\ No newline at end of file
+def set_host_config(host_config: HostConfig):
+    """
+    Replaces the host config (e.g. after it was reloaded) and rebuilds the
+    index of its tokens.
+    """
+    global _host_config
+    # Swapped in one assignment so readers never see a config with another
+    # config's tokens.
+    _host_config = _LoadedHostConfig(host_config, AccessIndex(host_config))
+
+
+def _watch_host_config() -> WatchedConfig[HostConfig]:
+    global _host_config_watch
+    if _host_config_watch is None:
+        with _host_config_lock:
+            if _host_config_watch is None:
+                watch = JSONConfigStore().watch(
+                    HostConfig, interval=HOST_CONFIG_RELOAD_INTERVAL)
+                watch.add_listener(set_host_config)
+                set_host_config(watch.get())
+                _host_config_watch = watch
+    return _host_config_watch
+
+
+def _loaded_host_config() -> _LoadedHostConfig:
+    # Reloads host.SECRET.json (and calls set_host_config) if it changed.
+    _watch_host_config().get()
+    assert _host_config is not None
+    return _host_config
+
+
+def get_host_config() -> HostConfig:
+    """
+    Returns the host config, reading host.SECRET.json the first time it's
+    needed rather than when this module is imported, and again whenever it
+    changes.
+    """
+    return _loaded_host_config().config
+
+
+def add_host_config_listener(listener: Callable[[HostConfig], None]):
+    """
+    Calls listener with the new host config whenever host.SECRET.json is
+    reloaded.
+    """
+    _watch_host_config().add_listener(listener)
+
+
+def __getattr__(name: str):
+    # HOST_CONFIG used to be loaded at import; keep it available by name.
+    if name == 'HOST_CONFIG':
+        return get_host_config()
+    raise AttributeError(f'module {__name__} has no attribute {name}')
+
+
+def permitted_access(access_token : Union[str, None]) -> frozenset[str]:
+    """
+    Returns the set of permitted access tags
+    """
+    token_access = _loaded_host_config().access.get(access_token)
+    if not token_access:
+        return NO_ACCESS
+    return token_access.access_tags
+
+
+def access_token_id(access_token: Union[str, None]) -> Union[str, None]:
+    """
+    Returns the id (the key in HostConfig.tokens) of the user an access token
+    belongs to, or None if it's not a known token.
+    """
+    token_access = _loaded_host_config().access.get(access_token)
+    if not token_access:
+        return None
+    return token_access.user_id
+
+
+def is_admin_token(token: str) -> bool:
+    """
+    Returns whether token is the host's admin_token. Always False if the
+    host has none.
+    """
+    admin_token = get_host_config().admin_token
+    if not admin_token or not token:
+        return False
+    # compare_digest only takes ASCII strs, but any bytes.
+    return secrets.compare_digest(token.encode(), admin_token.encode())
@@ -1,10 +1,8 @@
 import glob
 import os
+import threading
 from time import sleep
 
-import openai
-from transformers import GPT2TokenizerFast
-
 from typing import Any
 
 from .library import Library
@@ -14,6 +12,12 @@ COMPLETION_MODEL_NAME = "text-davinci-003"
 LIBRARY_DIR = 'libraries'
 SAMPLE_LIBRARIES_FILE = 'sample-content.json'
 
+# openai and transformers are slow to import and most users of this package
+# (like the host) never call into them, so they're imported where they're
+# used.
+_tokenizer: Any = None
+_tokenizer_lock = threading.Lock()
+
 
 def get_max_tokens_for_completion_model(completion_model_id=COMPLETION_MODEL_NAME):
     if completion_model_id == "text-davinci-003":
@@ -26,6 +30,7 @@ def get_embedding_model_name_from_id(model_id):
 
 
 def get_embedding(text, model_id=Library.EMBEDDINGS_MODEL_ID):
+    import openai
     # Occasionally, API returns an error.
     # Retry a few times before giving up.
     retry_count = 10
@@ -49,12 +54,22 @@ def get_embedding(text, model_id=Library.EMBEDDINGS_MODEL_ID):
         return result["data"][0]["embedding"]
 
 
-def load_default_libraries(fail_on_empty=False) -> Library:
-    files = glob.glob(os.path.join(LIBRARY_DIR, '**/*.json'), recursive=True)
+def library_filenames(file=None, directory=LIBRARY_DIR) -> list[str]:
+    """
+    Returns the library files that load_libraries(file, directory=directory)
+    reads, or an empty list if it would fall back to the sample library.
+    """
+    if file:
+        return [file]
+    return glob.glob(os.path.join(directory, '**/*.json'), recursive=True)
+
+
+def load_default_libraries(fail_on_empty=False, directory=LIBRARY_DIR) -> Library:
+    files = library_filenames(directory=directory)
     if len(files):
         return load_multiple_libraries(files)
     if fail_on_empty:
-        raise Exception('No libraries were in the default library directory.')
+        raise Exception(f'No libraries were in {directory}.')
     return Library(filename=SAMPLE_LIBRARIES_FILE)
 
 
@@ -63,10 +78,10 @@ def load_libraries_in_directory(directory) -> Library:
     return load_multiple_libraries(files)
 
 
-def load_libraries(file=None, fail_on_empty=False) -> Library:
+def load_libraries(file=None, fail_on_empty=False, directory=LIBRARY_DIR) -> Library:
     if file:
         return Library(filename=file)
-    return load_default_libraries(fail_on_empty)
+    return load_default_libraries(fail_on_empty, directory)
 
 
 def load_multiple_libraries(library_file_names) -> Library:
@@ -74,12 +89,23 @@ def load_multiple_libraries(library_file_names) -> Library:
     for file in library_file_names:
         library = Library(filename=file)
         result.extend(library)
+        # Each file is clustered on its own for centroid routing.
+        result.add_shard([bit.id for bit in library.bits])
     return result
 
 
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                from transformers import GPT2TokenizerFast
+                _tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
+    return _tokenizer
+
+
 def get_token_count(text):
-    tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
-    return len(tokenizer.tokenize(text))
+    return len(get_tokenizer().tokenize(text))
 
 
 def get_max_answer_length(prompt, completion_model=COMPLETION_MODEL_NAME):
@@ -89,6 +115,7 @@ def get_max_answer_length(prompt, completion_model=COMPLETION_MODEL_NAME):
 
 
 def get_completion(prompt, answer_length=None, completion_model=COMPLETION_MODEL_NAME):
+    import openai
     if answer_length is None:
         answer_length = get_max_answer_length(prompt, completion_model=completion_model)
     # TODO: type this better
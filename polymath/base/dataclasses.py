@@ -11,15 +11,13 @@ def empty(factory):
 
 
 def is_a_dataclass_dict(type):
-    if not inspect.isclass(type):
-        return False
-    is_a_dict_subclass = False
+    # dict[str, SomeConfig] is a types.GenericAlias, which inspect.isclass()
+    # doesn't consider a class since Python 3.11, so go by its origin.
     origin = typing.get_origin(type)
     args = typing.get_args(type)
-    if origin is dict:
-        if all(issubclass(arg, object) for arg in args):
-            is_a_dict_subclass = True
-    return is_a_dict_subclass and is_dataclass(args[1])
+    if origin is not dict or len(args) != 2:
+        return False
+    return inspect.isclass(args[1]) and is_dataclass(args[1])
     
 
 def omit_empties_factory(items):
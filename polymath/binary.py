@@ -0,0 +1,96 @@
+import json
+import struct
+from typing import Iterator, Union, cast
+
+import numpy as np
+
+from .types import BitData, LibraryData
+
+# A compact alternative to the JSON library format, used on the wire when a
+# client asks for it with an Accept header of BINARY_MIMETYPE.
+#
+# The layout (all integers little-endian) is:
+#
+#   magic        4 bytes, b'PLMB'
+#   version      uint16
+#   dtype        uint8, one of _DTYPE_CODES
+#   reserved     uint8
+#   header_len   uint32
+#   header       header_len bytes of UTF-8 JSON: the library data, with every
+#                bit's embedding removed.
+#   rows         uint32
+#   dims         uint32
+#   embeddings   rows * dims raw floats of dtype, one row per bit in order.
+#
+# Either every bit has a row, or (when embeddings are omitted) rows is 0.
+
+BINARY_MIMETYPE = 'application/x-polymath-library'
+
+BINARY_MAGIC = b'PLMB'
+BINARY_VERSION = 1
+
+LEGAL_EMBEDDING_DTYPES = set(['float32', 'float16'])
+
+_DTYPE_CODES = {
+    'float32': 1,
+    'float16': 2
+}
+
+_PREAMBLE = struct.Struct('<4sHBBI')
+_SHAPE = struct.Struct('<II')
+
+
+def encode_library_data(header: LibraryData, bits: list[BitData], embeddings: Union[np.ndarray, None], dtype: str = 'float32') -> Iterator[bytes]:
+    """
+    Yields the binary encoding of a library, given its header fields (all but
+    bits), its bits and a matrix of their embeddings (or None if they were
+    omitted).
+    """
+    header = {
+        **header,
+        'bits': [
+            {key: value for key, value in bit.items() if key != 'embedding'}
+            for bit in bits
+        ]
+    }
+    header_bytes = json.dumps(header).encode()
+    yield _PREAMBLE.pack(BINARY_MAGIC, BINARY_VERSION, _DTYPE_CODES[dtype], 0, len(header_bytes))
+    yield header_bytes
+    if embeddings is None:
+        yield _SHAPE.pack(0, 0)
+        return
+    rows, dims = embeddings.shape
+    yield _SHAPE.pack(rows, dims)
+    yield embeddings.astype(f'<{np.dtype(dtype).str[1:]}', copy=False).tobytes()
+
+
+def decode_library_data(blob: bytes) -> LibraryData:
+    """
+    Returns library data from its binary encoding. Embeddings are placed in
+    each bit as float32 arrays rather than base64 strings.
+    """
+    view = memoryview(blob)
+    magic, version, dtype_code, _, header_len = _PREAMBLE.unpack_from(view, 0)
+    if magic != BINARY_MAGIC:
+        raise Exception('Not a binary polymath library')
+    if version != BINARY_VERSION:
+        raise Exception(f'Unsupported binary library version {version}')
+    offset = _PREAMBLE.size
+    data = cast(LibraryData, json.loads(bytes(view[offset:offset + header_len])))
+    offset += header_len
+    rows, dims = _SHAPE.unpack_from(view, offset)
+    offset += _SHAPE.size
+    if not rows:
+        return data
+    dtypes = {code: name for name, code in _DTYPE_CODES.items()}
+    if dtype_code not in dtypes:
+        raise Exception(f'Unknown embedding dtype code {dtype_code}')
+    dtype = np.dtype(dtypes[dtype_code]).newbyteorder('<')
+    embeddings = np.frombuffer(view, dtype=dtype, count=rows * dims, offset=offset)
+    embeddings = embeddings.reshape(rows, dims).astype(np.float32)
+    bits = cast(list[BitData], data['bits'])
+    if len(bits) != rows:
+        raise Exception(f'Expected {len(bits)} embeddings but got {rows}')
+    for bit, embedding in zip(bits, embeddings):
+        bit['embedding'] = embedding
+    return data
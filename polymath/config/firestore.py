@@ -2,6 +2,8 @@ from typing import Union, TypeVar, Callable
 
 from google.cloud import firestore
 
+from .watch import WatchedConfig
+
 T = TypeVar('T', bound=Callable)
 
 class FirestoreConfigStore:
@@ -17,3 +19,20 @@ class FirestoreConfigStore:
         ref = self._client.document(path)
         config = ref.get().to_dict()
         return config_type(config)
+
+    def watch(self, config_type: T, path: Union[str, None] = None, ttl: float = 60) -> WatchedConfig[T]:
+        """
+        Returns a view of the config that refetches the document once it's
+        older than ttl seconds, and only reloads it if it was updated.
+        """
+        if path is None:
+            path = self.default(config_type)
+        ref = self._client.document(path)
+
+        def revalidate(version):
+            snapshot = ref.get()
+            if version is not None and snapshot.update_time == version:
+                return None
+            return (snapshot.update_time, config_type(snapshot.to_dict()))
+
+        return WatchedConfig(revalidate, ttl)
@@ -2,6 +2,8 @@ import json
 import os
 from typing import Any, Union, TypeVar, Callable
 
+from .watch import WatchedConfig
+
 T = TypeVar('T', bound=Callable)
 
 class JSONConfigStore:
@@ -9,15 +11,24 @@ class JSONConfigStore:
         self._cache = {}
         self.path = path
 
+    def _version(self, location: str) -> Union[tuple[int, int], None]:
+        try:
+            stat = os.stat(location)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
     def _load(self, filename: str) -> Any:
         location = os.path.join(self.path, filename)
-        if location in self._cache:
-            return self._cache[location]
-        if not os.path.exists(location):
+        version = self._version(location)
+        if version is None:
             return {}
+        cached = self._cache.get(location)
+        if cached and cached[0] == version:
+            return cached[1]
         with open(location, 'r') as f:
             result = json.load(f)
-        self._cache[location] = result
+        self._cache[location] = (version, result)
         return result
 
     def default(self, config_type) -> str:
@@ -32,6 +43,25 @@ class JSONConfigStore:
         config = self._load(filename)
         return config_type(config)
 
+    def watch(self, config_type: T, filename: Union[str, None] = None, interval: float = 5) -> WatchedConfig[T]:
+        """
+        Returns a view of the config that is reloaded when the file's
+        modification time changes, checked at most every interval seconds.
+        """
+        if filename is None:
+            filename = self.default(config_type)
+        location = os.path.join(self.path, filename)
+
+        def revalidate(version):
+            # A missing file has a version too, so that it isn't reloaded on
+            # every check.
+            current_version = self._version(location) or ()
+            if version is not None and current_version == version:
+                return None
+            return (current_version, config_type(self._load(filename)))
+
+        return WatchedConfig(revalidate, interval)
+
     def save(self, config: Any, filename: Union[str, None] = None) -> None:
         config_type = type(config)
         if filename is None:
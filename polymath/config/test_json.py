@@ -19,3 +19,47 @@ def test_save(tmp_path):
     assert os.path.exists(location)
     with open(location) as f:
         assert f.read() == '{\n    "bar": "simple",\n    "baz": 42\n}'
+
+
+@config
+class EntryConfig:
+    name: str = ''
+
+
+@config(id='test_entries')
+class EntriesConfig:
+    entries: dict[str, EntryConfig] = empty(dict)
+
+
+def test_load_dataclass_dict(tmp_path):
+    location = os.path.join(tmp_path, 'test_entries.SECRET.json')
+    with open(location, 'w') as f:
+        f.write('{"entries": {"a": {"name": "first"}}}')
+    config = JSONConfigStore(tmp_path).load(EntriesConfig)
+    assert isinstance(config.entries['a'], EntryConfig)
+    assert config.entries['a'].name == 'first'
+
+
+def test_watch(tmp_path):
+    location = os.path.join(tmp_path, 'test.SECRET.json')
+    with open(location, 'w') as f:
+        f.write('{"bar": "first"}')
+    watched = JSONConfigStore(tmp_path).watch(Config, interval=0)
+    reloaded = []
+    watched.add_listener(reloaded.append)
+    assert watched.get().bar == 'first'
+    assert not watched.refresh()
+
+    with open(location, 'w') as f:
+        f.write('{"bar": "second"}')
+    # Make sure the change is visible even on a coarse-grained filesystem clock.
+    stat = os.stat(location)
+    os.utime(location, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert watched.get().bar == 'second'
+    assert [config.bar for config in reloaded] == ['second']
+
+    with open(location, 'w') as f:
+        f.write('{"bar": ')
+    os.utime(location, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+    # A broken file keeps the last good config.
+    assert watched.get().bar == 'second'
@@ -22,9 +22,47 @@ class EnvironmentConfig:
     Attributes:
         openai_api_key: The OpenAI API key to use
         library_filename: The filename of the Polymath library to use
+        profile_rate: The fraction (0 to 1) of queries to profile with cProfile. 0 disables profiling.
+        profile_dir: A directory to periodically write the aggregated profile to, as pstats files
+        profile_interval: How many seconds to wait between writes to profile_dir
+        slow_query_threshold: Queries taking at least this many seconds are kept in the slow query log. 0 disables the log.
+        slow_query_log_size: How many slow queries to keep in memory
+        slow_query_log_file: A JSONL file to also append slow queries to
+        max_concurrent_queries: How many queries may run at once in this process. 0 means no limit.
+        max_queued_queries: How many queries may wait for a free slot before further ones are rejected as overloaded
+        query_queue_timeout: How many seconds a query may wait for a free slot before it's rejected as overloaded
+        query_timeout: How many seconds a query may take, waiting for a slot included, before it's rejected as overloaded. Checked between the stages of a query, so a stage that's running finishes first. 0 means no limit
+        token_fair_share: The fraction of max_concurrent_queries that a single access token may use at once
+        library_load_timeout: How many seconds a query waits for the library to finish loading at startup before it's rejected
+        collections_dir: A directory of library files and directories of library files, each served as a collection named after it
+        collections_memory_budget: How many megabytes loaded collections may take before the least recently used are evicted. 0 means no limit
+        result_cache_size: How many query results to keep for each collection (and the default library). 0 disables caching
+        search_threads: How many threads score each query against a large library, each taking a shard of its embeddings. 1 scores on the query's own thread
+        search_block_rows: Score queries this many embeddings at a time, releasing each block of a memory-mapped snapshot once it's scored, so libraries larger than memory can be served. 0 scores them all at once
+        cursor_cache_size: How many rankings of paginated queries to keep for each collection (and the default library), so their later pages don't score the library again
+        cursor_ttl: How many seconds a paginated query's ranking is kept after its last page was requested
     '''
     openai_api_key: str
     library_filename: str = ''
+    profile_rate: float = 0
+    profile_dir: str = ''
+    profile_interval: float = 300
+    slow_query_threshold: float = 0
+    slow_query_log_size: int = 100
+    slow_query_log_file: str = ''
+    max_concurrent_queries: int = 0
+    max_queued_queries: int = 0
+    query_queue_timeout: float = 5
+    query_timeout: float = 0
+    token_fair_share: float = 1
+    library_load_timeout: float = 10
+    collections_dir: str = ''
+    collections_memory_budget: float = 0
+    result_cache_size: int = 100
+    search_threads: int = 1
+    search_block_rows: int = 0
+    cursor_cache_size: int = 32
+    cursor_ttl: float = 600
 
 
 @config
@@ -123,6 +161,7 @@ class HostConfig:
         default_api_key: The default API key to use for this host
         info: Query page custom parameters
         tokens: Restricted access tokens
+        admin_token: The secret token that grants access to the /admin endpoints. If not set, they are disabled.
     '''
     endpoint: str = ''
     default_private_access_tag: str = ''
@@ -131,6 +170,7 @@ class HostConfig:
     info: InfoConfig = empty(InfoConfig)
     tokens: dict[str, TokenConfig] = empty(dict)
     completions_options: CompletionsOptionsConfig = empty(CompletionsOptionsConfig)
+    admin_token: str = ''
 
 
 @config
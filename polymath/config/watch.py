@@ -0,0 +1,72 @@
+import threading
+import time
+import traceback
+from typing import Any, Callable, Generic, TypeVar, Union
+
+T = TypeVar('T')
+
+# Given the version of the config that was last loaded (None the first time),
+# returns the current version and config if it changed, or None if it didn't.
+Revalidate = Callable[[Any], Union[tuple[Any, T], None]]
+
+
+class WatchedConfig(Generic[T]):
+    """
+    A cached view of a config in a store, which is checked for changes at
+    most once every interval seconds and reloaded when it changed.
+
+    Listeners are called with the new config after every reload, so that
+    anything derived from it (like the map of access tokens) can be rebuilt.
+
+    Created by a store's watch() method rather than directly.
+    """
+
+    def __init__(self, revalidate: Revalidate[T], interval: float):
+        self.interval = interval
+        self._revalidate = revalidate
+        self._listeners = list[Callable[[T], None]]()
+        self._lock = threading.Lock()
+        loaded = revalidate(None)
+        if loaded is None:
+            raise Exception('Config could not be loaded')
+        self._version, self._config = loaded
+        self._checked = time.monotonic()
+
+    def add_listener(self, listener: Callable[[T], None]):
+        self._listeners.append(listener)
+
+    def get(self) -> T:
+        """
+        Returns the config, reloading it first if it's due to be checked and
+        has changed.
+        """
+        if time.monotonic() - self._checked >= self.interval:
+            self.refresh()
+        return self._config
+
+    def refresh(self) -> bool:
+        """
+        Checks for changes now. Returns True if the config was reloaded.
+
+        If another thread is already checking, returns right away instead of
+        waiting for it. If the new config can't be loaded (e.g. the file is
+        half-written), the old one is kept.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked = time.monotonic()
+            try:
+                loaded = self._revalidate(self._version)
+            except Exception:
+                traceback.print_exc()
+                return False
+            if loaded is None:
+                return False
+            self._version, self._config = loaded
+            listeners = list(self._listeners)
+        finally:
+            self._lock.release()
+        for listener in listeners:
+            listener(self._config)
+        return True
@@ -0,0 +1,82 @@
+from typing import Callable, Sequence, Union
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from polymath import access
+from polymath.config.types import HostConfig
+from polymath.library import EMBEDDINGS_MODEL_ID, EXPECTED_EMBEDDING_LENGTH, Library, base64_from_embedding
+
+# Helpers shared by the tests of the library. Import them from here.
+
+DIMS = EXPECTED_EMBEDDING_LENGTH[EMBEDDINGS_MODEL_ID]
+
+
+def random_embedding(rng: np.random.Generator) -> NDArray[np.float32]:
+    return rng.standard_normal(DIMS).astype(np.float32)
+
+
+def library_data(count: int = 0, seed: int = 0, embeddings: Union[Sequence[NDArray[np.float32]], None] = None, bit: Callable[[int], dict] = lambda i: {}, **fields) -> dict:
+    """
+    Returns the data of a library with count bits, or one per embedding if
+    embeddings are given (otherwise they're random, from seed). Bit i has the
+    text 'bit i', 10 tokens and the url https://example.com/i, and whatever
+    else (or instead) bit(i) returns. fields are added to the library's.
+    """
+    rng = np.random.default_rng(seed)
+    if embeddings is None:
+        embeddings = [random_embedding(rng) for _ in range(count)]
+    return {
+        'version': Library.CURRENT_VERSION,
+        'embedding_model': EMBEDDINGS_MODEL_ID,
+        **fields,
+        'bits': [{
+            'text': f'bit {i}',
+            'token_count': 10,
+            'embedding': base64_from_embedding(embedding),
+            'info': {'url': f'https://example.com/{i}'},
+            **bit(i)
+        } for i, embedding in enumerate(embeddings)]
+    }
+
+
+def make_library(count: int = 0, seed: int = 0, embeddings: Union[Sequence[NDArray[np.float32]], None] = None, bit: Callable[[int], dict] = lambda i: {}, **fields) -> Library:
+    """
+    Returns a library with the data library_data() returns for the same
+    arguments.
+    """
+    return Library(data=library_data(count, seed, embeddings, bit, **fields))
+
+
+def query_args(query_embedding: Union[NDArray[np.float32], str, None] = None, seed: int = 1, **args) -> dict:
+    """
+    Returns the arguments of a query for 5 bits, with query_embedding (or a
+    random one from seed, if it's None) and whatever else is in args.
+    """
+    if query_embedding is None:
+        query_embedding = random_embedding(np.random.default_rng(seed))
+    if not isinstance(query_embedding, str):
+        query_embedding = base64_from_embedding(query_embedding)
+    return {
+        'version': Library.CURRENT_VERSION,
+        'query_embedding_model': EMBEDDINGS_MODEL_ID,
+        'query_embedding': query_embedding,
+        'count': 5,
+        'count_type': 'bit',
+        **args
+    }
+
+
+@pytest.fixture(autouse=True)
+def host_config(monkeypatch):
+    """
+    Gives each test a default HostConfig instead of whatever
+    host.SECRET.json is in the working directory. Tests can call the fixture
+    with another config to use that instead.
+    """
+    def use(config: HostConfig):
+        loaded = access._LoadedHostConfig(config, access.AccessIndex(config))
+        monkeypatch.setattr(access, '_loaded_host_config', lambda: loaded)
+    use(HostConfig())
+    return use
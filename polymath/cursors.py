@@ -0,0 +1,91 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+# A cursor lets a client page through the results of a query without the
+# library scoring every bit again for each page. The first query with
+# paginate ranks every bit the client can see and keeps that ranking for a
+# while; the result's details.cursor then names the ranking and where the
+# next page starts in it.
+
+# How many seconds a ranking is kept after it was last used.
+CURSOR_TTL = 600
+
+# How many rankings each library keeps. The least recently used are evicted
+# first.
+CURSOR_CACHE_SIZE = 32
+
+
+class Ranking(NamedTuple):
+    # The rows of the library's embedding index, most similar first.
+    rows: NDArray[np.int64]
+    similarities: NDArray[np.float32]
+    # The access tags that the query's access_token granted. Only queries
+    # that are granted the same ones may continue it.
+    access_tags: frozenset[str]
+    # The sort of the pages, e.g. 'hybrid' for a ranking that isn't by
+    # similarity alone.
+    sort: str = 'similarity'
+
+
+class RankingCache:
+    """
+    Keeps the rankings of paginated queries, each under a random key, for
+    ttl seconds after they were last used and up to size of them.
+    """
+
+    def __init__(self, size: int = CURSOR_CACHE_SIZE, ttl: float = CURSOR_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Key to (ranking, time it expires)
+        self._rankings = OrderedDict[str, tuple[Ranking, float]]()
+
+    def __len__(self) -> int:
+        return len(self._rankings)
+
+    def put(self, ranking: Ranking) -> str:
+        key = secrets.token_urlsafe(12)
+        with self._lock:
+            self._rankings[key] = (ranking, time.monotonic() + self.ttl)
+            while len(self._rankings) > max(self.size, 1):
+                self._rankings.popitem(last=False)
+        return key
+
+    def get(self, key: str) -> Union[Ranking, None]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._rankings.get(key)
+            if entry is None:
+                return None
+            ranking, expires = entry
+            if expires < now:
+                del self._rankings[key]
+                return None
+            self._rankings[key] = (ranking, now + self.ttl)
+            self._rankings.move_to_end(key)
+            return ranking
+
+    def clear(self):
+        with self._lock:
+            self._rankings.clear()
+
+
+def encode_cursor(key: str, offset: int) -> str:
+    return f'{key}.{offset}'
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """
+    Returns the key of the ranking a cursor continues, and the position in
+    it of the next page.
+    """
+    key, _, offset = cursor.rpartition('.')
+    if not key or not offset.isdigit():
+        raise Exception(f'Invalid cursor: {cursor}')
+    return key, int(offset)
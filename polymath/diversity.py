@@ -0,0 +1,102 @@
+import numpy as np
+from numpy.typing import NDArray
+
+# Long pages are split into many bits that are all similar to a query, and to
+# each other, so the most similar bits are often several chunks that say the
+# same thing. Diversity reranking trades a little similarity for bits that
+# add something the bits before them don't, and collapsing (below) drops the
+# bits that add nothing.
+#
+# Maximal marginal relevance (MMR) reranks the most similar candidates one
+# pick at a time: each pick is the candidate with the best
+#
+#   lambda * similarity to the query - (1 - lambda) * max similarity to the
+#   candidates already picked
+#
+# so lambda 1 is plain similarity order and lambda 0 only cares about being
+# unlike the bits already picked.
+
+MMR_LAMBDA = 0.5
+
+# How many of the most similar bits are reranked.
+MMR_CANDIDATES = 50
+
+
+def _normalized(embeddings: NDArray[np.float32]) -> NDArray[np.float32]:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms > 0, norms, 1)
+
+
+def mmr_order(embeddings: NDArray[np.float32], query_embedding: NDArray[np.float32], mmr_lambda: float = MMR_LAMBDA) -> NDArray[np.int64]:
+    """
+    Returns the order in which MMR picks the candidates with embeddings
+    (sorted most similar first, which breaks ties), given the query's
+    embedding.
+    """
+    count = len(embeddings)
+    if count <= 1:
+        return np.arange(count, dtype=np.int64)
+    candidates = _normalized(embeddings)
+    query_norm = float(np.linalg.norm(query_embedding))
+    relevance = candidates @ (query_embedding / query_norm if query_norm else query_embedding)
+    # Every pairwise similarity at once, rather than one pair at a time.
+    similarities = candidates @ candidates.T
+    max_similarity = np.full(count, -np.inf, dtype=np.float32)
+    picked = np.zeros(count, dtype=np.bool_)
+    order = np.zeros(count, dtype=np.int64)
+    for position in range(count):
+        if position == 0:
+            # Nothing has been picked yet, so the first pick is the most
+            # relevant.
+            scores = relevance.copy()
+        else:
+            scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[picked] = -np.inf
+        pick = int(np.argmax(scores))
+        order[position] = pick
+        picked[pick] = True
+        max_similarity = np.maximum(max_similarity, similarities[pick])
+    return order
+
+
+# Collapsing drops bits that would add little to a result: near-duplicates of
+# a bit ranked before them (e.g. the same page from a mirror, which has a
+# different id), and bits of a url that already has enough bits before them.
+# Only the first COLLAPSE_CANDIDATES bits of a ranking are collapsed.
+
+COLLAPSE_CANDIDATES = 200
+
+
+def collapse_mask(embeddings: NDArray[np.float32], url_codes: NDArray[np.int64], max_similarity: float = 0, per_url: int = 0) -> NDArray[np.bool_]:
+    """
+    Given the embeddings and url codes (-1 for no url) of some ranked bits,
+    returns which of them to keep: those whose similarity to every kept bit
+    ranked before them is at most max_similarity (if given), and the first
+    per_url (if given) of those with each url.
+    """
+    count = len(embeddings)
+    keep = np.ones(count, dtype=np.bool_)
+    if max_similarity and count > 1:
+        candidates = _normalized(embeddings)
+        # duplicates[i, j] is whether bit j is too similar to the bit i
+        # ranked before it.
+        duplicates = np.triu(candidates @ candidates.T > max_similarity, k=1)
+        # A bit is kept if no kept bit before it is a duplicate. Whether a
+        # bit is kept only depends on the bits before it, so updating every
+        # bit at once settles, front to back, in at most count rounds.
+        for _ in range(count):
+            updated = ~(duplicates & keep[:, None]).any(axis=0)
+            if np.array_equal(updated, keep):
+                break
+            keep = updated
+    if per_url > 0:
+        kept = np.nonzero(keep & (url_codes >= 0))[0]
+        codes = url_codes[kept]
+        # How many kept bits with the same url come before each one.
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        group_starts = np.searchsorted(sorted_codes, sorted_codes, side='left')
+        occurrences = np.empty(len(kept), dtype=np.int64)
+        occurrences[order] = np.arange(len(kept)) - group_starts
+        keep[kept[occurrences >= per_url]] = False
+    return keep
@@ -0,0 +1,122 @@
+import bisect
+import re
+from typing import List, Union
+from urllib.parse import urlparse
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Filters restrict a query to the bits whose info matches, e.g. the pages of
+# one site. Each filter is looked up in an inverted index from a field of the
+# bits' infos to the rows of the library's embedding index that have it, so a
+# filtered query only scores the rows that match, rather than scoring
+# everything and throwing most of it away.
+#
+# The query arguments, and what a bit's info must have to match:
+#
+#   filter_url_prefix  A url that starts with the value
+#   filter_hostname    A url on that host (case-insensitive)
+#   filter_title       A title with every word of the value (case-insensitive)
+#
+# A query with several filters gets the bits that match all of them.
+
+FILTER_ARGUMENTS = ('filter_url_prefix', 'filter_hostname', 'filter_title')
+
+_WORD = re.compile(r'\w+')
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _hostname(url: str) -> str:
+    try:
+        return urlparse(url).hostname or ''
+    except ValueError:
+        return ''
+
+
+def _postings(rows_by_key: dict[str, List[int]]) -> dict[str, NDArray[np.int64]]:
+    return {key: np.array(rows, dtype=np.int64) for key, rows in rows_by_key.items()}
+
+
+class InfoIndex:
+    """
+    The inverted indexes of the infos of the bits in each row of a library's
+    embedding matrix, built by Library._info_index().
+
+    Args:
+        urls: The info.url of each row's bit.
+        titles: The info.title of each row's bit.
+    """
+
+    def __init__(self, urls: List[str], titles: List[str]):
+        self.row_count = len(urls)
+        by_url = dict[str, List[int]]()
+        url_codes = dict[str, int]()
+        row_url_codes = []
+        by_hostname = dict[str, List[int]]()
+        by_word = dict[str, List[int]]()
+        # Bits of the same page share their info, so each distinct url and
+        # title is only parsed once.
+        hostnames = dict[str, str]()
+        title_words = dict[str, List[str]]()
+        for row, (url, title) in enumerate(zip(urls, titles)):
+            by_url.setdefault(url, []).append(row)
+            if url not in url_codes:
+                url_codes[url] = len(url_codes) if url else -1
+            row_url_codes.append(url_codes[url])
+            if url not in hostnames:
+                hostnames[url] = _hostname(url)
+            by_hostname.setdefault(hostnames[url], []).append(row)
+            if title not in title_words:
+                title_words[title] = sorted(set(_words(title)))
+            for word in title_words[title]:
+                by_word.setdefault(word, []).append(row)
+        self._by_url = _postings(by_url)
+        # A number for the url of each row, the same for rows with the same
+        # url, or -1 if it has none.
+        self.url_codes = np.array(row_url_codes, dtype=np.int64)
+        # Sorted, so the urls with a prefix are next to each other.
+        self._urls = sorted(self._by_url)
+        self._by_hostname = _postings(by_hostname)
+        self._by_word = _postings(by_word)
+
+    def _url_prefix_rows(self, prefix: str) -> NDArray[np.int64]:
+        start = bisect.bisect_left(self._urls, prefix)
+        end = start
+        while end < len(self._urls) and self._urls[end].startswith(prefix):
+            end += 1
+        if start == end:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate([self._by_url[url] for url in self._urls[start:end]]))
+
+    def _title_rows(self, title: str) -> Union[NDArray[np.int64], None]:
+        rows = None
+        for word in set(_words(title)):
+            word_rows = self._by_word.get(word, np.zeros(0, dtype=np.int64))
+            rows = word_rows if rows is None else np.intersect1d(rows, word_rows, assume_unique=True)
+        return rows
+
+    def rows(self, filters: dict[str, str]) -> NDArray[np.int64]:
+        """
+        Returns the rows, in ascending order, that match every one of
+        filters (keyed by the names in FILTER_ARGUMENTS).
+        """
+        result = None
+        for name, value in filters.items():
+            if name == 'filter_url_prefix':
+                rows = self._url_prefix_rows(value)
+            elif name == 'filter_hostname':
+                rows = self._by_hostname.get(value.lower(), np.zeros(0, dtype=np.int64))
+            elif name == 'filter_title':
+                rows = self._title_rows(value)
+            else:
+                raise Exception(f'{name} is not one of the legal filters: {FILTER_ARGUMENTS}')
+            if rows is None:
+                # A value without words doesn't filter anything.
+                continue
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+        if result is None:
+            return np.arange(self.row_count, dtype=np.int64)
+        return result
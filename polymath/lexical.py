@@ -0,0 +1,112 @@
+import math
+import re
+from collections import Counter
+from typing import Iterable, List
+
+import numpy as np
+from numpy.typing import NDArray
+
+# A lexical index scores the text of each bit against the words of a query
+# with BM25, so that queries for exact terms (e.g. API names) find the bits
+# that mention them even when their embeddings aren't among the most similar.
+#
+# A hybrid query ranks the bits both ways and fuses the two rankings with
+# reciprocal rank fusion: each bit scores 1 / (HYBRID_RRF_K + rank) for each
+# ranking it's in, counting only the first HYBRID_CANDIDATES of each.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# How many of the best bits of each ranking are fused.
+HYBRID_CANDIDATES = 100
+
+# Damps the difference between the first few ranks, so a bit near the top of
+# both rankings beats one at the very top of just one.
+HYBRID_RRF_K = 60
+
+_TERM = re.compile(r'\w+')
+
+
+def terms(text: str) -> List[str]:
+    return _TERM.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    The BM25 index of the text of the bit in each row of a library's
+    embedding matrix, built by Library._lexical_index().
+
+    Args:
+        texts: The text of each row's bit.
+    """
+
+    def __init__(self, texts: Iterable[str]):
+        rows_by_term = dict[str, List[int]]()
+        frequencies_by_term = dict[str, List[int]]()
+        lengths = []
+        for row, text in enumerate(texts):
+            term_counts = Counter(terms(text))
+            lengths.append(sum(term_counts.values()))
+            for term, frequency in term_counts.items():
+                rows_by_term.setdefault(term, []).append(row)
+                frequencies_by_term.setdefault(term, []).append(frequency)
+        self.row_count = len(lengths)
+        self._rows = {
+            term: np.array(rows, dtype=np.int64) for term, rows in rows_by_term.items()
+        }
+        self._frequencies = {
+            term: np.array(frequencies, dtype=np.float32) for term, frequencies in frequencies_by_term.items()
+        }
+        lengths = np.array(lengths, dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) and lengths.mean() else 1
+        # The part of BM25's denominator that only depends on the row.
+        self._length_norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def scores(self, query_text: str) -> NDArray[np.float32]:
+        """
+        Returns the BM25 score of each row for query_text. Rows without any
+        of its terms score 0.
+        """
+        result = np.zeros(self.row_count, dtype=np.float32)
+        for term in set(terms(query_text)):
+            rows = self._rows.get(term)
+            if rows is None:
+                continue
+            idf = math.log(1 + (self.row_count - len(rows) + 0.5) / (len(rows) + 0.5))
+            frequencies = self._frequencies[term]
+            result[rows] += idf * frequencies * (BM25_K1 + 1) / (frequencies + self._length_norms[rows])
+        return result
+
+
+def top_positions(scores: NDArray[np.float32], count: int) -> NDArray[np.int64]:
+    """
+    Returns the positions of the count highest scores, highest first, with
+    ties in position order.
+    """
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if count < len(scores):
+        cutoff = -np.partition(-scores, count - 1)[count - 1]
+        positions = np.nonzero(scores >= cutoff)[0]
+    else:
+        positions = np.arange(len(scores), dtype=np.int64)
+    order = np.lexsort((positions, -scores[positions]))
+    return positions[order][:count]
+
+
+def reciprocal_rank_fusion(rankings: List[NDArray[np.int64]], k: int = HYBRID_RRF_K) -> tuple[NDArray[np.int64], NDArray[np.float64]]:
+    """
+    Given several rankings of rows (best first), returns every row in any of
+    them and its fused score, best first with ties in row order.
+    """
+    rows = np.concatenate(rankings) if rankings else np.zeros(0, dtype=np.int64)
+    contributions = np.concatenate([
+        1 / (k + np.arange(1, len(ranking) + 1, dtype=np.float64)) for ranking in rankings
+    ]) if rankings else np.zeros(0, dtype=np.float64)
+    fused_rows, positions = np.unique(rows, return_inverse=True)
+    fused_scores = np.bincount(positions, weights=contributions, minlength=len(fused_rows))
+    order = np.lexsort((fused_rows, -fused_scores))
+    return fused_rows[order], fused_scores[order]
@@ -3,17 +3,27 @@ import bisect
 import copy
 import hashlib
 import json
+import mmap
 import os
 import random
-from typing import List, Union, Final, cast
+from typing import Iterable, Iterator, List, Union, Final, cast
 
 import numpy as np
 
 from numpy.typing import NDArray
 
-from .access import DEFAULT_PRIVATE_ACCESS_TAG, HOST_CONFIG, permitted_access
-from .upgrade import upgrade_library_data
-from .types import BitData, BitInfoData, LibraryData, LibraryDetailsCountsData, LibraryDetailsData
+from .access import DEFAULT_PRIVATE_ACCESS_TAG, get_host_config, permitted_access
+from .cursors import Ranking, RankingCache, decode_cursor, encode_cursor
+from .diversity import COLLAPSE_CANDIDATES, MMR_CANDIDATES, MMR_LAMBDA, collapse_mask, mmr_order
+from .filters import FILTER_ARGUMENTS, InfoIndex
+from .lexical import HYBRID_CANDIDATES, LexicalIndex, reciprocal_rank_fusion, top_positions
+from .timing import StageTimer
+from .routing import CentroidRouter, ROUTING_MIN_EMBEDDINGS, RowAttributes, ranking_threshold
+from .search import exhaustive_ranking, shard_bounds, similarities as search_similarities
+from .textstore import TextStore
+from .binary import LEGAL_EMBEDDING_DTYPES, decode_library_data, encode_library_data
+from .upgrade import info_key, upgrade_library_data
+from .types import BitData, BitInfoData, LibraryData, LibraryDetailsCountsData, LibraryDetailsData, LibraryDetailsTimingsData
 
 EMBEDDINGS_MODEL_ID = "openai.com:text-embedding-ada-002"
 
@@ -32,13 +42,22 @@ MAX_CONTEXT_LEN_IN_TOKENS = 2048
 # Old libraries will continue to work, just being upgraded every time they are
 # loaded. When a new version is released, ping the discord and remind everyone
 # to run `python3 -m convert.upgrade` to upgrade all of their libraries.
-CURRENT_VERSION = 1
+CURRENT_VERSION = 2
 
-LEGAL_SORTS = set(['similarity', 'any', 'random', 'manual'])
+# The oldest version a query may ask for. Results are written in the version
+# the query asks for (or CURRENT_VERSION, if it asks for a newer one), so that
+# clients and federated hosts that haven't updated yet keep working.
+OLDEST_QUERY_VERSION = 1
+
+LEGAL_SORTS = set(['similarity', 'any', 'random', 'manual', 'hybrid', 'mmr'])
+# The sorts a query can ask for.
+LEGAL_QUERY_SORTS = set(['similarity', 'hybrid', 'mmr'])
 LEGAL_COUNT_TYPES = set(['token', 'bit'])
 LEGAL_OMIT_KEYS = set(
     ['*', '', 'similarity', 'embedding', 'token_count', 'info', 'access_tag'])
 
+TRUTHY_ARGUMENT_VALUES = set(['1', 'true', 'yes', 'on'])
+
 
 def canonical_id(bit_text: str, url: str = '') -> str:
     """
@@ -62,12 +81,24 @@ def vector_from_base64(str: str) -> NDArray[np.float32]:
     return np.frombuffer(base64.b64decode(str), dtype=np.float32)
 
 
+def base64_from_embedding(embedding: NDArray[np.float32]) -> str:
+    return base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode('ascii')
+
+
 def vector_similarity(x: NDArray[np.float32], y: NDArray[np.float32]) -> float:
     # np.dot returns a float32 but those aren't serializable in json. Just
     # covert to a float64 now.
     return float(np.dot(np.array(x), np.array(y)))
 
 
+def result_version(args: dict[str, Union[str, int]]) -> int:
+    """
+    Returns the library format version to write the result of a query with
+    args in: the version it asks for, or CURRENT_VERSION if that's newer.
+    """
+    return min(int(args.get('version', CURRENT_VERSION)), CURRENT_VERSION)
+
+
 class BitInfo:
     def __init__(self, bit: Union['Bit', None] = None, data: Union[BitInfoData, None] = None):
         self._data = data if data else {}
@@ -81,9 +112,7 @@ class BitInfo:
     def url(self, value: str):
         if value == self.url:
             return
-        self._data['url'] = value
-        if self._bit:
-            self._bit.info = self
+        self._set('url', value)
 
     @property
     def image_url(self) -> str:
@@ -93,9 +122,7 @@ class BitInfo:
     def image_url(self, value: str):
         if value == self.image_url:
             return
-        self._data['image_url'] = value
-        if self._bit:
-            self._bit.info = self
+        self._set('image_url', value)
 
     @property
     def title(self) -> str:
@@ -105,9 +132,7 @@ class BitInfo:
     def title(self, value: str):
         if value == self.title:
             return
-        self._data['title'] = value
-        if self._bit:
-            self._bit.info = self
+        self._set('title', value)
 
     @property
     def description(self) -> str:
@@ -117,7 +142,12 @@ class BitInfo:
     def description(self, value: str):
         if value == self.description:
             return
-        self._data['description'] = value
+        self._set('description', value)
+
+    def _set(self, key: str, value: str):
+        # Infos are shared between the bits that have the same one (see
+        # Library._intern_info), so changing one makes a new record.
+        self._data = {**self._data, key: value}
         if self._bit:
             self._bit.info = self
 
@@ -138,6 +168,10 @@ class Bit:
         self._cached_info = None
         self._cached_embedding = None
         self._canonical_id = None
+        # Set when the bit's text and info are kept in a text store (see
+        # textstore.py) rather than in _data.
+        self._store: Union[TextStore, None] = None
+        self._store_position = 0
 
         # data is the direct object backing store within library.content
         self._data = data if data else {}
@@ -183,10 +217,50 @@ class Bit:
         """
         Returns a copy of self, but not attached to any library
         """
-        data = copy.deepcopy(self._data)
+        data = copy.deepcopy(self._full_data())
         result = Bit(data=data)
         return result
 
+    def _full_data(self) -> BitData:
+        """
+        Returns _data, with the fields kept in a text store filled in.
+        """
+        if self._store is None:
+            return self._data
+        stored = self._store.fields(self._store_position)
+        return cast(BitData, {
+            key: stored.get(key) if value is None and key in stored else value
+            for key, value in self._data.items()
+        })
+
+    def _load_stored_fields(self):
+        """
+        Copies the fields kept in a text store into _data, e.g. once the bit
+        is part of a query result.
+        """
+        if self._store is None:
+            return
+        stored = self._store.fields(self._store_position)
+        for key, value in stored.items():
+            if key in self._data and self._data[key] is None:
+                self._data[key] = value
+        self._store = None
+
+    def _shallow_copy(self) -> 'Bit':
+        """
+        Returns a copy of self, not attached to any library, that shares the
+        underlying values (and the decoded embedding and id) with self.
+
+        Only the top-level dict is copied, so it's safe to set or strip fields
+        on the result, but not to mutate its info in place.
+        """
+        result = Bit(data=dict(self._data))
+        result._cached_embedding = self.embedding
+        result._canonical_id = self.id
+        result._store = self._store
+        result._store_position = self._store_position
+        return result
+
     def remove(self):
         if not self.library:
             return
@@ -203,6 +277,8 @@ class Bit:
     def _set_library(self, library: Union['Library', None]):
         # _set_library should only be called by a library in insert_bit or in our constructor.
         self._library = library
+        if library is not None:
+            self._load_stored_fields()
         self.validate()
 
     @property
@@ -213,6 +289,8 @@ class Bit:
 
     @property
     def text(self) -> str:
+        if self._store is not None and self._data.get('text') is None:
+            return str(self._store.fields(self._store_position).get('text', ''))
         return str(self._data.get('text', ''))
 
     @text.setter
@@ -222,6 +300,8 @@ class Bit:
         self._data['text'] = value
         # canonical ID depends on text.
         self._canonical_id = None
+        if self._library:
+            self._library._invalidate_index()
 
     @property
     def token_count(self) -> int:
@@ -238,6 +318,9 @@ class Bit:
     def embedding(self) -> Union[NDArray[np.float32], None]:
         if self._cached_embedding is None:
             raw_embedding = self._data.get('embedding', None)
+            if isinstance(raw_embedding, np.ndarray):
+                self._cached_embedding = raw_embedding
+                return self._cached_embedding
             if not raw_embedding:
                 return None
             if not isinstance(raw_embedding, str):
@@ -250,6 +333,8 @@ class Bit:
         self._cached_embedding = value
         self._data['embedding'] = Library.base64_from_vector(
             value).decode('ascii')
+        if self._library:
+            self._library._invalidate_index()
 
     @property
     def similarity(self) -> float:
@@ -272,6 +357,8 @@ class Bit:
     @access_tag.setter
     def access_tag(self, value: Union[str, None]):
         self._data['access_tag'] = value
+        if self._library:
+            self._library._invalidate_index()
 
     @property
     def info(self) -> BitInfo:
@@ -286,7 +373,7 @@ class Bit:
     @info.setter
     def info(self, value: BitInfo):
         self._cached_info = value
-        self._data['info'] = value._data
+        self._data['info'] = self._library._intern_info(value._data) if self._library else value._data
 
     def strip(self):
         # Called when it should strip any values that its library has configured
@@ -300,20 +387,124 @@ class Bit:
                 del self._data[field_to_omit]
 
 
+class EmbeddingIndex:
+    """
+    The embeddings of a library's bits stacked into one matrix, so that every
+    bit can be scored against a query at once.
+    """
+
+    def __init__(self, bits: List[Bit]):
+        embeddings = [bit.embedding for bit in bits]
+        bits = [bit for bit, embedding in zip(bits, embeddings) if embedding is not None]
+        # ids[i] is the id of the bit whose embedding is in matrix[i]
+        self.ids = [bit.id for bit in bits]
+        # Set by from_matrix() when matrix is mapped from a file.
+        self._mapping: Union[mmap.mmap, None] = None
+        self._mapping_offset = 0
+        if bits:
+            self.matrix = np.stack(
+                [cast(NDArray[np.float32], bit.embedding) for bit in bits]).astype(np.float32, copy=False)
+            # Each bit's embedding becomes a view of its row, so the decoded
+            # embeddings aren't held twice.
+            for row, bit in enumerate(bits):
+                bit._cached_embedding = self.matrix[row]
+                if isinstance(bit._data.get('embedding', None), np.ndarray):
+                    bit._data['embedding'] = self.matrix[row]
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @classmethod
+    def from_matrix(cls, ids: List[str], matrix: NDArray[np.float32], mapping: Union[mmap.mmap, None] = None, mapping_offset: int = 0) -> 'EmbeddingIndex':
+        """
+        Returns an index over an existing matrix (e.g. one mapped from a
+        snapshot file) without copying it. ids[i] is the id of matrix[i].
+
+        If matrix is mapped from a file, mapping is the map and matrix starts
+        at mapping_offset in it.
+        """
+        result = cls([])
+        result.ids = ids
+        result.matrix = matrix
+        result._mapping = mapping
+        result._mapping_offset = mapping_offset
+        return result
+
+    @property
+    def mapped(self) -> bool:
+        return self._mapping is not None
+
+    def release(self, start: int, end: int):
+        """
+        Lets the OS drop the pages of rows [start, end) of a mapped matrix
+        from memory. They're read from the file again if they're used again.
+        """
+        if self._mapping is None or not hasattr(mmap, 'MADV_DONTNEED') or not len(self):
+            return
+        row_bytes = self.matrix.shape[1] * self.matrix.itemsize
+        begin = self._mapping_offset + start * row_bytes
+        # madvise() only takes whole pages. The pages at either end may
+        # be shared with rows outside the range, which just means they're
+        # read again if needed.
+        aligned = begin - begin % mmap.PAGESIZE
+        length = self._mapping_offset + end * row_bytes - aligned
+        if length > 0:
+            self._mapping.madvise(mmap.MADV_DONTNEED, aligned, length)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def similarities(self, query_embedding: NDArray[np.float32]) -> NDArray[np.float32]:
+        """
+        Returns the similarity of each row to query_embedding.
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.float32)
+        return self.matrix @ query_embedding.astype(np.float32, copy=False)
+
+
 class Library:
 
     EMBEDDINGS_MODEL_ID: Final[str] = EMBEDDINGS_MODEL_ID
     CURRENT_VERSION: Final[int] = CURRENT_VERSION
 
-    def __init__(self, data: Union[LibraryData, None] = None, blob: Union[str, None] = None, filename: Union[str, None] = None, access_tag: Union[str, bool, None] = None):
+    def __init__(self, data: Union[LibraryData, None] = None, blob: Union[str, None] = None, filename: Union[str, None] = None, access_tag: Union[str, bool, None] = None, binary: Union[bytes, None] = None):
 
         # The only actual data member of the class is _data. If that ever
-        # changes, also change copy().
+        # changes, also change copy(). _index is derived from the bits and
+        # rebuilt whenever they change.
+        self._index: Union[EmbeddingIndex, None] = None
+        self._access_tag_counts: Union[dict[Union[str, None], int], None] = None
+        self._row_attributes_cache: Union[RowAttributes, None] = None
+        self._info_index_cache: Union[InfoIndex, None] = None
+        self._lexical_index_cache: Union[LexicalIndex, None] = None
+        self._router: Union[CentroidRouter, None] = None
+        self._router_built = False
+        # The router's assignments, if they were restored from a snapshot.
+        self._router_assignments: Union[NDArray[np.int64], None] = None
+        # Every distinct info of the bits, each stored once and shared by the
+        # bits that have it. See _intern_info().
+        self._infos = cast(dict[Union[tuple, str], BitInfoData], {})
+        self._info_ids = cast(set[int], set())
+        # Set by add_shard()
+        self._shards = cast(List[List[str]], [])
+        # Set by use_precomputed()
+        self._precomputed = None
+        # Set by use_search_threads() and use_search_blocks()
+        self._search_threads = 1
+        self._search_block_rows = 0
+        # Set by use_cursor_cache(), or created by the first paginated query.
+        self._rankings: Union[RankingCache, None] = None
 
         if filename:
             data = Library.load_data_file(filename)
         if blob:
             data = json.loads(blob)
+        if binary:
+            data = decode_library_data(binary)
         if data:
             self._data = data
         else:
@@ -337,11 +528,13 @@ class Library:
 
         content = self._data.get('bits', [])
         assert isinstance(content, list)
+        infos = cast(list[BitInfoData], self._data.pop('infos', []))
         self._bits = cast(dict[str, Bit], {})
         # _bits_in_order is an inflated bit in the same order as the underlying data.
         self._bits_in_order = cast(list[Bit], [])
         for bit_data in content:
             assert isinstance(bit_data, dict)
+            self._intern_bit_info(bit_data, infos)
             bit = Bit(library=self, data=bit_data)
             bit_id = bit.id
             self._bits[bit_id] = bit
@@ -353,11 +546,101 @@ class Library:
 
         self.validate()
 
+    @classmethod
+    def _restore(cls, data: LibraryData, ids: List[str], index: EmbeddingIndex, store: Union[TextStore, None] = None) -> 'Library':
+        """
+        Returns a library for data that was already upgraded and validated
+        (see snapshot.py), without doing either again or rehashing bit ids.
+        ids[i] is the id of data['bits'][i], and index must cover the bits.
+        If store is given, it has the text and info of data['bits'][i] at
+        position i.
+        """
+        result = cls.__new__(cls)
+        result._index = index
+        result._access_tag_counts = None
+        result._row_attributes_cache = None
+        result._info_index_cache = None
+        result._lexical_index_cache = None
+        result._router = None
+        result._router_built = False
+        result._router_assignments = None
+        result._infos = {}
+        result._info_ids = set()
+        result._shards = []
+        result._precomputed = None
+        result._search_threads = 1
+        result._search_block_rows = 0
+        result._rankings = None
+        result._data = data
+        result._upgraded = False
+        result._bits = {}
+        result._bits_in_order = []
+        infos = cast(list[BitInfoData], data.pop('infos', []))
+        for position, (bit_data, bit_id) in enumerate(zip(cast(list[BitData], data['bits']), ids)):
+            result._intern_bit_info(bit_data, infos)
+            # Without a library the bit skips validation.
+            bit = Bit(data=bit_data)
+            bit._canonical_id = bit_id
+            bit._store = store
+            bit._store_position = position
+            bit._library = result
+            result._bits[bit_id] = bit
+            result._bits_in_order.append(bit)
+        return result
+
+    def _intern_info(self, info: BitInfoData) -> BitInfoData:
+        """
+        Returns the info stored for bits of self that have the same info, or
+        info itself (which is then stored) if none do yet.
+        """
+        if id(info) in self._info_ids:
+            return info
+        key = info_key(info)
+        interned = self._infos.get(key)
+        if interned is None:
+            self._infos[key] = info
+            self._info_ids.add(id(info))
+            return info
+        return interned
+
+    def _intern_bit_info(self, bit_data: BitData, infos: List[BitInfoData]):
+        """
+        Replaces the info of bit_data, which in serialized libraries is its
+        position in infos, with the info stored by self.
+        """
+        info = bit_data.get('info', None)
+        if isinstance(info, int) and not isinstance(info, bool):
+            if not 0 <= info < len(infos):
+                raise Exception(f'info {info} is not in infos')
+            info = infos[info]
+        if isinstance(info, dict):
+            bit_data['info'] = self._intern_info(info)
+
     @classmethod
     def load_data_file(cls, file: str) -> LibraryData:
         with open(file, "r") as f:
             return json.load(f)
 
+    @classmethod
+    def load_data_lines(cls, lines: Iterable[Union[str, bytes]]) -> LibraryData:
+        """
+        Returns the library data from newline-delimited JSON, as produced by
+        serialized_lines().
+        """
+        result = None
+        bits = []
+        for line in lines:
+            if not line.strip():
+                continue
+            if result is None:
+                result = json.loads(line)
+                continue
+            bits.append(json.loads(line))
+        if result is None:
+            raise Exception('No library header was found')
+        result['bits'] = bits
+        return result
+
     # In JS, the argument can be produced with with:
     # ```
     # new Float32Array(new Uint8Array([...atob(encoded_data)].map(c => c.charCodeAt(0))).buffer);
@@ -448,6 +731,7 @@ class Library:
             self._bits = {}
         for bit in self.bits:
             bit.strip()
+        self._invalidate_index()
 
     @property
     def sort(self) -> str:
@@ -516,6 +800,10 @@ class Library:
         elif sort_type == 'manual':
             # sort type of manual we expliclity want left in the previous order.
             pass
+        elif sort_type == 'hybrid' or sort_type == 'mmr':
+            # hybrid and mmr are the order of a reranking (see lexical.py and
+            # diversity.py), which can't be recomputed from the bits.
+            pass
         else:
             # effectively any, which means any order is fine.
             pass
@@ -595,6 +883,24 @@ class Library:
         self.counts = self.counts
         self.counts['restricted'] = value
 
+    @property
+    def timings(self) -> LibraryDetailsTimingsData:
+        """
+        Returns how many milliseconds each stage of the query that produced
+        this library took, if the query asked for debug_timings.
+        """
+        details = self._details
+        if 'timings' not in details:
+            return {}
+        result = details['timings']
+        assert isinstance(result, dict)
+        return cast(LibraryDetailsTimingsData, result)
+
+    @timings.setter
+    def timings(self, value: LibraryDetailsTimingsData):
+        self._details = self._details
+        self._details['timings'] = value
+
     @property
     def message(self) -> str:
         details = self._details
@@ -607,15 +913,39 @@ class Library:
         self._details = self._details
         self._details['message'] = value
 
+    @property
+    def cursor(self) -> str:
+        """
+        Returns the cursor to pass to get the next page of results, if the
+        query that produced this library was paginated and has more.
+        """
+        details = self._details
+        result = details.get('cursor', '')
+        assert isinstance(result, str)
+        return result
+
+    @cursor.setter
+    def cursor(self, value: str):
+        self._details = self._details
+        self._details['cursor'] = value
+
     @property
     def text(self) -> List[str]:
         return [bit.text for bit in self.bits]
 
     @property
     def unique_infos(self: 'Library') -> List[BitInfo]:
+        # Bits with the same info share it, so only the first bit with each
+        # one needs to be compared by contents.
+        seen_records = cast(set[int], set())
         seen_infos = cast(set[str], set())
         result = cast(list[BitInfo], [])
         for bit in self.bits:
+            record = bit._data.get('info', None)
+            if record is not None:
+                if id(record) in seen_records:
+                    continue
+                seen_records.add(id(record))
             info = bit.info
             key = info.contents
             if key in seen_infos:
@@ -644,13 +974,61 @@ class Library:
         for bit in other.bits:
             self.insert_bit(bit.copy())
 
+    def _empty_copy(self) -> 'Library':
+        """
+        Returns a copy of self with everything but the bits.
+        """
+        result = Library()
+        result._data = copy.deepcopy(
+            {key: value for key, value in self._data.items() if key != 'bits'})
+        result._data['bits'] = []
+        return result
+
+    def _shallow_copy(self) -> 'Library':
+        """
+        Returns a copy of self whose bits share their values with the bits of
+        self. Used by query() to avoid duplicating every bit's text and
+        embedding on each request.
+        """
+        result = self._empty_copy()
+        for original_bit in self._bits_in_order:
+            result._append_shallow_copy(original_bit)
+        # The copy has the same bits, so it can score against our index.
+        result._index = self._embedding_index()
+        return result
+
+    def _ranked_copy(self, ranking: List[tuple[str, float]], sort: str = 'similarity') -> 'Library':
+        """
+        Returns a copy of self like _shallow_copy, but with only the bits in
+        ranking, in that order and with those similarities.
+        """
+        result = self._empty_copy()
+        result._data['sort'] = sort
+        for bit_id, similarity in ranking:
+            original_bit = self.bit(bit_id)
+            if not original_bit:
+                continue
+            result._append_shallow_copy(original_bit).similarity = similarity
+        return result
+
+    def _append_shallow_copy(self, original_bit: Bit) -> Bit:
+        bit = original_bit._shallow_copy()
+        # The original bit was already validated, skip doing it again.
+        bit._library = self
+        self._bits[bit.id] = bit
+        self._bits_in_order.append(bit)
+        cast(list[BitData], self._data['bits']).append(bit._data)
+        return bit
+
     def copy(self):
         result = Library()
-        result._data = copy.deepcopy(self._data)
+        result._data = copy.deepcopy(
+            {**self._data, 'bits': [bit._full_data() for bit in self._bits_in_order]})
         result._bits = cast(dict[str, Bit], {})
         result._bits_in_order = cast(list[Bit], [])
         raw_bits = cast(list[BitData], result._data.get('bits', []))
         for data in raw_bits:
+            result._intern_bit_info(data, [])
             bit = Bit(library=result, data=data)
             result._bits[bit.id] = bit
             result._bits_in_order.append(bit)
@@ -664,11 +1042,13 @@ class Library:
         })
         self._bits = {}
         self._bits_in_order = []
+        self._invalidate_index()
 
     def delete_all_bits(self):
         self._data['bits'] = []
         self._bits = {}
         self._bits_in_order = []
+        self._invalidate_index()
 
     def delete_restricted_bits(self, access_token: Union[str, None] = None):
         """
@@ -691,6 +1071,40 @@ class Library:
 
         return restricted_count
 
+    def collapse(self, max_similarity: float = 0, per_url: int = 0) -> int:
+        """
+        Deletes the bits that collapse_mask() drops (see diversity.py): those
+        whose embedding is more similar than max_similarity (if given) to a
+        bit before them, and those of a url that already has per_url (if
+        given) bits before them. Bits without an embedding are never
+        near-duplicates.
+
+        Useful for libraries merged from several hosts, e.g. with extend(),
+        which can hold the same content from mirrored urls under different
+        ids. Compares every pair of bits, so it's meant for query results
+        rather than whole libraries.
+
+        Returns the number of bits that were removed.
+        """
+        bits = self.bits
+        if not bits or (max_similarity <= 0 and per_url <= 0):
+            return 0
+        dims = next((len(bit.embedding) for bit in bits if bit.embedding is not None), 0)
+        embeddings = np.stack([
+            bit.embedding if bit.embedding is not None else np.zeros(dims, dtype=np.float32)
+            for bit in bits
+        ]).astype(np.float32, copy=False)
+        url_codes = dict[str, int]()
+        codes = np.array([
+            url_codes.setdefault(bit.info.url, len(url_codes)) if bit.info.url else -1
+            for bit in bits
+        ], dtype=np.int64)
+        keep = collapse_mask(embeddings, codes, max_similarity, per_url)
+        for bit, kept in zip(bits, keep):
+            if not kept:
+                self.remove_bit(bit)
+        return int(len(keep) - keep.sum())
+
     def bit(self, bit_id: str) -> Union[Bit, None]:
         return self._bits.get(bit_id, None)
 
@@ -718,6 +1132,7 @@ class Library:
         self._bits_in_order.pop(index)
         cast(list[BitData], self._data['bits']).pop(index)
         del self._bits[bit_id]
+        self._invalidate_index()
 
     def insert_bit(self, bit: Bit):
         if bit.library == self:
@@ -729,20 +1144,122 @@ class Library:
             # cases where there is the same text in a given url.
             return
         bit._set_library(self)
+        info = bit._data.get('info', None)
+        if isinstance(info, dict):
+            interned = self._intern_info(info)
+            if interned is not info:
+                bit._data['info'] = interned
+                bit._cached_info = None
         self._bits[bit.id] = bit
         self._insert_bit_in_order(bit)
+        self._invalidate_index()
 
-    def serializable(self, include_access_tag: bool = False):
+    def serializable(self, include_access_tag: bool = False, version: int = CURRENT_VERSION):
         """
         Returns a dict representing the data in the library that is suitable for
         being serialized e.g. into JSON.
+
+        version is the library format version to write, CURRENT_VERSION or 1
+        (which has each bit's info inline instead of an infos table).
+        """
+        infos, info_positions = self._serializable_infos(version)
+        return copy.deepcopy({
+            **self._serializable_header(infos, version),
+            'bits': [
+                self._serializable_bit(bit, info_positions, include_access_tag)
+                for bit in self._bits_in_order
+            ]
+        })
+
+    def _serializable_header(self, infos: Union[List[BitInfoData], None] = None, version: int = CURRENT_VERSION) -> LibraryData:
+        result = {key: value for key, value in self._data.items() if key != 'bits'}
+        if version != CURRENT_VERSION:
+            result['version'] = version
+        if infos:
+            result['infos'] = infos
+        return result
+
+    def _serializable_infos(self, version: int = CURRENT_VERSION) -> tuple[List[BitInfoData], Union[dict[int, int], None]]:
         """
-        result = copy.deepcopy(self._data)
-        for bit in cast(list[BitData], result['bits']):
-            if not include_access_tag and 'access_tag' in bit:
-                del bit['access_tag']
+        Returns the infos of the bits, each once, in the order they first
+        appear, and the position of each of them by id(). Version 1 has no
+        infos table, so for it the positions are None.
+        """
+        if version not in (1, CURRENT_VERSION):
+            raise Exception(f'version {version} can\'t be written, only 1 and {CURRENT_VERSION}')
+        if version == 1:
+            return [], None
+        infos = cast(list[BitInfoData], [])
+        positions = cast(dict[int, int], {})
+        for bit in self._bits_in_order:
+            info = bit._data.get('info', None)
+            if isinstance(info, dict) and id(info) not in positions:
+                positions[id(info)] = len(infos)
+                infos.append(info)
+        return infos, positions
+
+    def _serializable_bit(self, bit: Bit, info_positions: Union[dict[int, int], None], include_access_tag: bool = False, encode_embedding: bool = True) -> BitData:
+        result = dict(bit._full_data())
+        if not include_access_tag and 'access_tag' in result:
+            del result['access_tag']
+        info = result.get('info', None)
+        if isinstance(info, dict) and info_positions is not None:
+            result['info'] = info_positions[id(info)]
+        embedding = result.get('embedding', None)
+        if encode_embedding and isinstance(embedding, np.ndarray):
+            result['embedding'] = base64_from_embedding(embedding)
         return result
 
+    def serialized_chunks(self, include_access_tag: bool = False, version: int = CURRENT_VERSION) -> Iterator[str]:
+        """
+        Yields the same JSON that serializable() would produce, but in pieces:
+        first the header fields, then one bit at a time. Nothing is copied, so
+        the full response never has to be held in memory.
+        """
+        infos, info_positions = self._serializable_infos(version)
+        header = json.dumps(self._serializable_header(infos, version))
+        separator = ', ' if header != '{}' else ''
+        yield header[:-1] + separator + '"bits": ['
+        for index, bit in enumerate(self._bits_in_order):
+            prefix = ', ' if index else ''
+            yield prefix + json.dumps(self._serializable_bit(bit, info_positions, include_access_tag))
+        yield ']}'
+
+    def serialized_lines(self, include_access_tag: bool = False, version: int = CURRENT_VERSION) -> Iterator[str]:
+        """
+        Yields the library as newline-delimited JSON: the first line is the
+        header (everything but bits), followed by one line per bit.
+
+        The result can be read back with Library.load_data_lines.
+        """
+        infos, info_positions = self._serializable_infos(version)
+        yield json.dumps(self._serializable_header(infos, version)) + '\n'
+        for bit in self._bits_in_order:
+            yield json.dumps(self._serializable_bit(bit, info_positions, include_access_tag)) + '\n'
+
+    def serialized_binary(self, embedding_dtype: str = 'float32', include_access_tag: bool = False, version: int = CURRENT_VERSION) -> Iterator[bytes]:
+        """
+        Yields the library in the compact binary format (see binary.py), with
+        embeddings as raw arrays of embedding_dtype instead of base64 strings.
+
+        The result can be read back with Library(binary=...).
+        """
+        if embedding_dtype not in LEGAL_EMBEDDING_DTYPES:
+            raise Exception(
+                f'embedding_dtype {embedding_dtype} is not one of the legal options: {LEGAL_EMBEDDING_DTYPES}')
+        infos, info_positions = self._serializable_infos(version)
+        bits = [
+            self._serializable_bit(bit, info_positions, include_access_tag, encode_embedding=False)
+            for bit in self._bits_in_order
+        ]
+        embeddings = None
+        if 'embedding' not in self.fields_to_omit and self._bits_in_order:
+            rows = [bit.embedding for bit in self._bits_in_order]
+            if any(row is None for row in rows):
+                raise Exception('Every bit must have an embedding unless embeddings are omitted')
+            embeddings = np.stack(cast(list[NDArray[np.float32]], rows))
+        return encode_library_data(self._serializable_header(infos, version), bits, embeddings, embedding_dtype)
+
     def slice(self, count: int, count_type_is_bit: bool = False) -> 'Library':
         """
         Returns a new library that contains a subset of the first items of self
@@ -756,8 +1273,7 @@ class Library:
 
         A count of negative means 'all items'
         """
-        result = self.copy()
-        result.delete_all_bits()
+        result = self._empty_copy()
         context_len = 0
         counter = 0
 
@@ -765,7 +1281,7 @@ class Library:
         for original_bit in self.bits:
             if count_type_is_bit and count >= 0 and counter >= count:
                 break
-            bit = original_bit.copy()
+            bit = original_bit._shallow_copy()
             tokens = bit.token_count
             text = bit.text
             context_len += tokens
@@ -783,24 +1299,421 @@ class Library:
         with open(filename, 'w') as f:
             json.dump(result, f, indent='\t')
 
+    def _invalidate_index(self):
+        self._index = None
+        self._access_tag_counts = None
+        self._row_attributes_cache = None
+        self._info_index_cache = None
+        self._lexical_index_cache = None
+        self._router = None
+        self._router_built = False
+        self._router_assignments = None
+        # Rankings refer to rows of the index.
+        if self._rankings is not None:
+            self._rankings.clear()
+
+    def _count_restricted(self, access_token: Union[str, None]) -> int:
+        """
+        Returns how many bits delete_restricted_bits(access_token) would
+        delete, without looking at every bit.
+        """
+        if self._access_tag_counts is None:
+            counts = cast(dict[Union[str, None], int], {})
+            for bit in self._bits_in_order:
+                counts[bit.access_tag] = counts.get(bit.access_tag, 0) + 1
+            self._access_tag_counts = counts
+        visible_access_tags = permitted_access(access_token)
+        return sum(
+            count for access_tag, count in self._access_tag_counts.items()
+            if access_tag is not None and access_tag not in visible_access_tags)
+
+    def _fills_count(self, count: int, count_type: str) -> bool:
+        """
+        Returns True if slice(count) would stop before running out of bits.
+        """
+        if count < 0:
+            return False
+        if count_type == 'bit':
+            return len(self._bits_in_order) >= count
+        return sum(bit.token_count for bit in self._bits_in_order) > count
+
+    def use_precomputed(self, precomputed):
+        """
+        Answers queries that match one of precomputed's queries (see
+        precompute.py) from its stored ranking instead of scoring every bit.
+        """
+        self._precomputed = precomputed
+
+    def use_search_threads(self, thread_count: int):
+        """
+        Scores queries that can't be answered otherwise on up to
+        thread_count threads, each taking a shard of the embeddings (see
+        search.py), instead of scoring every bit on the query's thread.
+        """
+        self._search_threads = thread_count
+
+    def use_cursor_cache(self, size: int, ttl: float):
+        """
+        Keeps the rankings of up to size paginated queries (see cursors.py),
+        each for ttl seconds after it was last used.
+        """
+        self._rankings = RankingCache(size, ttl)
+
+    def use_search_blocks(self, block_rows: int):
+        """
+        Scores queries that can't be answered otherwise block_rows embeddings
+        at a time, keeping only the bits that can still make it into the
+        result, instead of scoring every bit at once. If the embeddings are
+        mapped from a snapshot, each block is released from memory once it's
+        scored, so libraries larger than memory can be searched.
+        """
+        self._search_block_rows = block_rows
+
+    def add_shard(self, bit_ids: List[str]):
+        """
+        Marks bit_ids as coming from one source, e.g. one of several library
+        files that were loaded into self. Queries that route by centroids
+        (see routing.py) cluster each shard separately.
+        """
+        self._shards.append(list(bit_ids))
+        self._router = None
+        self._router_built = False
+        self._router_assignments = None
+
+    @property
+    def shards(self) -> List[List[str]]:
+        return self._shards
+
+    def _embedding_router(self) -> Union[CentroidRouter, None]:
+        """
+        Returns the centroid router for the index, or None if the library is
+        too small for routing to pay off.
+        """
+        if self._router_built:
+            return self._router
+        index = self._embedding_index()
+        # Building the router reads every embedding, which searching in
+        # blocks is meant to avoid.
+        if len(index) >= ROUTING_MIN_EMBEDDINGS and not self._search_block_rows:
+            rows_by_id = {bit_id: row for row, bit_id in enumerate(index.ids)}
+            shards = []
+            unsharded = np.ones(len(index), dtype=np.bool_)
+            for bit_ids in self._shards:
+                rows = np.unique(np.array(
+                    [rows_by_id[bit_id] for bit_id in bit_ids if bit_id in rows_by_id], dtype=np.int64))
+                # A bit that's in several shards is clustered with the first.
+                rows = rows[unsharded[rows]]
+                unsharded[rows] = False
+                shards.append(rows)
+            shards.append(np.nonzero(unsharded)[0])
+            self._router = CentroidRouter(
+                index.matrix, shards, self._row_attributes(), self._router_assignments)
+        self._router_built = True
+        return self._router
+
+    def _row_attributes(self) -> RowAttributes:
+        if self._row_attributes_cache is None:
+            bits = [cast(Bit, self.bit(bit_id)) for bit_id in self._embedding_index().ids]
+            self._row_attributes_cache = RowAttributes(
+                [bit.token_count for bit in bits],
+                [bit.access_tag for bit in bits])
+        return self._row_attributes_cache
+
+    def _info_index(self) -> InfoIndex:
+        if self._info_index_cache is None:
+            bits = [cast(Bit, self.bit(bit_id)) for bit_id in self._embedding_index().ids]
+            self._info_index_cache = InfoIndex(
+                [bit.info.url for bit in bits],
+                [bit.info.title for bit in bits])
+        return self._info_index_cache
+
+    def _lexical_index(self) -> LexicalIndex:
+        # Built by the first hybrid query rather than by prepare(), since it
+        # reads the text of every bit, which a snapshot otherwise leaves in
+        # the file.
+        if self._lexical_index_cache is None:
+            self._lexical_index_cache = LexicalIndex(
+                cast(Bit, self.bit(bit_id)).text for bit_id in self._embedding_index().ids)
+        return self._lexical_index_cache
+
+    def _routed_result(self, query_embedding: NDArray[np.float32], count: int, count_type: str, access_token: Union[str, None], timer: StageTimer) -> Union['Library', None]:
+        """
+        Returns a copy of self with just the bits that can make it into the
+        first count bits visible with access_token, found by scoring the most
+        promising clusters of embeddings until the rest can't contribute.
+        Returns None if the library isn't routed, or if count can't be filled
+        without scoring everything.
+        """
+        if count < 0:
+            return None
+        router = self._embedding_router()
+        if router is None:
+            return None
+        index = self._embedding_index()
+        visible_access_tags = permitted_access(access_token)
+        bounds = router.upper_bounds(query_embedding)
+        rows = np.zeros(0, dtype=np.int64)
+        similarities = np.zeros(0, dtype=np.float32)
+        threshold = None
+        scored_clusters = 0
+        for cluster in np.argsort(-bounds, kind='stable'):
+            if threshold is not None and bounds[cluster] < threshold:
+                # Clusters are in order of their bounds, so none of the rest
+                # can contribute either.
+                break
+            cluster_rows = router.rows[cluster]
+            rows = np.concatenate([rows, cluster_rows])
+            similarities = np.concatenate(
+                [similarities, index.matrix[cluster_rows] @ query_embedding.astype(np.float32, copy=False)])
+            # Most similar first, ties in library order, like sort.
+            order = np.lexsort((rows, -similarities))
+            rows, similarities = rows[order], similarities[order]
+            threshold = ranking_threshold(
+                similarities, router.attributes.visible(rows, visible_access_tags), router.attributes.token_counts[rows], count, count_type)
+            scored_clusters += 1
+        if threshold is None:
+            return None
+        timer.count('scored_bits', len(rows))
+        timer.count('skipped_clusters', len(router) - scored_clusters)
+        # Bits below the threshold were scored but can't make the cut.
+        candidates = similarities >= threshold
+        return self._ranked_copy(
+            list(zip([index.ids[row] for row in rows[candidates]], similarities[candidates].tolist())))
+
+    def _uses_exhaustive_search(self) -> bool:
+        if self._search_block_rows > 0:
+            return True
+        if self._search_threads <= 1:
+            return False
+        return len(shard_bounds(len(self._embedding_index()), self._search_threads)) > 1
+
+    def _exhaustive_result(self, query_embedding: NDArray[np.float32], count: int, count_type: str, access_token: Union[str, None], timer: StageTimer) -> Union['Library', None]:
+        """
+        Returns a copy of self with just the bits that can make it into the
+        first count bits visible with access_token, found by scoring shards
+        of the embeddings on several threads and/or in blocks (see
+        search.py). Returns None if count can't be filled.
+        """
+        index = self._embedding_index()
+        ranking = exhaustive_ranking(
+            index.matrix, query_embedding, self._row_attributes(),
+            permitted_access(access_token), count, count_type, self._search_threads,
+            self._search_block_rows, index.release if index.mapped else None)
+        if ranking is None:
+            return None
+        rows, similarities = ranking
+        timer.count('scored_bits', len(index))
+        return self._ranked_copy(
+            list(zip([index.ids[row] for row in rows], similarities.tolist())))
+
+    def _visible_similarities(self, query_embedding: NDArray[np.float32], visible_access_tags: frozenset[str], timer: StageTimer, rows: Union[NDArray[np.int64], None]) -> tuple[NDArray[np.int64], NDArray[np.float32]]:
+        """
+        Returns the rows of the index (of rows, if given) that are visible
+        with visible_access_tags, and their similarity to query_embedding.
+        """
+        index = self._embedding_index()
+        release = index.release if index.mapped else None
+        with timer.stage('similarity'):
+            if rows is None:
+                # Scored in place (in blocks, if set), so a mapped matrix
+                # isn't copied.
+                similarities = search_similarities(
+                    index.matrix, query_embedding, self._search_threads, self._search_block_rows, release)
+                rows = np.nonzero(self._row_attributes().visible(
+                    slice(None), visible_access_tags))[0]
+                similarities = similarities[rows]
+                timer.count('scored_bits', len(index))
+            else:
+                rows = rows[self._row_attributes().visible(rows, visible_access_tags)]
+                similarities = search_similarities(
+                    index.matrix, query_embedding, self._search_threads, self._search_block_rows, rows=rows)
+                timer.count('scored_bits', len(rows))
+        return rows, similarities
+
+    def _ranking(self, query_embedding: NDArray[np.float32], access_token: Union[str, None], timer: StageTimer, rows: Union[NDArray[np.int64], None] = None) -> Ranking:
+        """
+        Returns every bit with an embedding that's visible with access_token
+        (and, if rows is given, in one of those rows of the index), ranked by
+        similarity to query_embedding.
+        """
+        visible_access_tags = permitted_access(access_token)
+        rows, similarities = self._visible_similarities(
+            query_embedding, visible_access_tags, timer, rows)
+        with timer.stage('sort'):
+            # Most similar first, ties in library order, like sort.
+            order = np.lexsort((rows, -similarities))
+        return Ranking(rows[order], similarities[order], frozenset(visible_access_tags))
+
+    def _hybrid_ranking(self, query_embedding: NDArray[np.float32], query_text: str, access_token: Union[str, None], count: int, count_type: str, timer: StageTimer, rows: Union[NDArray[np.int64], None] = None) -> Ranking:
+        """
+        Returns the bits with an embedding that are visible with access_token
+        (and, if rows is given, in one of those rows of the index) and among
+        the most similar to query_embedding or the best BM25 matches for
+        query_text, ranked by the fusion of both (see lexical.py).
+        """
+        visible_access_tags = permitted_access(access_token)
+        rows, similarities = self._visible_similarities(
+            query_embedding, visible_access_tags, timer, rows)
+        with timer.stage('lexical'):
+            lexical_scores = self._lexical_index().scores(query_text)[rows]
+        with timer.stage('sort'):
+            candidates = max(HYBRID_CANDIDATES, count if count_type == 'bit' else 0)
+            by_similarity = top_positions(similarities, candidates)
+            matching = np.nonzero(lexical_scores > 0)[0]
+            by_lexical_score = matching[top_positions(lexical_scores[matching], candidates)]
+            positions, _ = reciprocal_rank_fusion([by_similarity, by_lexical_score])
+        return Ranking(rows[positions], similarities[positions], frozenset(visible_access_tags), 'hybrid')
+
+    def _mmr_ranking(self, query_embedding: NDArray[np.float32], mmr_lambda: float, candidates: int, access_token: Union[str, None], timer: StageTimer, rows: Union[NDArray[np.int64], None] = None) -> Ranking:
+        """
+        Returns the candidates most similar bits with an embedding that are
+        visible with access_token (and, if rows is given, in one of those
+        rows of the index), reranked by maximal marginal relevance (see
+        diversity.py).
+        """
+        visible_access_tags = permitted_access(access_token)
+        rows, similarities = self._visible_similarities(
+            query_embedding, visible_access_tags, timer, rows)
+        with timer.stage('sort'):
+            positions = top_positions(similarities, candidates)
+        with timer.stage('mmr'):
+            positions = positions[mmr_order(
+                self._embedding_index().matrix[rows[positions]], query_embedding, mmr_lambda)]
+        return Ranking(rows[positions], similarities[positions], frozenset(visible_access_tags), 'mmr')
+
+    def _collapsed_ranking(self, ranking: Ranking, max_similarity: float, per_url: int, count: int, count_type: str, timer: StageTimer) -> Ranking:
+        """
+        Returns ranking without the bits among its first candidates that
+        collapse_mask() drops (see diversity.py).
+        """
+        candidates = max(COLLAPSE_CANDIDATES, count if count_type == 'bit' else 0)
+        with timer.stage('collapse'):
+            rows = ranking.rows[:candidates]
+            keep = collapse_mask(
+                self._embedding_index().matrix[rows], self._info_index().url_codes[rows], max_similarity, per_url)
+            timer.count('collapsed_bits', int(len(keep) - keep.sum()))
+            return ranking._replace(
+                rows=np.concatenate([rows[keep], ranking.rows[candidates:]]),
+                similarities=np.concatenate([ranking.similarities[:candidates][keep], ranking.similarities[candidates:]]))
+
+    def _paginated_result(self, cursor: str, ranking: Union[Ranking, None], access_args: dict, timer: StageTimer) -> 'Library':
+        """
+        Returns the page of results that cursor points to, or the first page
+        of ranking if there's no cursor, with the cursor of the next page (if
+        any) in details.
+        """
+        if self._rankings is None:
+            self._rankings = RankingCache()
+        if cursor:
+            with timer.stage('cursor'):
+                key, offset = decode_cursor(cursor)
+                ranking = self._rankings.get(key)
+                if ranking is None or ranking.access_tags != permitted_access(access_args['access_token']):
+                    raise Exception('The cursor has expired, rerun the query without it')
+        else:
+            assert ranking is not None
+            key = self._rankings.put(ranking)
+            offset = 0
+        result = self._ranking_page(ranking, offset, access_args, timer)
+        next_offset = offset + result.count_bits
+        if next_offset < len(ranking.rows):
+            result.cursor = encode_cursor(key, next_offset)
+        return result
+
+    def _ranking_page(self, ranking: Ranking, offset: int, access_args: dict, timer: StageTimer) -> 'Library':
+        """
+        Returns the first count (see slice()) of the bits of ranking from
+        offset on.
+        """
+        index = self._embedding_index()
+        count, count_type = access_args['count'], access_args['count_type']
+        with timer.stage('copy'):
+            rows = ranking.rows[offset:]
+            if count_type == 'bit':
+                end = count if count >= 0 else len(rows)
+            else:
+                # Up to and including the bit that takes the total over count.
+                token_counts = np.cumsum(self._row_attributes().token_counts[rows])
+                end = int(np.searchsorted(token_counts, count, side='right')) + 1 if count >= 0 else len(rows)
+            page = self._ranked_copy(list(zip(
+                [index.ids[row] for row in rows[:end]],
+                ranking.similarities[offset:offset + end].tolist())), ranking.sort)
+        return page._remove_restricted_bits(
+            **access_args, timer=timer, restricted_count=self._count_restricted(access_args['access_token']))
+
+    def _filter_rows(self, args: dict[str, Union[str, int]], timer: StageTimer) -> Union[NDArray[np.int64], None]:
+        """
+        Returns the rows of the index that match the filters in args (see
+        filters.py), or None if args has no filters.
+        """
+        filters = {
+            name: str(args[name]) for name in FILTER_ARGUMENTS
+            if str(args.get(name, '') or '')
+        }
+        if not filters:
+            return None
+        with timer.stage('filter'):
+            rows = self._info_index().rows(filters)
+            timer.count('filtered_bits', len(rows))
+        return rows
+
+    @property
+    def precomputed(self):
+        """
+        The precomputed queries passed to use_precomputed(), if any.
+        """
+        return self._precomputed
+
+    def _embedding_index(self) -> EmbeddingIndex:
+        if self._index is None:
+            self._index = EmbeddingIndex(self._bits_in_order)
+        return self._index
+
+    @property
+    def embedding_bytes(self) -> Union[int, None]:
+        """
+        The bytes taken by the decoded embeddings of the bits, or None if the
+        index that holds them hasn't been built yet (see prepare()).
+        """
+        return self._index.nbytes if self._index is not None else None
+
+    def prepare(self) -> dict[str, int]:
+        """
+        Decodes every embedding and builds the index (and, for large
+        libraries, the centroid router) used to score queries, so that the
+        first query doesn't have to. Returns a summary of what
+        was prepared.
+        """
+        index = self._embedding_index()
+        router = self._embedding_router()
+        self._info_index()
+        return {
+            'bits': len(self._bits_in_order),
+            'embeddings': len(index),
+            'embedding_bytes': index.nbytes,
+            'clusters': len(router) if router is not None else 0
+        }
+
     def _similarities(self, query_embedding: NDArray[np.float32]):
-        bits = sorted([
-            (vector_similarity(query_embedding, bit.embedding), bit.id)
-            for bit
-            in self.bits
-            if bit.embedding is not None], reverse=True)
-        return {key: value for value, key in bits}
-
-    def compute_similarities(self, query_embedding: Union[NDArray[np.float32], None]):
+        index = self._embedding_index()
+        similarities = index.similarities(query_embedding).tolist()
+        return dict(zip(index.ids, similarities))
+
+    def compute_similarities(self, query_embedding: Union[NDArray[np.float32], None]) -> int:
+        """
+        Sets the similarity of each bit to query_embedding. Returns how many
+        bits were scored.
+        """
         # if we won't store the similarities anyway then don't bother.
         if self.omit_whole_bit or 'similarities' in self.fields_to_omit or query_embedding is None:
-            return
+            return 0
         similarities = self._similarities(query_embedding)
         for bit_id, similarity in similarities.items():
             bit = self.bit(bit_id)
             if not bit:
                 continue
             bit.similarity = similarity
+        return len(similarities)
 
     @classmethod
     def _validate_query_arguments(cls, args: dict[str, Union[str, int]]):
@@ -815,13 +1728,12 @@ class Library:
         if count == 0:
             raise Exception('count must be greater than 0')
 
-        if version < CURRENT_VERSION:
+        if version < OLDEST_QUERY_VERSION:
             # We expect hosts to potentially lag in updating. We want to ensure
             # the format they spit out is understood by the client (lower
-            # versions can be upgraded seamlessly). So as long as our current
-            # version is less than or equal to the client's version everything
-            # should work.
-            raise Exception(f'version must be at least {CURRENT_VERSION}')
+            # versions can be upgraded seamlessly). Clients that lag get their
+            # results in the version they asked for (see result_version).
+            raise Exception(f'version must be at least {OLDEST_QUERY_VERSION}')
 
         if query_embedding_model != EMBEDDINGS_MODEL_ID:
             raise Exception(
@@ -842,40 +1754,183 @@ class Library:
             raise Exception(
                 f'count_type {count_type} is not one of the legal options: {LEGAL_COUNT_TYPES}')
 
+        mmr_lambda = _number_argument(args, 'mmr_lambda', float, MMR_LAMBDA)
+        if not 0 <= mmr_lambda <= 1:
+            raise Exception('mmr_lambda must be between 0 and 1')
+        mmr_candidates = _number_argument(args, 'mmr_candidates', int, MMR_CANDIDATES)
+        if mmr_candidates <= 0:
+            raise Exception('mmr_candidates must be greater than 0')
+        collapse_similarity = _number_argument(args, 'collapse_similarity', float, 0)
+        collapse_per_url = _number_argument(args, 'collapse_per_url', int, 0)
+        if collapse_similarity < 0 or collapse_per_url < 0:
+            raise Exception('collapse_similarity and collapse_per_url must not be negative')
+
         return (query_embedding, {
             'count': count,
             'count_type': count_type,
             'omit': omit,
             'access_token': access_token
+        }, {
+            'mmr_lambda': mmr_lambda,
+            'mmr_candidates': mmr_candidates,
+            'collapse_similarity': collapse_similarity,
+            'collapse_per_url': collapse_per_url
         })
 
-    def _produce_query_result(self, target, query_embedding: NDArray[np.float32]):
-        target.compute_similarities(query_embedding)
-        target.sort = 'similarity'
+    def _produce_query_result(self, target, query_embedding: NDArray[np.float32], timer: StageTimer):
+        with timer.stage('similarity'):
+            timer.count('scored_bits', target.compute_similarities(query_embedding))
+        with timer.stage('sort'):
+            target.sort = 'similarity'
 
-    def _remove_restricted_bits(self, count: int, omit: str, count_type: str, access_token: Union[str, None]):
+    def _precomputed_result(self, query_embedding: NDArray[np.float32], count: int, count_type: str, access_token: Union[str, None]) -> Union['Library', None]:
+        """
+        Returns a copy of self with just the bits of the precomputed ranking
+        for query_embedding, minus restricted bits. Returns None if there's no
+        such ranking, or if it's too short to fill count.
+        """
+        if self._precomputed is None:
+            return None
+        ranking = self._precomputed.match(query_embedding)
+        if ranking is None:
+            return None
+        result = self._ranked_copy(ranking)
+        result.delete_restricted_bits(access_token)
+        ranking_is_complete = len(ranking) >= len(self._embedding_index())
+        if not ranking_is_complete and not result._fills_count(count, count_type):
+            return None
+        return result
+
+    def _remove_restricted_bits(self, count: int, omit: str, count_type: str, access_token: Union[str, None], timer: Union[StageTimer, None] = None, restricted_count: Union[int, None] = None):
+        """
+        Returns the first count of the bits visible with access_token. If
+        restricted_count is provided, it's reported as the number of
+        restricted bits instead of how many were deleted from self.
+        """
+        if timer is None:
+            timer = StageTimer()
         count_type_is_bit = count_type == 'bit'
-        restricted_count = self.delete_restricted_bits(access_token)
-        result = self.slice(count, count_type_is_bit=count_type_is_bit)
-        result.count_bits = len(result.bits)
-        # Now that we know how many bits exist we can set omit, which might
-        # remove all bits.
-        result.omit = omit
-
-        if HOST_CONFIG.restricted.count:
+        with timer.stage('restricted'):
+            deleted_count = self.delete_restricted_bits(access_token)
+            if restricted_count is None:
+                restricted_count = deleted_count
+        with timer.stage('slice'):
+            result = self.slice(count, count_type_is_bit=count_type_is_bit)
+            result.count_bits = len(result.bits)
+            # Now that we know how many bits exist we can set omit, which might
+            # remove all bits.
+            result.omit = omit
+
+        host_config = get_host_config()
+
+        if host_config.restricted.count:
             result.count_restricted = restricted_count
 
-        restricted_message = HOST_CONFIG.restricted.message
+        restricted_message = host_config.restricted.message
 
         if restricted_message and restricted_count > 0:
             result.message = 'Restricted results were omitted. ' + restricted_message
         return result
 
-    def query(self, args: dict[str, Union[str, int]]):
-        query_embedding, access_args = self._validate_query_arguments(args)
-        result = self.copy()
-        self._produce_query_result(result, query_embedding)
-        return result._remove_restricted_bits(**access_args)
+    def query(self, args: dict[str, Union[str, int]], timer: Union[StageTimer, None] = None):
+        """
+        Returns a new library with the bits that best match args.
+
+        If a timer is provided, the time spent in each stage of the query is
+        recorded in it. If args has a truthy debug_timings, the timings are
+        also returned in the result's details.timings.
+        """
+        if timer is None:
+            timer = StageTimer()
+        with timer.stage('validate'):
+            query_embedding, access_args, options = self._validate_query_arguments(args)
+        cursor = str(args.get('cursor', '') or '')
+        paginate = bool(cursor) or str(args.get('paginate', '')).lower() in TRUTHY_ARGUMENT_VALUES
+        ranking = None
+        if not cursor:
+            sort = str(args.get('sort', '') or 'similarity')
+            if sort not in LEGAL_QUERY_SORTS:
+                raise Exception(
+                    f'sort {sort} is not one of the legal options: {LEGAL_QUERY_SORTS}')
+            filter_rows = self._filter_rows(args, timer)
+            if sort == 'hybrid':
+                query_text = str(args.get('query_text', '') or '')
+                if not query_text:
+                    raise Exception('sort hybrid requires query_text')
+                ranking = self._hybrid_ranking(
+                    query_embedding, query_text, access_args['access_token'], access_args['count'], access_args['count_type'], timer, filter_rows)
+            elif sort == 'mmr':
+                ranking = self._mmr_ranking(
+                    query_embedding, options['mmr_lambda'], options['mmr_candidates'], access_args['access_token'], timer, filter_rows)
+            max_similarity = options['collapse_similarity']
+            per_url = options['collapse_per_url']
+            collapse = max_similarity > 0 or per_url > 0
+            if ranking is None and (paginate or collapse or filter_rows is not None):
+                # These need the bits past the first count of them, and only
+                # the rows that match a filter are scored, so there's nothing
+                # for precomputed rankings or routing to save.
+                ranking = self._ranking(
+                    query_embedding, access_args['access_token'], timer, filter_rows)
+            if ranking is not None and collapse:
+                ranking = self._collapsed_ranking(
+                    ranking, max_similarity, per_url, access_args['count'], access_args['count_type'], timer)
+        if paginate:
+            result = self._paginated_result(cursor, ranking, access_args, timer)
+            return self._with_timings(result, args, timer)
+        if ranking is not None:
+            result = self._ranking_page(ranking, 0, access_args, timer)
+            return self._with_timings(result, args, timer)
+        precomputed_result = None
+        # Queries without an embedding get a random one, which can't be one
+        # of the precomputed queries.
+        if self._precomputed is not None and args.get('query_embedding'):
+            with timer.stage('precomputed'):
+                precomputed_result = self._precomputed_result(
+                    query_embedding, access_args['count'], access_args['count_type'], access_args['access_token'])
+        candidates = precomputed_result
+        if candidates is None and self._uses_exhaustive_search():
+            # Searching on several threads takes about as long for every
+            # query, and searching in blocks bounds memory, so when either is
+            # enabled it's preferred over routing.
+            with timer.stage('search'):
+                candidates = self._exhaustive_result(
+                    query_embedding, access_args['count'], access_args['count_type'], access_args['access_token'], timer)
+        elif candidates is None:
+            with timer.stage('routing'):
+                candidates = self._routed_result(
+                    query_embedding, access_args['count'], access_args['count_type'], access_args['access_token'], timer)
+        if candidates is not None:
+            restricted_count = self._count_restricted(access_args['access_token'])
+            result = candidates._remove_restricted_bits(
+                **access_args, timer=timer, restricted_count=restricted_count)
+        else:
+            with timer.stage('copy'):
+                result = self._shallow_copy()
+            self._produce_query_result(result, query_embedding, timer)
+            result = result._remove_restricted_bits(**access_args, timer=timer)
+        return self._with_timings(result, args, timer)
+
+    def _with_timings(self, result: 'Library', args: dict[str, Union[str, int]], timer: StageTimer) -> 'Library':
+        if str(args.get('debug_timings', '')).lower() in TRUTHY_ARGUMENT_VALUES:
+            result.timings = {
+                stage: round(duration * 1000, 3)
+                for stage, duration in timer.durations.items()
+            }
+        return result
+
+
+def _number_argument(args: dict[str, Union[str, int]], name: str, parse: Union[type[int], type[float]], default: Union[int, float]) -> Union[int, float]:
+    """
+    Returns args[name] parsed with parse (int or float), or default if it's
+    missing or empty.
+    """
+    value = args.get(name, '')
+    if value is None or value == '':
+        return default
+    try:
+        return parse(value)
+    except (TypeError, ValueError):
+        raise Exception(f'{name} must be {"an integer" if parse is int else "a number"}, not {value!r}')
 
 
 def _keys_to_omit(configuration='') -> tuple[bool, set[str], Union[str, list[str]]]:
@@ -6,6 +6,7 @@ from numpy.typing import NDArray
 from overrides import override
 
 from .library import Bit, Library
+from .timing import StageTimer
 
 # TODO: Make this configurable. Alternatively if we run out of content before
 # hitting our content bar, fetch another chunk of content from pinecone until we
@@ -27,7 +28,11 @@ class PineconeLibrary(Library):
         super().__init__()
 
     @override
-    def _produce_query_result(self, target, query_embedding: NDArray[np.float32]):
+    def _produce_query_result(self, target, query_embedding: NDArray[np.float32], timer: StageTimer):
+        with timer.stage('similarity'):
+            self._query_index(target, query_embedding)
+
+    def _query_index(self, target, query_embedding: NDArray[np.float32]):
         target.omit = 'embedding'
         pinecone.init(
             api_key=self.config.api_key,
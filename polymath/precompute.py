@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+from typing import List, Union, cast
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .library import EMBEDDINGS_MODEL_ID, EXPECTED_EMBEDDING_LENGTH, Library, base64_from_embedding, vector_from_base64
+
+# Precomputed rankings for a fixed set of queries (typically
+# HostConfig.info.fun_queries), stored next to the library they rank so that
+# the host can answer those queries without scoring every bit.
+#
+# The file is JSON of the form:
+#
+# {
+#   version: 1,
+#   embedding_model: 'openai.com:text-embedding-ada-002',
+#   // Identifies the bits the rankings were computed against.
+#   fingerprint: <hex digest>,
+#   queries: {
+#     <query text>: {
+#       embedding: <base64 embedding>,
+#       // True if the embedding is an offline stand-in rather than a real one
+#       stand_in: false,
+#       // The most similar bits, most similar first.
+#       ranking: [[<bit id>, <similarity>], ...]
+#     }
+#   }
+# }
+
+PRECOMPUTED_VERSION = 1
+
+PRECOMPUTED_EXTENSION = '.precomputed'
+
+# How many bits to keep in each ranking.
+PRECOMPUTED_RANKING_SIZE = 500
+
+# How similar (by cosine) a query embedding must be to a precomputed one to be
+# answered from its ranking. Embeddings of the same text aren't always
+# bit-identical.
+PRECOMPUTED_MATCH_SIMILARITY = 0.9999
+
+# How much the norms of the two may differ, relative to the precomputed one,
+# since the ranking's similarities scale with it.
+PRECOMPUTED_MATCH_NORM_TOLERANCE = 1e-3
+
+Ranking = List[tuple[str, float]]
+
+
+def precomputed_filename(library_filename: str = '', library_dir: str = 'libraries') -> str:
+    """
+    Returns where the precomputed queries for a library are stored. If no
+    library filename is given, it's the file for the default libraries.
+
+    The extension is not .json so that it isn't mistaken for a library.
+    """
+    if library_filename:
+        return library_filename + PRECOMPUTED_EXTENSION
+    return os.path.join(library_dir, 'default' + PRECOMPUTED_EXTENSION)
+
+
+def library_fingerprint(library: Library) -> str:
+    """
+    Returns a digest that changes whenever the set of bits in the library
+    changes.
+    """
+    hash_object = hashlib.sha256()
+    for bit_id in sorted(bit.id for bit in library.bits):
+        hash_object.update(bit_id.encode())
+    return hash_object.hexdigest()
+
+
+def stand_in_embedding(query: str, model_id: str = EMBEDDINGS_MODEL_ID) -> NDArray[np.float32]:
+    """
+    Returns a deterministic unit vector for query, used in place of a real
+    embedding when building offline. It won't match what clients send, but
+    keeps the build working until it's rerun online.
+    """
+    seed = int.from_bytes(hashlib.sha256(query.encode()).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(
+        EXPECTED_EMBEDDING_LENGTH[model_id]).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class PrecomputedQueries:
+    def __init__(self, data: Union[dict, None] = None):
+        self._data = data if data else {
+            'version': PRECOMPUTED_VERSION,
+            'embedding_model': EMBEDDINGS_MODEL_ID,
+            'fingerprint': '',
+            'queries': {}
+        }
+        if self._data.get('version') != PRECOMPUTED_VERSION:
+            raise Exception('Unsupported precomputed queries version')
+        if self._data.get('embedding_model') != EMBEDDINGS_MODEL_ID:
+            raise Exception('Invalid model name')
+        # The unit vectors of the precomputed embeddings, and their norms.
+        self._matrix: Union[NDArray[np.float32], None] = None
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._matrix_queries = cast(List[str], [])
+
+    @classmethod
+    def load(cls, filename: str) -> Union['PrecomputedQueries', None]:
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r') as f:
+            return PrecomputedQueries(json.load(f))
+
+    def save(self, filename: str):
+        with open(filename, 'w') as f:
+            json.dump(self._data, f, indent='\t')
+
+    @property
+    def fingerprint(self) -> str:
+        return self._data['fingerprint']
+
+    @property
+    def queries(self) -> List[str]:
+        return list(self._data['queries'].keys())
+
+    def embedding(self, query: str) -> Union[NDArray[np.float32], None]:
+        record = self._data['queries'].get(query)
+        if not record:
+            return None
+        return vector_from_base64(record['embedding'])
+
+    def is_stand_in(self, query: str) -> bool:
+        record = self._data['queries'].get(query, {})
+        return bool(record.get('stand_in', False))
+
+    def set_embedding(self, query: str, embedding: NDArray[np.float32], stand_in: bool = False):
+        self._data['queries'][query] = {
+            'embedding': base64_from_embedding(embedding),
+            'stand_in': stand_in,
+            'ranking': []
+        }
+        # Rankings need to be recomputed.
+        self._data['fingerprint'] = ''
+        self._matrix = None
+
+    def remove(self, query: str):
+        if query not in self._data['queries']:
+            return
+        del self._data['queries'][query]
+        self._matrix = None
+
+    def is_stale(self, library: Library) -> bool:
+        return self.fingerprint != library_fingerprint(library)
+
+    def rank(self, library: Library):
+        """
+        Recomputes the ranking of every query against library.
+        """
+        index = library._embedding_index()
+        for record in self._data['queries'].values():
+            similarities = index.similarities(
+                vector_from_base64(record['embedding']))
+            count = min(PRECOMPUTED_RANKING_SIZE, len(similarities))
+            top = np.argpartition(-similarities, count - 1)[:count] if count else []
+            ranking = sorted(
+                ((index.ids[row], float(similarities[row])) for row in top),
+                key=lambda item: item[1], reverse=True)
+            record['ranking'] = ranking
+        self._data['fingerprint'] = library_fingerprint(library)
+
+    def match(self, query_embedding: NDArray[np.float32]) -> Union[Ranking, None]:
+        """
+        Returns the precomputed ranking for query_embedding, if it's one of
+        the precomputed queries.
+        """
+        if self._matrix is None:
+            self._matrix_queries = self.queries
+            matrix = np.stack([
+                vector_from_base64(self._data['queries'][query]['embedding'])
+                for query in self._matrix_queries
+            ]) if self._matrix_queries else np.zeros((0, 0), dtype=np.float32)
+            self._norms = np.linalg.norm(matrix, axis=1) if len(matrix) else np.zeros(0, dtype=np.float32)
+            self._matrix = matrix / np.where(self._norms > 0, self._norms, 1)[:, None] if len(matrix) else matrix
+        if not len(self._matrix_queries):
+            return None
+        query_norm = float(np.linalg.norm(query_embedding))
+        if not query_norm:
+            return None
+        similarities = self._matrix @ (query_embedding / query_norm)
+        best = int(np.argmax(similarities))
+        if similarities[best] < PRECOMPUTED_MATCH_SIMILARITY:
+            return None
+        if abs(query_norm - self._norms[best]) > PRECOMPUTED_MATCH_NORM_TOLERANCE * self._norms[best]:
+            return None
+        record = self._data['queries'][self._matrix_queries[best]]
+        return [(bit_id, similarity) for bit_id, similarity in record['ranking']]
+
+
+def load_precomputed_queries(library: Library, filename: str) -> Union[PrecomputedQueries, None]:
+    """
+    Loads the precomputed queries in filename, if any, and attaches them to
+    library. If the library changed since they were computed, they are
+    ranked again (and saved, if the file is writable).
+    """
+    precomputed = PrecomputedQueries.load(filename)
+    if precomputed is None:
+        return None
+    if precomputed.is_stale(library):
+        precomputed.rank(library)
+        try:
+            precomputed.save(filename)
+        except OSError:
+            # e.g. a read-only deployment; the fresh rankings are still used.
+            pass
+    library.use_precomputed(precomputed)
+    return precomputed
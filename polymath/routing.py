@@ -0,0 +1,210 @@
+import math
+from typing import Iterable, List, Union, cast
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Centroid routing lets a query skip parts of a large library that can't make
+# it into the result.
+#
+# The embeddings of each shard (typically one of the library files that were
+# loaded together) are clustered, and each cluster keeps the direction c of
+# its centroid, the widest angle t between c and any of its embeddings, and
+# the largest norm m of its embeddings. If a query q is at an angle p from c,
+# every embedding x in the cluster is at least max(p - t, 0) away from q, so:
+#
+#   q·x <= |q| m cos(max(p - t, 0))
+#
+# Once enough bits to fill a query's count have been found with a similarity
+# above that bound, the cluster can be skipped without changing the result.
+
+# Libraries with fewer embeddings than this are always scored in full.
+ROUTING_MIN_EMBEDDINGS = 4096
+
+# About how many embeddings each cluster gets. Smaller clusters have tighter
+# bounds, so more of them can be skipped, but there are more bounds to check.
+ROUTING_CLUSTER_SIZE = 256
+
+ROUTING_MAX_CLUSTERS_PER_SHARD = 256
+
+ROUTING_KMEANS_ITERATIONS = 6
+
+# Centroids are fit on at most this many embeddings per cluster, then every
+# embedding is assigned to its nearest one.
+ROUTING_KMEANS_SAMPLE_PER_CLUSTER = 16
+
+# Slack added to every bound, so float rounding can't make a cluster that
+# holds a result look skippable.
+ROUTING_BOUND_SLACK = 1e-4
+
+
+def _kmeans(vectors: NDArray[np.float32], cluster_count: int, rng: np.random.Generator) -> NDArray[np.int64]:
+    """
+    Returns the cluster of each vector, grouping them by cosine similarity.
+    """
+    if cluster_count <= 1:
+        return np.zeros(len(vectors), dtype=np.int64)
+    sample_size = min(len(vectors), cluster_count * ROUTING_KMEANS_SAMPLE_PER_CLUSTER)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[:cluster_count].copy()
+    for _ in range(ROUTING_KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(cluster_count):
+            members = sample[assignments == cluster]
+            if len(members):
+                centroid = members.mean(axis=0)
+                norm = np.linalg.norm(centroid)
+                centroids[cluster] = centroid / norm if norm else centroid
+    return np.argmax(vectors @ centroids.T, axis=1)
+
+
+class RowAttributes:
+    """
+    The token_count and access_tag of the bit in each row of a library's
+    embedding matrix, built by Library._row_attributes(), so that queries can
+    rank rows without looking at each bit.
+
+    Args:
+        token_counts: The token_count of each row's bit.
+        access_tags: The access_tag of each row's bit.
+    """
+
+    def __init__(self, token_counts: List[int], access_tags: List[Union[str, None]]):
+        self.token_counts = np.array(token_counts, dtype=np.int64)
+        # Access tags are stored as codes into self.access_tags. Code 0 is no
+        # access tag.
+        self.access_tags = cast(List[Union[str, None]], [None])
+        codes = dict[Union[str, None], int]({None: 0})
+        for access_tag in access_tags:
+            if access_tag not in codes:
+                codes[access_tag] = len(self.access_tags)
+                self.access_tags.append(access_tag)
+        self.access_tag_codes = np.array([codes[access_tag] for access_tag in access_tags], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.token_counts)
+
+    def visible(self, rows: Union[NDArray[np.int64], slice], visible_access_tags: Iterable[str]) -> NDArray[np.bool_]:
+        """
+        Returns which of rows are visible to a token that grants
+        visible_access_tags.
+        """
+        visible_tags = set(visible_access_tags)
+        visible_codes = [
+            code for code, access_tag in enumerate(self.access_tags)
+            if access_tag is None or access_tag in visible_tags
+        ]
+        return np.isin(self.access_tag_codes[rows], visible_codes)
+
+
+class CentroidRouter:
+    """
+    The clusters of a library's embedding matrix, built by
+    Library._embedding_router().
+
+    Args:
+        matrix: The embeddings, one row per embedded bit.
+        shards: Each shard's rows of matrix. Clusters never span shards.
+        attributes: The attributes of each row's bit.
+        assignments: The assignments of an earlier router for the same
+            matrix and shards (e.g. one stored in a snapshot), so that the
+            clusters don't have to be found again.
+    """
+
+    def __init__(self, matrix: NDArray[np.float32], shards: List[NDArray[np.int64]], attributes: RowAttributes,
+                 assignments: Union[NDArray[np.int64], None] = None):
+        self.attributes = attributes
+        rng = np.random.default_rng(0)
+        if assignments is not None and len(assignments) != len(matrix):
+            assignments = None
+        # rows[i] are the rows of matrix in cluster i, in ascending order.
+        self.rows = list[NDArray[np.int64]]()
+        # The cluster of each row of matrix, or -1 if it's in no shard.
+        self.assignments = np.full(len(matrix), -1, dtype=np.int64)
+        # The shard each cluster belongs to.
+        self.shard_of_cluster = list[int]()
+        directions = []
+        max_angles = []
+        max_norms = []
+        min_norms = []
+        for shard_index, shard_rows in enumerate(shards):
+            if not len(shard_rows):
+                continue
+            vectors = matrix[shard_rows]
+            if assignments is not None:
+                # Clusters are numbered in order, so renumbering the earlier
+                # ones from 0 gives the same clusters in the same order.
+                clusters, shard_assignments = np.unique(assignments[shard_rows], return_inverse=True)
+                cluster_count = len(clusters)
+            else:
+                cluster_count = min(
+                    ROUTING_MAX_CLUSTERS_PER_SHARD,
+                    math.ceil(len(shard_rows) / ROUTING_CLUSTER_SIZE),
+                    len(shard_rows))
+                shard_assignments = _kmeans(vectors, cluster_count, rng)
+            for cluster in range(cluster_count):
+                members = shard_assignments == cluster
+                if not members.any():
+                    continue
+                self.assignments[shard_rows[members]] = len(self.rows)
+                member_vectors = vectors[members]
+                centroid = member_vectors.mean(axis=0)
+                centroid_norm = np.linalg.norm(centroid)
+                direction = centroid / centroid_norm if centroid_norm else centroid
+                norms = np.linalg.norm(member_vectors, axis=1)
+                cosines = (member_vectors @ direction) / np.where(norms > 0, norms, 1)
+                self.rows.append(np.sort(shard_rows[members]))
+                self.shard_of_cluster.append(shard_index)
+                directions.append(direction)
+                # A zero centroid says nothing about where the members are.
+                max_angles.append(np.arccos(np.clip(cosines.min(), -1, 1)) if centroid_norm else np.pi)
+                max_norms.append(norms.max())
+                min_norms.append(norms.min())
+        self.directions = np.stack(directions).astype(np.float32) if directions else np.zeros((0, 0), dtype=np.float32)
+        self.max_angles = np.array(max_angles, dtype=np.float64)
+        self.max_norms = np.array(max_norms, dtype=np.float64)
+        self.min_norms = np.array(min_norms, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def upper_bounds(self, query_embedding: NDArray[np.float32]) -> NDArray[np.float32]:
+        """
+        Returns, for each cluster, a similarity that none of its embeddings
+        can exceed.
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query_embedding))
+        if not query_norm:
+            return np.full(len(self), ROUTING_BOUND_SLACK)
+        cosines = (self.directions @ query_embedding) / query_norm
+        angles = np.arccos(np.clip(cosines.astype(np.float64), -1, 1))
+        gaps = np.maximum(angles - self.max_angles, 0)
+        gap_cosines = np.cos(gaps)
+        # When even the closest member points away from the query, the
+        # shortest one is the least dissimilar.
+        norms = np.where(gap_cosines >= 0, self.max_norms, self.min_norms)
+        return query_norm * norms * gap_cosines + ROUTING_BOUND_SLACK
+
+
+def ranking_threshold(similarities: NDArray[np.float32], visible: NDArray[np.bool_], token_counts: NDArray[np.int64], count: int, count_type: str) -> Union[float, None]:
+    """
+    Given the similarities of some rows (sorted most similar first), returns
+    the similarity of the last visible row that Library.slice(count) would
+    look at, or None if those rows don't fill count.
+
+    Rows less similar than that can't be part of the result.
+    """
+    if count < 0:
+        return None
+    visible_similarities = similarities[visible]
+    if count_type == 'bit':
+        if len(visible_similarities) < count or count == 0:
+            return None
+        return float(visible_similarities[count - 1])
+    # slice() stops at the first bit that takes the total over count.
+    over = np.nonzero(np.cumsum(token_counts[visible]) > count)[0]
+    if not len(over):
+        return None
+    return float(visible_similarities[over[0]])
@@ -0,0 +1,190 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .routing import RowAttributes, ranking_threshold
+
+# Exhaustive search scores every embedding of a library, like a full query,
+# but splits the rows into shards that are scored on a pool of threads (NumPy
+# releases the GIL while multiplying). Each shard only keeps its rows that
+# could make it into the result, so merging them is cheap.
+#
+# Shards can also be scored a block of rows at a time, keeping a running set
+# of candidates, so that a library whose embeddings are mapped from a file
+# larger than memory (see snapshot.py) only needs one block of them resident.
+
+# Shards smaller than this aren't worth handing to another thread.
+SEARCH_MIN_ROWS_PER_SHARD = 8192
+
+# Scoring some rows rather than all of them copies their embeddings, so it's
+# done this many rows at a time (unless blocks are smaller) to bound the copy.
+SEARCH_GATHER_BLOCK_ROWS = 1024
+
+_pool_lock = threading.Lock()
+# Pools by size. They're never shut down, since a query on another thread
+# may still be submitting to one; there are only as many as there are
+# distinct shard counts, which search_threads bounds.
+_pools = dict[int, ThreadPoolExecutor]()
+
+
+def _thread_pool(size: int) -> ThreadPoolExecutor:
+    """
+    Returns the pool with size threads shared by every library.
+    """
+    with _pool_lock:
+        if size not in _pools:
+            _pools[size] = ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix='polymath-search')
+        return _pools[size]
+
+
+def shard_bounds(row_count: int, shard_count: int) -> list[tuple[int, int]]:
+    """
+    Returns the [start, end) rows of each shard, splitting row_count rows
+    into at most shard_count shards of at least SEARCH_MIN_ROWS_PER_SHARD.
+    """
+    shard_count = max(1, min(shard_count, row_count // SEARCH_MIN_ROWS_PER_SHARD))
+    edges = np.linspace(0, row_count, shard_count + 1).astype(np.int64).tolist()
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _candidate_size(attributes: RowAttributes, rows: slice, count: int, count_type: str) -> Union[int, None]:
+    """
+    Returns how many of the most similar visible rows are enough to fill
+    count, or None if that can't be known without ranking all of them.
+    """
+    if count_type == 'bit':
+        return count
+    # slice() stops at the first bit that takes the total over count, and
+    # every bit adds at least the smallest token_count.
+    smallest = int(attributes.token_counts[rows].min())
+    if smallest <= 0:
+        return None
+    return count // smallest + 1
+
+
+def ranked_candidates(similarities: NDArray[np.float32], rows: NDArray[np.int64], token_counts: NDArray[np.int64], count: int, count_type: str, size: Union[int, None] = None) -> tuple[NDArray[np.int64], NDArray[np.float32], bool]:
+    """
+    Given the similarities of some visible rows, returns the rows (and their
+    similarities) that can be part of the first count of them, most similar
+    first with ties in row order, and whether they fill count. If size is
+    given, at most about size rows (plus any tied with the last) are needed
+    to fill count.
+    """
+    if size is not None and 0 < size < len(similarities):
+        # Partitioning is much cheaper than sorting all of them.
+        cutoff = -np.partition(-similarities, size - 1)[size - 1]
+        keep = similarities >= cutoff
+        similarities, rows = similarities[keep], rows[keep]
+    order = np.lexsort((rows, -similarities))
+    similarities, rows = similarities[order], rows[order]
+    threshold = ranking_threshold(
+        similarities, np.ones(len(rows), dtype=np.bool_), token_counts[rows], count, count_type)
+    if threshold is None:
+        return rows, similarities, False
+    keep = similarities >= threshold
+    return rows[keep], similarities[keep], True
+
+
+# Called with the [start, end) rows of each block once it has been scored.
+Release = Callable[[int, int], None]
+
+
+def _score_shard(matrix: NDArray[np.float32], start: int, end: int, query_embedding: NDArray[np.float32], attributes: RowAttributes, visible_access_tags: Iterable[str], count: int, count_type: str, block_rows: int, release: Union[Release, None]) -> tuple[NDArray[np.int64], NDArray[np.float32], bool]:
+    size = _candidate_size(attributes, slice(start, end), count, count_type)
+    step = block_rows if block_rows > 0 else end - start
+    rows = np.zeros(0, dtype=np.int64)
+    similarities = np.zeros(0, dtype=np.float32)
+    filled = False
+    for block_start in range(start, end, step):
+        block_end = min(block_start + step, end)
+        block_similarities = matrix[block_start:block_end] @ query_embedding
+        if release is not None:
+            release(block_start, block_end)
+        visible = attributes.visible(slice(block_start, block_end), visible_access_tags)
+        rows = np.concatenate(
+            [rows, np.arange(block_start, block_end, dtype=np.int64)[visible]])
+        similarities = np.concatenate([similarities, block_similarities[visible]])
+        rows, similarities, filled = ranked_candidates(
+            similarities, rows, attributes.token_counts, count, count_type, size)
+    return rows, similarities, filled
+
+
+def exhaustive_ranking(matrix: NDArray[np.float32], query_embedding: NDArray[np.float32], attributes: RowAttributes, visible_access_tags: Iterable[str], count: int, count_type: str, shard_count: int, block_rows: int = 0, release: Union[Release, None] = None) -> Union[tuple[NDArray[np.int64], NDArray[np.float32]], None]:
+    """
+    Scores every row of matrix against query_embedding, shard_count shards
+    at a time, and returns the visible rows that can be part of the first
+    count of them, with their similarities, most similar first. Returns None
+    if the visible rows don't fill count.
+
+    If block_rows is given, each shard is scored that many rows at a time,
+    and release (if given) is called after each block.
+    """
+    if count < 0:
+        return None
+    visible_access_tags = frozenset(visible_access_tags)
+    query_embedding = query_embedding.astype(np.float32, copy=False)
+    bounds = shard_bounds(len(matrix), shard_count)
+    futures = []
+    if len(bounds) > 1:
+        pool = _thread_pool(len(bounds) - 1)
+        futures = [
+            pool.submit(_score_shard, matrix, start, end, query_embedding,
+                        attributes, visible_access_tags, count, count_type, block_rows, release)
+            for start, end in bounds[1:]
+        ]
+    # The query's own thread scores the first shard rather than waiting.
+    start, end = bounds[0]
+    shards = [_score_shard(matrix, start, end, query_embedding, attributes,
+                           visible_access_tags, count, count_type, block_rows, release)]
+    shards += [future.result() for future in futures]
+    rows = np.concatenate([shard_rows for shard_rows, _, _ in shards])
+    similarities = np.concatenate([shard_similarities for _, shard_similarities, _ in shards])
+    rows, similarities, filled = ranked_candidates(
+        similarities, rows, attributes.token_counts, count, count_type)
+    if not filled:
+        return None
+    return rows, similarities
+
+
+def _score_positions(matrix: NDArray[np.float32], rows: Union[NDArray[np.int64], None], start: int, end: int, query_embedding: NDArray[np.float32], step: int, release: Union[Release, None], out: NDArray[np.float32]):
+    for block_start in range(start, end, step):
+        block_end = min(block_start + step, end)
+        if rows is None:
+            out[block_start:block_end] = matrix[block_start:block_end] @ query_embedding
+            if release is not None:
+                release(block_start, block_end)
+        else:
+            out[block_start:block_end] = matrix[rows[block_start:block_end]] @ query_embedding
+
+
+def similarities(matrix: NDArray[np.float32], query_embedding: NDArray[np.float32], shard_count: int, block_rows: int = 0, release: Union[Release, None] = None, rows: Union[NDArray[np.int64], None] = None) -> NDArray[np.float32]:
+    """
+    Returns the similarity of each of rows of matrix (or every row, if rows
+    isn't given) to query_embedding, scoring shard_count shards at a time
+    like exhaustive_ranking().
+    """
+    query_embedding = query_embedding.astype(np.float32, copy=False)
+    count = len(matrix) if rows is None else len(rows)
+    out = np.zeros(count, dtype=np.float32)
+    if not count:
+        return out
+    step = block_rows if block_rows > 0 else count
+    if rows is not None:
+        step = min(step, SEARCH_GATHER_BLOCK_ROWS)
+    bounds = shard_bounds(count, shard_count)
+    futures = []
+    if len(bounds) > 1:
+        pool = _thread_pool(len(bounds) - 1)
+        futures = [
+            pool.submit(_score_positions, matrix, rows, start, end, query_embedding, step, release, out)
+            for start, end in bounds[1:]
+        ]
+    start, end = bounds[0]
+    _score_positions(matrix, rows, start, end, query_embedding, step, release, out)
+    for future in futures:
+        future.result()
+    return out
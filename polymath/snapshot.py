@@ -0,0 +1,239 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import List, Union, cast
+
+import numpy as np
+
+from .library import EmbeddingIndex, Library
+from .textstore import TEXT_STORE_FIELDS, TextStore
+from .types import BitData, LibraryData
+
+# A snapshot is a library's serving state written out after it was loaded, so
+# that a host can restore it without upgrading, validating, hashing ids or
+# decoding embeddings again.
+#
+# The layout follows the binary wire format (see binary.py), except that the
+# embeddings are aligned so the file can be mapped into memory and used as
+# the index matrix directly. The text of each bit is also kept out of the
+# header, in a text store (see textstore.py) that stays in the file until a
+# bit is returned. All integers are little-endian:
+#
+#   magic         4 bytes, b'PLMS'
+#   version       uint16
+#   reserved      uint16
+#   header_len    uint32
+#   header        header_len bytes of UTF-8 JSON (see below)
+#   padding       zeros up to the next multiple of SNAPSHOT_ALIGNMENT
+#   embeddings    rows * dims raw float32, one row per embedded bit.
+#   padding       zeros up to the next multiple of SNAPSHOT_ALIGNMENT
+#   text_offsets  len(library.bits) + 1 uint64, the text store's offsets
+#   texts         text_bytes bytes, the text store's buffer
+#
+# The header is:
+#
+# {
+#   // The files the library was loaded from: [path, size, mtime_ns, sha256]
+#   sources: [...],
+#   // The upgraded library data, with null in place of each bit's
+#   // embedding and text.
+#   library: {...},
+#   // ids[i] is the id of library.bits[i]
+#   ids: [...],
+#   // The positions in library.bits of the bits with an embedding, in the
+#   // order of the embedding rows.
+#   embedded: [...],
+#   // The positions in library.bits of the bits in each of library.shards
+#   shards: [[...], ...],
+#   // The centroid router's cluster of each embedding row (see routing.py),
+#   // or null if the library is too small to route
+#   clusters: [...],
+#   rows: <int>,
+#   dims: <int>,
+#   text_bytes: <int>
+# }
+
+SNAPSHOT_MAGIC = b'PLMS'
+SNAPSHOT_VERSION = 2
+
+SNAPSHOT_EXTENSION = '.snapshot'
+
+SNAPSHOT_ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct('<4sHHI')
+
+Source = List[Union[str, int]]
+
+
+def snapshot_filename(library_filename: str = '', library_dir: str = 'libraries') -> str:
+    """
+    Returns where the snapshot of a library is stored. If no library filename
+    is given, it's the snapshot of the default libraries.
+    """
+    if library_filename:
+        return library_filename + SNAPSHOT_EXTENSION
+    return os.path.join(library_dir, 'default' + SNAPSHOT_EXTENSION)
+
+
+def _file_digest(filename: str) -> str:
+    hash_object = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def describe_sources(filenames: List[str]) -> List[Source]:
+    result = cast(List[Source], [])
+    for filename in sorted(filenames):
+        stat = os.stat(filename)
+        result.append(
+            [filename, stat.st_size, stat.st_mtime_ns, _file_digest(filename)])
+    return result
+
+
+def sources_match(sources: List[Source], filenames: List[str]) -> bool:
+    """
+    Returns True if filenames are the same files, with the same contents, as
+    sources. Contents are only hashed when a file's modification time changed
+    (e.g. because a deploy didn't preserve it).
+    """
+    if sorted(filenames) != [source[0] for source in sources]:
+        return False
+    for filename, size, mtime_ns, digest in sources:
+        filename = str(filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if stat.st_size != size:
+            return False
+        if stat.st_mtime_ns == mtime_ns:
+            continue
+        if _file_digest(filename) != digest:
+            return False
+    return True
+
+
+def write_snapshot(library: Library, filename: str, source_filenames: List[str]):
+    """
+    Writes the snapshot of library, loaded from source_filenames, to filename.
+
+    The file is replaced atomically, so a host starting at the same time
+    never maps a partial snapshot.
+    """
+    index = library._embedding_index()
+    bits = []
+    ids = []
+    embedded = []
+    full_bits = []
+    infos, info_positions = library._serializable_infos()
+    for position, bit in enumerate(library.bits):
+        has_embedding = bit.embedding is not None
+        data = library._serializable_bit(
+            bit, info_positions, include_access_tag=True, encode_embedding=False)
+        full_bits.append(data)
+        # Fields that aren't in the header are left as placeholders so that
+        # restored bits keep their key order.
+        bits.append({
+            key: None if key == 'embedding' or key in TEXT_STORE_FIELDS else value
+            for key, value in data.items()
+            if key != 'embedding' or has_embedding
+        })
+        ids.append(bit.id)
+        if has_embedding:
+            embedded.append(position)
+    positions = {bit_id: position for position, bit_id in enumerate(ids)}
+    shards = [
+        [positions[bit_id] for bit_id in shard if bit_id in positions]
+        for shard in library.shards
+    ]
+    rows, dims = index.matrix.shape if len(index) else (0, 0)
+    # Finding the clusters is the slowest part of loading a large library,
+    # so they are found once here rather than by every host that restores it.
+    router = library._embedding_router()
+    text_offsets, texts = TextStore.encode(full_bits)
+    header = {
+        'sources': describe_sources(source_filenames),
+        'library': {**library._serializable_header(infos), 'bits': bits},
+        'ids': ids,
+        'embedded': embedded,
+        'shards': shards,
+        'clusters': router.assignments.tolist() if router else None,
+        'rows': rows,
+        'dims': dims,
+        'text_bytes': len(texts)
+    }
+    header_bytes = json.dumps(header).encode()
+    preamble = _PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(header_bytes))
+    offset = len(preamble) + len(header_bytes)
+    padding = -offset % SNAPSHOT_ALIGNMENT
+    embedding_bytes = np.ascontiguousarray(index.matrix, dtype='<f4').tobytes()
+    offset += padding + len(embedding_bytes)
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        f.write(preamble)
+        f.write(header_bytes)
+        f.write(b'\0' * padding)
+        f.write(embedding_bytes)
+        f.write(b'\0' * (-offset % SNAPSHOT_ALIGNMENT))
+        f.write(text_offsets.astype('<u8').tobytes())
+        f.write(texts)
+    os.replace(temp_filename, filename)
+
+
+def load_snapshot(filename: str, source_filenames: Union[List[str], None] = None) -> Union[Library, None]:
+    """
+    Returns the library in the snapshot at filename, or None if there is no
+    snapshot, it was written by a different version, or (if source_filenames
+    is given) it is stale compared with source_filenames.
+
+    Embeddings, and the text and info of bits, are mapped from the file
+    rather than read, so they are only paged in as queries touch them, and
+    are shared between processes.
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < _PREAMBLE.size:
+            return None
+        contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _, header_len = _PREAMBLE.unpack_from(contents, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    offset = _PREAMBLE.size
+    header = json.loads(contents[offset:offset + header_len])
+    if source_filenames is not None and not sources_match(header['sources'], source_filenames):
+        return None
+    data = cast(LibraryData, header['library'])
+    if data.get('version') != Library.CURRENT_VERSION:
+        return None
+    offset += header_len
+    offset += -offset % SNAPSHOT_ALIGNMENT
+    rows, dims = header['rows'], header['dims']
+    embeddings_offset = offset
+    if rows:
+        matrix = np.frombuffer(contents, dtype='<f4', count=rows * dims,
+                               offset=offset).reshape(rows, dims)
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    bits = cast(list[BitData], data['bits'])
+    offset += rows * dims * 4
+    offset += -offset % SNAPSHOT_ALIGNMENT
+    text_offsets = np.frombuffer(contents, dtype='<u8', count=len(bits) + 1, offset=offset)
+    offset += text_offsets.nbytes
+    texts = memoryview(contents)[offset:offset + header['text_bytes']]
+    ids = cast(List[str], header['ids'])
+    embedded = cast(List[int], header['embedded'])
+    for row, position in enumerate(embedded):
+        bits[position]['embedding'] = matrix[row]
+    index = EmbeddingIndex.from_matrix(
+        [ids[position] for position in embedded], matrix, contents, embeddings_offset)
+    result = Library._restore(data, ids, index, TextStore(texts, text_offsets))
+    for shard in header.get('shards', []):
+        result.add_shard([ids[position] for position in shard])
+    if header.get('clusters') is not None:
+        result._router_assignments = np.array(header['clusters'], dtype=np.int64)
+    return result
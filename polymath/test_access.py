@@ -0,0 +1,56 @@
+from polymath.access import AccessIndex, access_token_id, is_admin_token, permitted_access
+from polymath.config.types import HostConfig
+
+
+def test_admin_token(host_config):
+    assert not is_admin_token('')
+    assert not is_admin_token('anything')
+    host_config(HostConfig({'admin_token': 'sesame'}))
+    assert is_admin_token('sesame')
+    assert not is_admin_token('')
+    assert not is_admin_token('sesam')
+    # Not ASCII, which compare_digest can't compare as a str.
+    assert not is_admin_token('sésame')
+
+
+def _config() -> HostConfig:
+    return HostConfig({
+        'default_private_access_tag': 'private',
+        'tokens': {
+            'a@example.com': {'token': 'a', 'access_tags': ['team', 'extra']},
+            'b@example.com': {'token': 'b', 'access_tags': ['extra', 'team']},
+            'c@example.com': {'token': 'c'},
+            'd@example.com': {'token': 'a', 'access_tags': ['other']},
+            'e@example.com': {'access_tags': ['team']},
+        }
+    })
+
+
+def test_access_index_resolves_tokens():
+    index = AccessIndex(_config())
+    # The second record with token a, and the one without a token, are
+    # skipped.
+    assert len(index) == 3
+    a = index.get('a')
+    assert a is not None
+    assert a.user_id == 'a@example.com'
+    assert a.access_tags == frozenset(['team', 'extra'])
+    # Tokens without tags get the default private tag.
+    assert index.get('c').access_tags == frozenset(['private'])
+    assert index.get('') is None
+    assert index.get(None) is None
+    assert index.get('unknown') is None
+
+
+def test_equal_tag_sets_are_shared():
+    index = AccessIndex(_config())
+    assert index.get('a').access_tags is index.get('b').access_tags
+
+
+def test_permitted_access(host_config):
+    host_config(_config())
+    assert permitted_access('a') == frozenset(['team', 'extra'])
+    assert permitted_access('unknown') == frozenset()
+    assert permitted_access(None) == frozenset()
+    assert access_token_id('b') == 'b@example.com'
+    assert access_token_id('unknown') is None
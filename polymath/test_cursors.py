@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from polymath import cursors
+from polymath.config.types import HostConfig
+from polymath.cursors import Ranking, RankingCache, decode_cursor, encode_cursor
+from polymath.conftest import make_library, query_args
+from polymath.library import Library
+
+
+def _ranking() -> Ranking:
+    return Ranking(np.arange(3), np.zeros(3, dtype=np.float32), frozenset())
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor('a.b-c', 12)) == ('a.b-c', 12)
+    for cursor in ['', 'abc', 'abc.', '.3', 'abc.-1']:
+        with pytest.raises(Exception):
+            decode_cursor(cursor)
+
+
+def test_rankings_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cursors.time, 'monotonic', lambda: now[0])
+    cache = RankingCache(size=4, ttl=10)
+    key = cache.put(_ranking())
+    now[0] += 8
+    assert cache.get(key) is not None
+    # Using it keeps it for another ttl.
+    now[0] += 8
+    assert cache.get(key) is not None
+    now[0] += 11
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_rankings_are_evicted():
+    cache = RankingCache(size=2, ttl=60)
+    first = cache.put(_ranking())
+    second = cache.put(_ranking())
+    assert cache.get(first) is not None
+    cache.put(_ranking())
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert len(cache) == 2
+
+
+def _library() -> Library:
+    return make_library(40, bit=lambda i: {
+        'token_count': 10 + i % 7,
+        **({'access_tag': 'team'} if i % 5 == 0 else {})
+    })
+
+
+@pytest.mark.parametrize('count,count_type', [(3, 'bit'), (35, 'token')])
+def test_pages_add_up_to_the_full_result(count, count_type):
+    library = _library()
+    expected = [bit.id for bit in library.query(query_args(count=1000, count_type='bit')).bits]
+    page = library.query(query_args(count=count, count_type=count_type, paginate='true'))
+    first = library.query(query_args(count=count, count_type=count_type))
+    assert [bit.id for bit in page.bits] == [bit.id for bit in first.bits]
+    ids = [bit.id for bit in page.bits]
+    while page.cursor:
+        page = library.query(query_args(count=count, count_type=count_type, cursor=page.cursor))
+        ids += [bit.id for bit in page.bits]
+    assert ids == expected
+
+
+def test_cursors_are_bound_to_access(host_config):
+    host_config(HostConfig({'tokens': {'user': {'token': 'secret', 'access_tags': ['team']}}}))
+    library = _library()
+    page = library.query(query_args(count=3, count_type='bit', paginate='true', access_token='secret'))
+    assert page.cursor
+    assert library.query(query_args(count=3, count_type='bit', cursor=page.cursor, access_token='secret')).bits
+    with pytest.raises(Exception):
+        library.query(query_args(count=3, count_type='bit', cursor=page.cursor))
+
+
+def test_expired_cursors_are_an_error():
+    library = _library()
+    library.use_cursor_cache(1, 600)
+    page = library.query(query_args(count=3, count_type='bit', paginate='true'))
+    library.query(query_args(count=3, count_type='bit', paginate='true'))
+    with pytest.raises(Exception, match='expired'):
+        library.query(query_args(count=3, count_type='bit', cursor=page.cursor))
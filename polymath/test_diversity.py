@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from polymath.conftest import make_library, query_args, random_embedding
+from polymath.diversity import collapse_mask, mmr_order
+from polymath.library import Library
+
+
+def _greedy_mmr(embeddings: np.ndarray, query_embedding: np.ndarray, mmr_lambda: float) -> list[int]:
+    candidates = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    relevance = candidates @ (query_embedding / np.linalg.norm(query_embedding))
+    order = [int(np.argmax(relevance))]
+    while len(order) < len(candidates):
+        scores = {
+            i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max(float(candidates[i] @ candidates[j]) for j in order)
+            for i in range(len(candidates)) if i not in order
+        }
+        order.append(max(scores, key=lambda i: (scores[i], -i)))
+    return order
+
+
+def test_mmr_order_matches_greedy_picks():
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((25, 6)).astype(np.float32)
+    query_embedding = rng.standard_normal(6).astype(np.float32)
+    for mmr_lambda in [0, 0.3, 0.7]:
+        assert mmr_order(embeddings, query_embedding, mmr_lambda).tolist() == _greedy_mmr(
+            embeddings, query_embedding, mmr_lambda)
+
+
+def test_mmr_order_with_lambda_1_is_similarity_order():
+    rng = np.random.default_rng(1)
+    query_embedding = rng.standard_normal(6).astype(np.float32)
+    embeddings = rng.standard_normal((10, 6)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    expected = np.argsort(-(embeddings @ query_embedding), kind='stable')
+    assert mmr_order(embeddings, query_embedding, 1).tolist() == expected.tolist()
+
+
+def test_collapse_mask_drops_duplicates_of_kept_bits_only():
+    embeddings = np.array([
+        [1, 0, 0],
+        [0.9, 0.44, 0],  # Like 0, dropped.
+        [0.6, 0.8, 0],  # Like 1, but 1 was dropped and it's unlike 0.
+        [0, 0, 1],
+    ], dtype=np.float32)
+    codes = np.array([-1, -1, -1, -1])
+    assert collapse_mask(embeddings, codes, 0.85).tolist() == [True, False, True, True]
+    assert collapse_mask(embeddings, codes).tolist() == [True] * 4
+
+
+def test_collapse_mask_caps_bits_per_url():
+    embeddings = np.eye(6, dtype=np.float32)
+    codes = np.array([0, 1, 0, 0, -1, -1])
+    assert collapse_mask(embeddings, codes, per_url=2).tolist() == [True, True, True, False, True, True]
+    assert collapse_mask(embeddings, codes, per_url=1).tolist() == [True, True, False, False, True, True]
+
+
+def _library(embeddings: list[np.ndarray], urls: list[str], similarities: list[float]) -> Library:
+    return make_library(embeddings=embeddings, sort='similarity', bit=lambda i: {
+        'text': f'{urls[i]} {similarities[i]}',
+        'similarity': similarities[i],
+        'info': {'url': urls[i]}
+    })
+
+
+def test_library_collapse_after_extend():
+    rng = np.random.default_rng(2)
+    shared = random_embedding(rng)
+    other = random_embedding(rng)
+    combined = _library([shared, other], ['https://a.example/page', 'https://a.example/other'], [0.9, 0.5])
+    # The same content, mirrored by another host under another url.
+    combined.extend(_library([shared * 1.001], ['https://mirror.example/page'], [0.8]))
+    assert len(combined.bits) == 3
+    assert combined.collapse(max_similarity=0.99) == 1
+    assert [bit.info.url for bit in combined.bits] == ['https://a.example/page', 'https://a.example/other']
+    assert combined.collapse(per_url=1) == 0
+
+
+def test_collapsed_query():
+    rng = np.random.default_rng(4)
+    query_embedding = random_embedding(rng)
+    near = query_embedding + 0.1 * random_embedding(rng)
+    embeddings = [near, near * 1.001] + [query_embedding + 0.5 * random_embedding(rng) for _ in range(4)]
+    urls = ['https://a.example/1', 'https://mirror.example/1', 'https://b.example/', 'https://b.example/', 'https://b.example/', 'https://c.example/']
+    library = _library(embeddings, urls, [0.9, 0.8, 0.7, 0.6, 0.5, 0.4])
+    args = query_args(query_embedding, count=4)
+    plain = library.query(args)
+    assert len(plain.bits) == 4
+    result = library.query({**args, 'collapse_similarity': 0.99, 'collapse_per_url': 1})
+    urls = [bit.info.url for bit in result.bits]
+    # One of the mirrored pair, one bit of b.example, and c.example.
+    assert len(urls) == 3
+    assert len({url for url in urls if url.endswith('/1')}) == 1
+    assert sorted(url for url in urls if not url.endswith('/1')) == ['https://b.example/', 'https://c.example/']
+    # Empty values are the default, no collapsing.
+    assert len(library.query({**args, 'collapse_similarity': '', 'collapse_per_url': ''}).bits) == 4
+    with pytest.raises(Exception, match='must not be negative'):
+        library.query({**args, 'collapse_per_url': -1})
+    with pytest.raises(Exception, match="collapse_similarity must be a number, not 'x'"):
+        library.query({**args, 'collapse_similarity': 'x'})
+
+
+def test_mmr_query():
+    rng = np.random.default_rng(3)
+    query_embedding = random_embedding(rng)
+    near = query_embedding + 0.1 * random_embedding(rng)
+    embeddings = [near, near * 1.001, query_embedding + 0.8 * random_embedding(rng)]
+    library = _library(embeddings, ['https://a.example/1', 'https://a.example/2', 'https://a.example/3'], [0, 0, 0])
+    args = query_args(query_embedding, count=2)
+    plain = library.query(args)
+    assert {bit.info.url for bit in plain.bits} == {'https://a.example/1', 'https://a.example/2'}
+    # The first two bits are near-duplicates, so MMR picks the third second.
+    result = library.query({**args, 'sort': 'mmr', 'mmr_lambda': 0.5})
+    assert result.sort == 'mmr'
+    assert [bit.info.url for bit in result.bits][1:] == ['https://a.example/3']
+    # Lambda 0 is legal, and an empty value is the default.
+    library.query({**args, 'sort': 'mmr', 'mmr_lambda': '0', 'mmr_candidates': ''})
+    for mmr_lambda in (-0.1, 1.5):
+        with pytest.raises(Exception, match='mmr_lambda must be between 0 and 1'):
+            library.query({**args, 'sort': 'mmr', 'mmr_lambda': mmr_lambda})
+    with pytest.raises(Exception, match="mmr_lambda must be a number, not 'high'"):
+        library.query({**args, 'sort': 'mmr', 'mmr_lambda': 'high'})
+    with pytest.raises(Exception, match='mmr_candidates must be greater than 0'):
+        library.query({**args, 'sort': 'mmr', 'mmr_candidates': 0})
+    with pytest.raises(Exception, match="mmr_candidates must be an integer, not '1.5'"):
+        library.query({**args, 'sort': 'mmr', 'mmr_candidates': '1.5'})
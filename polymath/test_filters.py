@@ -0,0 +1,66 @@
+import pytest
+
+from polymath.conftest import make_library, query_args
+from polymath.filters import InfoIndex
+
+URLS = [
+    'https://developer.mozilla.org/en-US/docs/Web/API/Document',
+    'https://developer.mozilla.org/en-US/docs/Web/CSS',
+    'https://Example.com/blog/post',
+    '',
+    'https://developer.mozilla.org/en-US/docs/Web/API/Document',
+]
+TITLES = ['Document: querySelector', 'CSS basics', 'Hello, World', '', 'Document']
+
+
+def _index() -> InfoIndex:
+    return InfoIndex(URLS, TITLES)
+
+
+def test_url_prefix():
+    index = _index()
+    assert index.rows({'filter_url_prefix': 'https://developer.mozilla.org/en-US/docs/Web/API'}).tolist() == [0, 4]
+    assert index.rows({'filter_url_prefix': 'https://developer.mozilla.org/'}).tolist() == [0, 1, 4]
+    assert index.rows({'filter_url_prefix': 'https://nowhere'}).tolist() == []
+
+
+def test_hostname_is_case_insensitive():
+    index = _index()
+    assert index.rows({'filter_hostname': 'example.com'}).tolist() == [2]
+    assert index.rows({'filter_hostname': 'DEVELOPER.mozilla.org'}).tolist() == [0, 1, 4]
+
+
+def test_title_needs_every_word():
+    index = _index()
+    assert index.rows({'filter_title': 'document'}).tolist() == [0, 4]
+    assert index.rows({'filter_title': 'QUERYSELECTOR document'}).tolist() == [0]
+    assert index.rows({'filter_title': 'world hello'}).tolist() == [2]
+    assert index.rows({'filter_title': 'docu'}).tolist() == []
+    # No words, no filter.
+    assert index.rows({'filter_title': '...'}).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_filters_combine():
+    index = _index()
+    assert index.rows({'filter_hostname': 'developer.mozilla.org', 'filter_title': 'css'}).tolist() == [1]
+    assert index.rows({}).tolist() == [0, 1, 2, 3, 4]
+    with pytest.raises(Exception):
+        index.rows({'filter_color': 'red'})
+
+
+def test_url_codes():
+    codes = _index().url_codes.tolist()
+    assert codes[0] == codes[4]
+    assert len({codes[0], codes[1], codes[2]}) == 3
+    assert codes[3] == -1
+
+
+def test_filtered_query_only_returns_matching_bits():
+    library = make_library(30, bit=lambda i: {'info': {'url': URLS[i % 3], 'title': TITLES[i % 3]}})
+    args = query_args(count=4)
+    expected = [
+        bit.id for bit in library.query({**args, 'count': 100}).bits
+        if bit.info.url.startswith('https://developer.mozilla.org/')
+    ][:4]
+    result = library.query({**args, 'filter_hostname': 'developer.mozilla.org'})
+    assert [bit.id for bit in result.bits] == expected
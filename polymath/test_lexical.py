@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from polymath.conftest import make_library, query_args
+from polymath.lexical import HYBRID_RRF_K, LexicalIndex, reciprocal_rank_fusion, terms, top_positions
+from polymath.library import Library
+
+
+def test_terms():
+    assert terms('Array.prototype.flatMap() returns a NEW array') == [
+        'array', 'prototype', 'flatmap', 'returns', 'a', 'new', 'array']
+    assert terms('') == []
+
+
+def test_bm25_scores():
+    index = LexicalIndex([
+        'the cat sat on the mat',
+        'the dog sat on the log',
+        'the cat chased the dog',
+        '',
+    ])
+    assert len(index) == 4
+    assert index.scores('bird').tolist() == [0, 0, 0, 0]
+    assert index.scores('').tolist() == [0, 0, 0, 0]
+    scores = index.scores('cat')
+    assert scores[0] > 0 and scores[2] > 0
+    assert scores[1] == 0 and scores[3] == 0
+    # A rarer term counts for more than a common one.
+    assert index.scores('mat')[0] > index.scores('the')[0]
+    # Terms are case-insensitive and counted once per query.
+    assert np.allclose(index.scores('CAT cat'), scores)
+    assert np.allclose(index.scores('cat mat'), scores + index.scores('mat'))
+
+
+def test_bm25_prefers_shorter_texts():
+    index = LexicalIndex(['flatmap', 'flatmap and a lot of other words too'])
+    scores = index.scores('flatmap')
+    assert scores[0] > scores[1] > 0
+
+
+def test_top_positions():
+    scores = np.array([0.5, 0.9, 0.5, 0.1, 0.9], dtype=np.float32)
+    assert top_positions(scores, 3).tolist() == [1, 4, 0]
+    assert top_positions(scores, 10).tolist() == [1, 4, 0, 2, 3]
+    assert top_positions(scores, 0).tolist() == []
+    assert top_positions(scores, -1).tolist() == []
+
+
+def test_reciprocal_rank_fusion():
+    rows, scores = reciprocal_rank_fusion([
+        np.array([3, 1, 2], dtype=np.int64),
+        np.array([1, 5], dtype=np.int64),
+    ])
+    # Row 1 is in both rankings, so it beats row 3, which is only first in one.
+    assert rows.tolist() == [1, 3, 5, 2]
+    assert scores[0] == pytest.approx(1 / (HYBRID_RRF_K + 2) + 1 / (HYBRID_RRF_K + 1))
+    assert scores[1] == pytest.approx(1 / (HYBRID_RRF_K + 1))
+    # Ties are in row order.
+    rows, _ = reciprocal_rank_fusion([np.array([5], dtype=np.int64), np.array([3], dtype=np.int64)])
+    assert rows.tolist() == [3, 5]
+    rows, scores = reciprocal_rank_fusion([])
+    assert rows.tolist() == [] and scores.tolist() == []
+
+
+def _library(texts: list[str]) -> Library:
+    return make_library(len(texts), bit=lambda i: {'text': texts[i], 'info': {'url': f'https://example.com/{i}', 'title': f'Page {i}'}})
+
+
+def _args(library: Library, **kwargs) -> dict:
+    # As similar as can be to the first bit.
+    return query_args(library.bits[0].embedding, count=2, **kwargs)
+
+
+def test_hybrid_query():
+    library = _library([f'filler text {i}' for i in range(20)] + ['the flatmap method'])
+    with pytest.raises(Exception):
+        library.query(_args(library, sort='hybrid'))
+    result = library.query(_args(library, sort='hybrid', query_text='flatMap'))
+    assert result.sort == 'hybrid'
+    # The only bit with the query's text is in both rankings, so it beats the
+    # bit most similar to the query embedding, which isn't similar enough to
+    # be in a plain query's result.
+    assert [bit.text for bit in result.bits] == ['the flatmap method', 'filler text 0']
+    plain = library.query(_args(library))
+    assert 'the flatmap method' not in [bit.text for bit in plain.bits]
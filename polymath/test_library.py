@@ -0,0 +1,175 @@
+import copy
+import json
+import os
+
+import numpy as np
+import pytest
+
+from polymath.conftest import DIMS, query_args
+from polymath.library import EMBEDDINGS_MODEL_ID, Library, base64_from_embedding, result_version
+from polymath.snapshot import load_snapshot, write_snapshot
+from polymath.upgrade import upgrade_library_data
+
+
+def _v1_data() -> dict:
+    rng = np.random.default_rng(0)
+    return {
+        'version': 1,
+        'embedding_model': EMBEDDINGS_MODEL_ID,
+        'bits': [{
+            'text': f'chunk {i}',
+            'token_count': 10 + i,
+            'embedding': base64_from_embedding(rng.standard_normal(DIMS).astype(np.float32)),
+            # Chunks of the same page have equal (but not shared) infos.
+            'info': {'url': 'https://example.com/page', 'title': 'Page'} if i < 2 else {'url': 'https://example.com/other'}
+        } for i in range(3)]
+    }
+
+
+def _infos(library: Library) -> list:
+    return [(bit.info.url, bit.info.title) for bit in library.bits]
+
+
+EXPECTED_INFOS = [
+    ('https://example.com/page', 'Page'),
+    ('https://example.com/page', 'Page'),
+    ('https://example.com/other', ''),
+]
+
+
+def test_upgrade_from_1_stores_shared_infos_once():
+    data = _v1_data()
+    assert upgrade_library_data(data)
+    assert data['version'] == 2
+    assert data['infos'] == [
+        {'url': 'https://example.com/page', 'title': 'Page'},
+        {'url': 'https://example.com/other'},
+    ]
+    assert [bit['info'] for bit in data['bits']] == [0, 0, 1]
+    assert list(data.keys())[-2:] == ['infos', 'bits']
+    assert not upgrade_library_data(data)
+
+
+def test_upgrade_from_0_chains_to_current():
+    data = _v1_data()
+    bits = data.pop('bits')
+    data['version'] = 0
+    data['content'] = {f'id{i}': bit for i, bit in enumerate(bits)}
+    assert upgrade_library_data(data)
+    assert data['version'] == Library.CURRENT_VERSION
+    assert [bit['info'] for bit in data['bits']] == [0, 0, 1]
+
+
+def test_library_from_v1_shares_infos():
+    library = Library(data=_v1_data())
+    assert _infos(library) == EXPECTED_INFOS
+    bits = library.bits
+    assert bits[0]._data['info'] is bits[1]._data['info']
+    assert len(library.unique_infos) == 2
+
+
+def test_unknown_info_position_is_an_error():
+    data = _v1_data()
+    upgrade_library_data(data)
+    data['bits'][2]['info'] = 5
+    with pytest.raises(Exception):
+        Library(data=data)
+
+
+def _check_serialized(data: dict):
+    assert data['version'] == Library.CURRENT_VERSION
+    assert len(data['infos']) == 2
+    assert [bit['info'] for bit in data['bits']] == [0, 0, 1]
+
+
+def test_json_round_trip():
+    library = Library(data=_v1_data())
+    data = json.loads(json.dumps(library.serializable()))
+    _check_serialized(data)
+    assert json.loads(''.join(library.serialized_chunks())) == data
+    assert _infos(Library(data=data)) == EXPECTED_INFOS
+
+
+def test_ndjson_round_trip():
+    library = Library(data=_v1_data())
+    data = Library.load_data_lines(library.serialized_lines())
+    _check_serialized(data)
+    assert _infos(Library(data=data)) == EXPECTED_INFOS
+
+
+def test_binary_round_trip():
+    library = Library(data=_v1_data())
+    result = Library(binary=b''.join(library.serialized_binary()))
+    assert _infos(result) == EXPECTED_INFOS
+    assert np.allclose(result.bits[2].embedding, library.bits[2].embedding)
+    _check_serialized(result.serializable())
+
+
+def test_snapshot_round_trip(tmp_path):
+    source = os.path.join(tmp_path, 'library.json')
+    with open(source, 'w') as f:
+        json.dump(_v1_data(), f)
+    library = Library(filename=source)
+    snapshot = os.path.join(tmp_path, 'library.json.snapshot')
+    write_snapshot(library, snapshot, [source])
+    result = load_snapshot(snapshot, [source])
+    assert result is not None
+    assert _infos(result) == EXPECTED_INFOS
+    assert [bit.text for bit in result.bits] == [bit.text for bit in library.bits]
+    assert result.serializable() == library.serializable()
+
+
+def test_version_1_has_infos_inline():
+    library = Library(data=_v1_data())
+    data = json.loads(json.dumps(library.serializable(version=1)))
+    assert data['version'] == 1
+    assert 'infos' not in data
+    assert [bit['info'] for bit in data['bits']] == [bit['info'] for bit in _v1_data()['bits']]
+    assert json.loads(''.join(library.serialized_chunks(version=1))) == data
+    assert Library.load_data_lines(library.serialized_lines(version=1)) == data
+    assert _infos(Library(data=data)) == EXPECTED_INFOS
+    result = Library(binary=b''.join(library.serialized_binary(version=1)))
+    assert _infos(result) == EXPECTED_INFOS
+    with pytest.raises(Exception, match='only 1 and'):
+        library.serializable(version=0)
+
+
+def test_queries_for_version_1_are_answered_in_version_1():
+    library = Library(data=_v1_data())
+    args = query_args(library.bits[0].embedding, version=1, count=2)
+    result = library.query(args)
+    assert len(result.bits) == 2
+    assert result_version(args) == 1
+    assert result_version({**args, 'version': Library.CURRENT_VERSION + 1}) == Library.CURRENT_VERSION
+    with pytest.raises(Exception, match='version must be at least 1'):
+        library.query({**args, 'version': 0})
+
+
+def test_changing_an_info_doesnt_change_bits_that_shared_it():
+    library = Library(data=_v1_data())
+    original = copy.deepcopy(library.serializable())
+    bits = library.bits
+    bits[0].info.title = 'Renamed'
+    assert bits[0].info.title == 'Renamed'
+    assert bits[1].info.title == 'Page'
+    data = library.serializable()
+    assert len(data['infos']) == 3
+    assert [bit['info'] for bit in data['bits']] == [0, 1, 2]
+    # Setting it back shares the original info again.
+    bits[0].info.title = 'Page'
+    assert bits[0]._data['info'] is bits[1]._data['info']
+    assert library.serializable() == original
+
+
+def test_embeddings_are_views_of_the_index():
+    library = Library(data=_v1_data())
+    assert library.embedding_bytes is None
+    matrix = library._embedding_index().matrix
+    assert library.embedding_bytes == matrix.nbytes
+    for row, bit in enumerate(library.bits):
+        assert np.shares_memory(bit.embedding, matrix)
+        assert np.array_equal(bit.embedding, matrix[row])
+    binary = Library(binary=b''.join(library.serialized_binary()))
+    matrix = binary._embedding_index().matrix
+    assert all(np.shares_memory(bit.embedding, matrix) for bit in binary.bits)
+    assert all(np.shares_memory(bit._data['embedding'], matrix) for bit in binary.bits)
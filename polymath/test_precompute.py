@@ -0,0 +1,54 @@
+import numpy as np
+
+from polymath.conftest import DIMS, make_library, query_args, random_embedding
+from polymath.library import Library, base64_from_embedding
+from polymath.precompute import PrecomputedQueries
+
+def _unit(rng: np.random.Generator) -> np.ndarray:
+    vector = random_embedding(rng)
+    return vector / np.linalg.norm(vector)
+
+
+def _library(rng: np.random.Generator, count: int = 20) -> Library:
+    return make_library(embeddings=[_unit(rng) for _ in range(count)])
+
+
+def _precomputed(library: Library, embedding: np.ndarray) -> PrecomputedQueries:
+    precomputed = PrecomputedQueries()
+    precomputed.set_embedding('fun query', embedding)
+    precomputed.rank(library)
+    return precomputed
+
+
+def test_match_compares_by_cosine():
+    rng = np.random.default_rng(0)
+    library = _library(rng)
+    embedding = _unit(rng)
+    precomputed = _precomputed(library, embedding)
+    assert precomputed.match(embedding) is not None
+    # Same direction, but the stored similarities would be wrong.
+    assert precomputed.match(embedding * 20) is None
+    assert precomputed.match(_unit(rng)) is None
+
+
+def test_random_query_embeddings_dont_match():
+    rng = np.random.default_rng(1)
+    library = _library(rng)
+    # The direction random query embeddings (see query()) cluster around.
+    embedding = np.ones(DIMS, dtype=np.float32) / np.sqrt(DIMS)
+    precomputed = _precomputed(library, embedding)
+    for _ in range(200):
+        assert precomputed.match(np.random.rand(DIMS).astype(np.float32)) is None
+
+
+def test_query_without_embedding_skips_precomputed():
+    rng = np.random.default_rng(2)
+    library = _library(rng)
+    embedding = _unit(rng)
+    precomputed = _precomputed(library, embedding)
+    library.use_precomputed(precomputed)
+    args = query_args('', count=3, debug_timings='true')
+    result = library.query({**args, 'query_embedding': base64_from_embedding(embedding)})
+    assert 'precomputed' in result.timings
+    result = library.query(args)
+    assert 'precomputed' not in result.timings
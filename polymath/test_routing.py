@@ -0,0 +1,23 @@
+import numpy as np
+
+from polymath import routing
+from polymath.routing import CentroidRouter, RowAttributes
+
+
+def test_upper_bounds_hold_for_embeddings_of_any_norm(monkeypatch):
+    monkeypatch.setattr(routing, 'ROUTING_CLUSTER_SIZE', 16)
+    rng = np.random.default_rng(0)
+    # Tight clusters, with norms that vary a lot, so that queries pointing
+    # away from a cluster give every member a negative similarity.
+    centers = rng.standard_normal((8, 32))
+    matrix = np.concatenate([
+        center + 0.05 * rng.standard_normal((32, 32)) for center in centers
+    ]) * rng.uniform(0.1, 10, (256, 1))
+    matrix = matrix.astype(np.float32)
+    router = CentroidRouter(matrix, [np.arange(256, dtype=np.int64)], RowAttributes([10] * 256, [None] * 256))
+    queries = np.concatenate([rng.standard_normal((20, 32)), -centers, centers]).astype(np.float32)
+    for query_embedding in queries:
+        bounds = router.upper_bounds(query_embedding)
+        similarities = matrix @ query_embedding
+        for cluster, rows in enumerate(router.rows):
+            assert similarities[rows].max() <= bounds[cluster]
@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+
+from polymath import search
+from polymath.routing import RowAttributes
+
+
+def _attributes(row_count: int) -> RowAttributes:
+    return RowAttributes([10] * row_count, [None] * row_count)
+
+
+def test_shard_bounds_cover_rows(monkeypatch):
+    monkeypatch.setattr(search, 'SEARCH_MIN_ROWS_PER_SHARD', 10)
+    bounds = search.shard_bounds(95, 4)
+    assert bounds[0][0] == 0
+    assert bounds[-1][1] == 95
+    assert all(end == start for (_, end), (start, _) in zip(bounds, bounds[1:]))
+    assert search.shard_bounds(5, 4) == [(0, 5)]
+
+
+def test_exhaustive_ranking_matches_full_sort(monkeypatch):
+    monkeypatch.setattr(search, 'SEARCH_MIN_ROWS_PER_SHARD', 50)
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((400, 8)).astype(np.float32)
+    query_embedding = rng.standard_normal(8).astype(np.float32)
+    attributes = RowAttributes([10] * 400, ['team' if row % 3 == 0 else None for row in range(400)])
+    similarities = matrix @ query_embedding
+    visible = np.nonzero(np.arange(400) % 3 != 0)[0]
+    expected = visible[np.lexsort((visible, -similarities[visible]))][:7]
+    for shard_count, block_rows in [(1, 0), (4, 0), (4, 30)]:
+        ranking = search.exhaustive_ranking(
+            matrix, query_embedding, attributes, [], 7, 'bit', shard_count, block_rows)
+        assert ranking is not None
+        rows, _ = ranking
+        assert rows[:7].tolist() == expected.tolist()
+
+
+def test_one_shard_doesnt_use_a_pool(monkeypatch):
+    def fail(size):
+        raise AssertionError('no pool expected')
+    monkeypatch.setattr(search, '_thread_pool', fail)
+    matrix = np.eye(4, dtype=np.float32)
+    ranking = search.exhaustive_ranking(
+        matrix, matrix[2], _attributes(4), [], 1, 'bit', 1, block_rows=2)
+    assert ranking is not None
+    assert ranking[0].tolist() == [2]
+
+
+def test_pools_of_different_sizes_are_usable_concurrently(monkeypatch):
+    monkeypatch.setattr(search, 'SEARCH_MIN_ROWS_PER_SHARD', 100)
+    matrix = np.random.default_rng(0).standard_normal((1000, 16)).astype(np.float32)
+    attributes = _attributes(1000)
+    errors = []
+
+    def run(shard_count: int):
+        try:
+            for _ in range(20):
+                search.exhaustive_ranking(
+                    matrix, matrix[0], attributes, [], 5, 'bit', shard_count)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_similarities_in_blocks_and_of_some_rows(monkeypatch):
+    monkeypatch.setattr(search, 'SEARCH_MIN_ROWS_PER_SHARD', 50)
+    monkeypatch.setattr(search, 'SEARCH_GATHER_BLOCK_ROWS', 16)
+    rng = np.random.default_rng(1)
+    matrix = rng.standard_normal((300, 8)).astype(np.float32)
+    query_embedding = rng.standard_normal(8).astype(np.float32)
+    expected = matrix @ query_embedding
+    released = []
+    result = search.similarities(
+        matrix, query_embedding, 3, block_rows=40, release=lambda start, end: released.append((start, end)))
+    assert np.allclose(result, expected, atol=1e-5)
+    assert sum(end - start for start, end in released) == 300
+    rows = np.array([5, 17, 200, 299], dtype=np.int64)
+    assert np.allclose(search.similarities(matrix, query_embedding, 3, rows=rows), expected[rows], atol=1e-5)
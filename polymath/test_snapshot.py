@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+from polymath import library as library_module, routing
+from polymath.conftest import library_data, query_args
+from polymath.library import Library
+from polymath.snapshot import SNAPSHOT_MAGIC, load_snapshot, snapshot_filename, write_snapshot
+
+
+def _write_library(directory: str, name: str, seed: int, count: int = 12) -> str:
+    filename = os.path.join(directory, name)
+    with open(filename, 'w') as f:
+        json.dump(library_data(count, seed, bit=lambda i: {
+            'text': f'{name} bit {i} ✓',
+            'token_count': 10 + i,
+            'info': {'url': f'https://example.com/{name}/{i // 3}'}
+        }), f)
+    return filename
+
+
+def _query(library: Library, seed: int) -> dict:
+    return library.query(query_args(seed=seed)).serializable()
+
+
+def test_snapshot_filename():
+    assert snapshot_filename('libraries/a.json') == 'libraries/a.json.snapshot'
+    assert snapshot_filename('', 'libraries') == os.path.join('libraries', 'default.snapshot')
+
+
+def test_restored_library_answers_queries_the_same(tmp_path):
+    sources = [_write_library(tmp_path, 'a.json', 0), _write_library(tmp_path, 'b.json', 1)]
+    library = Library(filename=sources[0])
+    other = Library(filename=sources[1])
+    library.add_shard([bit.id for bit in library.bits])
+    library.extend(other)
+    library.add_shard([bit.id for bit in other.bits])
+    filename = os.path.join(tmp_path, 'default.snapshot')
+    write_snapshot(library, filename, sources)
+    with open(filename, 'rb') as f:
+        assert f.read(4) == SNAPSHOT_MAGIC
+    result = load_snapshot(filename, sources)
+    assert result is not None
+    assert result._embedding_index().mapped
+    assert result.shards == library.shards
+    assert result.serializable() == library.serializable()
+    for seed in range(5):
+        assert _query(result, seed) == _query(library, seed)
+
+
+def test_restored_library_routes_without_clustering_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(library_module, 'ROUTING_MIN_EMBEDDINGS', 8)
+    monkeypatch.setattr(routing, 'ROUTING_CLUSTER_SIZE', 4)
+    sources = [_write_library(tmp_path, 'a.json', 0, count=40)]
+    library = Library(filename=sources[0])
+    filename = os.path.join(tmp_path, 'a.json.snapshot')
+    write_snapshot(library, filename, sources)
+    router = library._embedding_router()
+    assert router is not None and len(router) > 1
+
+    def kmeans(*args):
+        pytest.fail('clustered again')
+    monkeypatch.setattr(routing, '_kmeans', kmeans)
+    result = load_snapshot(filename, sources)
+    assert result is not None
+    restored = result._embedding_router()
+    assert restored is not None
+    assert [rows.tolist() for rows in restored.rows] == [rows.tolist() for rows in router.rows]
+    assert restored.max_angles.tolist() == router.max_angles.tolist()
+    for seed in range(5):
+        assert _query(result, seed) == _query(library, seed)
+
+
+def test_stale_or_missing_snapshots_are_ignored(tmp_path):
+    source = _write_library(tmp_path, 'a.json', 0)
+    filename = os.path.join(tmp_path, 'a.json.snapshot')
+    assert load_snapshot(filename, [source]) is None
+    write_snapshot(Library(filename=source), filename, [source])
+    assert load_snapshot(filename, [source]) is not None
+    # A different set of sources.
+    other = _write_library(tmp_path, 'b.json', 1)
+    assert load_snapshot(filename, [source, other]) is None
+    # Changed contents.
+    _write_library(tmp_path, 'a.json', 2, count=13)
+    assert load_snapshot(filename, [source]) is None
+
+
+def test_snapshot_of_another_version_is_ignored(tmp_path):
+    source = _write_library(tmp_path, 'a.json', 0)
+    filename = os.path.join(tmp_path, 'a.json.snapshot')
+    write_snapshot(Library(filename=source), filename, [source])
+    with open(filename, 'r+b') as f:
+        f.seek(4)
+        f.write(b'\xff\xff')
+    assert load_snapshot(filename, [source]) is None
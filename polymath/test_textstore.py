@@ -0,0 +1,44 @@
+import json
+import os
+
+import numpy as np
+
+from polymath.conftest import library_data
+from polymath.library import Library
+from polymath.snapshot import load_snapshot, write_snapshot
+from polymath.textstore import TextStore
+
+
+def test_encode_and_read_fields():
+    bits = [{'text': 'first', 'token_count': 1}, {'text': 'ünïcode ✓', 'info': 0}, {'token_count': 3}]
+    offsets, buffer = TextStore.encode(bits)
+    assert offsets.dtype == np.uint64
+    assert len(offsets) == 4
+    store = TextStore(buffer, offsets)
+    assert len(store) == 3
+    # Only the text store's fields are kept.
+    assert store.fields(0) == {'text': 'first'}
+    assert store.fields(1) == {'text': 'ünïcode ✓'}
+    assert store.fields(2) == {}
+
+
+def test_empty_store():
+    offsets, buffer = TextStore.encode([])
+    assert len(TextStore(buffer, offsets)) == 0
+
+
+def test_snapshot_text_is_read_when_needed(tmp_path):
+    source = os.path.join(tmp_path, 'library.json')
+    with open(source, 'w') as f:
+        json.dump(library_data(4, bit=lambda i: {'info': {'url': 'https://example.com/'}}), f)
+    filename = source + '.snapshot'
+    write_snapshot(Library(filename=source), filename, [source])
+    library = load_snapshot(filename, [source])
+    assert library is not None
+    bits = library.bits
+    assert all(bit._data.get('text') is None for bit in bits)
+    assert bits[2].text == 'bit 2'
+    assert bits[1]._data.get('text') is None
+    # Copies and serialization see the text too.
+    assert [bit.text for bit in library.copy().bits] == [f'bit {i}' for i in range(4)]
+    assert [bit['text'] for bit in library.serializable()['bits']] == [f'bit {i}' for i in range(4)]
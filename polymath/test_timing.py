@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from polymath.conftest import make_library, query_args
+from polymath.timing import DeadlineExceeded, StageTimer
+
+
+def test_stages_record_durations_and_counts():
+    timer = StageTimer()
+    with timer.stage('a'):
+        pass
+    with timer.stage('a'):
+        pass
+    timer.count('scored_bits', 3)
+    timer.count('scored_bits', 2)
+    assert list(timer.durations) == ['a']
+    assert timer.counts == {'scored_bits': 5}
+
+
+def test_no_stage_starts_after_the_deadline():
+    timer = StageTimer(deadline=time.perf_counter() + 60)
+    with timer.stage('in time'):
+        # A running stage isn't interrupted by the deadline passing.
+        timer.deadline = time.perf_counter() - 1
+    with pytest.raises(DeadlineExceeded):
+        with timer.stage('too late'):
+            pass
+    assert list(timer.durations) == ['in time']
+    timer.deadline = None
+    with timer.stage('no deadline'):
+        pass
+
+
+def test_query_past_its_deadline_is_abandoned():
+    library = make_library(4)
+    args = query_args(count=2)
+    with pytest.raises(DeadlineExceeded):
+        library.query(args, StageTimer(deadline=time.perf_counter() - 1))
+    assert len(library.query(args, StageTimer(deadline=time.perf_counter() + 60)).bits) == 2
@@ -0,0 +1,53 @@
+import json
+from typing import Any, List, cast
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .types import BitData
+
+# A text store keeps the fields of a library's bits that are only needed once
+# a bit is returned (its text) encoded in a buffer, typically a section of a
+# snapshot file that's mapped into memory. Only the offsets of each bit's
+# fields stay in memory; they're decoded when a bit is read, copied into a
+# query result or serialized. (Infos are shared between bits, so they're
+# small enough to keep in memory.)
+#
+# Bits backed by a store keep None in place of those fields, so that the
+# order of their fields doesn't change (see Bit.text).
+
+TEXT_STORE_FIELDS = ('text',)
+
+
+class TextStore:
+    """
+    Args:
+        buffer: The encoded fields of every bit, back to back.
+        offsets: The fields of bit i are buffer[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, buffer: Any, offsets: NDArray[np.uint64]):
+        self._buffer = memoryview(buffer)
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return max(len(self._offsets) - 1, 0)
+
+    def fields(self, position: int) -> BitData:
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return cast(BitData, json.loads(self._buffer[start:end].tobytes()))
+
+    @classmethod
+    def encode(cls, bits: List[BitData]) -> tuple[NDArray[np.uint64], bytes]:
+        """
+        Returns the offsets and the buffer of a store with the
+        TEXT_STORE_FIELDS of bits.
+        """
+        chunks = []
+        offsets = [0]
+        for bit in bits:
+            chunk = json.dumps(
+                {key: bit[key] for key in TEXT_STORE_FIELDS if key in bit}).encode()
+            chunks.append(chunk)
+            offsets.append(offsets[-1] + len(chunk))
+        return np.array(offsets, dtype=np.uint64), b''.join(chunks)
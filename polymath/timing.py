@@ -0,0 +1,49 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator, Union
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a stage of work timed with a deadline starts after it.
+    """
+
+
+class StageTimer:
+    """
+    Records the wall-clock time spent in each named stage of a piece of work,
+    e.g. the stages of Library.query, along with counts of what those stages
+    processed.
+
+    Args:
+        deadline: A time.perf_counter() value after which no further stage
+            may start; one that tries raises DeadlineExceeded. A stage that
+            is already running isn't interrupted.
+    """
+
+    def __init__(self, deadline: Union[float, None] = None):
+        # Stage name to duration in seconds, in the order stages first ran.
+        self.durations = dict[str, float]()
+        # e.g. 'scored_bits' to how many bits had their similarity computed.
+        self.counts = dict[str, int]()
+        self.deadline = deadline
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        if self.deadline is not None and start > self.deadline:
+            raise DeadlineExceeded(f'Ran out of time before {name}')
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, duration: float):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def count(self, name: str, value: int):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @property
+    def total(self) -> float:
+        return sum(self.durations.values())
@@ -1,7 +1,14 @@
 from typing import Union, List
 
+import numpy as np
+from numpy.typing import NDArray
+
 BitInfoData = dict[str, str]
-BitData = dict[str, Union[None, str, int, float, BitInfoData]]
+# An embedding is a base64 string when loaded from JSON, or an array when
+# loaded from the binary format.
+BitData = dict[str, Union[None, str, int, float, BitInfoData, NDArray[np.float32]]]
 LibraryDetailsCountsData = dict[str, int]
-LibraryDetailsData = dict[str, Union[str, LibraryDetailsCountsData]]
-LibraryData = dict[str, Union[str, int, List[str], LibraryDetailsData, List[BitData]]]
\ No newline at end of file
+# Stage name to milliseconds
+LibraryDetailsTimingsData = dict[str, float]
+LibraryDetailsData = dict[str, Union[str, LibraryDetailsCountsData, LibraryDetailsTimingsData]]
+LibraryData = dict[str, Union[str, int, List[str], LibraryDetailsData, List[BitInfoData], List[BitData]]]
\ No newline at end of file
@@ -1,4 +1,5 @@
-from .types import LibraryData, BitData
+import json
+from .types import LibraryData, BitData, BitInfoData
 from typing import Union, List, cast
 
 def _upgrade_from_0(library_data : LibraryData) -> bool:
@@ -23,10 +24,52 @@ def _upgrade_from_0(library_data : LibraryData) -> bool:
         library_data['sort'] = sort_type
     return True
 
+def info_key(info: BitInfoData) -> Union[tuple, str]:
+    """
+    Returns a key that's equal for infos with the same fields and values, so
+    that they can be stored once.
+    """
+    try:
+        key = tuple(info.items())
+        hash(key)
+        return key
+    except TypeError:
+        return json.dumps(info)
+
+def _upgrade_from_1(library_data : LibraryData) -> bool:
+    if library_data.get('version', 0) == 2:
+        return False
+    library_data['version'] = 2
+    bits = cast(list[BitData], library_data.get('bits', []))
+    # Bits that share an info (e.g. chunks of the same page) now refer to one
+    # entry in infos by its position.
+    infos = cast(list[BitInfoData], [])
+    positions = cast(dict[Union[tuple, str], int], {})
+    for bit in bits:
+        info = bit.get('info', None)
+        if not isinstance(info, dict):
+            continue
+        key = info_key(info)
+        position = positions.get(key)
+        if position is None:
+            position = len(infos)
+            positions[key] = position
+            infos.append(info)
+        bit['info'] = position
+    if 'bits' in library_data:
+        # infos goes right before bits, so that it's read first when the
+        # library is streamed.
+        del library_data['bits']
+        if infos:
+            library_data['infos'] = infos
+        library_data['bits'] = bits
+    return True
+
 # Each upgrader knows how to upgrade from the version integer at key, up by one
 # version.
 _UPGRADERS = {
-    0: _upgrade_from_0
+    0: _upgrade_from_0,
+    1: _upgrade_from_1
 }
 
 def upgrade_library_data(library_data : LibraryData) -> bool:
@@ -46,6 +89,8 @@ def upgrade_library_data(library_data : LibraryData) -> bool:
             # Nothing changed; avoid an infinite loop
             return changes_made
         changes_made = True
+        version = library_data.get('version', 0)
+        assert isinstance(version, int)
         upgrader = _UPGRADERS.get(version, None)
 
     return changes_made
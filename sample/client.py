@@ -8,6 +8,7 @@ import urllib3
 
 from polymath import (Library, get_completion_with_context, get_embedding,
                       get_max_tokens_for_completion_model)
+from polymath.binary import BINARY_MIMETYPE
 from polymath.config.env import EnvConfigStore
 from polymath.config.json import JSONConfigStore
 from polymath.config.types import DirectoryConfig, EnvironmentConfig
@@ -19,7 +20,7 @@ DEFAULT_CONTEXT_TOKEN_COUNT = 1500
 DEFAULT_CONFIG_FILE = config_store.default(DirectoryConfig)
 
 
-def query_server(query_embedding, server, random=False, count=DEFAULT_CONTEXT_TOKEN_COUNT):
+def query_server(query_embedding, server, random=False, count=DEFAULT_CONTEXT_TOKEN_COUNT, binary=False, debug_timings=False, embeddings=False):
     http = urllib3.PoolManager()
     fields = {
         "version": Library.CURRENT_VERSION,
@@ -31,9 +32,20 @@ def query_server(query_embedding, server, random=False, count=DEFAULT_CONTEXT_TO
         fields["omit"] = "similarity,embedding"
     else:
         fields["query_embedding"] = query_embedding
+        if embeddings:
+            fields["omit"] = ""
+    if debug_timings:
+        fields["debug_timings"] = 1
+    headers = {}
+    if binary:
+        # Hosts that don't know the binary format will just send JSON.
+        headers["Accept"] = f"{BINARY_MIMETYPE}, application/json;q=0.5"
+        fields["embedding_dtype"] = "float16"
     response = http.request(
-        'POST', server, fields=fields).data
-    obj = json.loads(response)
+        'POST', server, fields=fields, headers=headers)
+    if response.headers.get('Content-Type', '').startswith(BINARY_MIMETYPE):
+        return Library(binary=response.data)
+    obj = json.loads(response.data)
     if 'error' in obj:
         error = obj['error']
         raise Exception(f"Server returned an error: {error}")
@@ -74,6 +86,18 @@ parser.add_argument(
     "--random", help="Ask for a random set of bits",
     action=argparse.BooleanOptionalAction,
     default=False)
+parser.add_argument(
+    "--binary", help="Ask hosts for the compact binary format instead of JSON",
+    action=argparse.BooleanOptionalAction,
+    default=False)
+parser.add_argument(
+    "--collapse-similarity", help="Drop bits more similar than this (e.g. 0.97) to a better bit from any host, such as the same page from a mirror",
+    type=float,
+    default=0)
+parser.add_argument(
+    "--collapse-per-url", help="Use at most this many bits from the same url across all hosts",
+    type=int,
+    default=0)
 parser.add_argument(
     "--verbose", help="Print out context and sources and other useful intermediate data",
     action=argparse.BooleanOptionalAction,
@@ -147,11 +171,23 @@ combined_library = Library()
 for server in server_list:
     print(f"Querying {server} ...") if args.verbose else None
     library = query_server(query_vector, server,
-                           random=args.random, count=context_count)
+                           random=args.random, count=context_count, binary=args.binary,
+                           debug_timings=args.verbose, embeddings=args.collapse_similarity > 0)
     if library.message:
         print(f'{server} said: ' + library.message)
+    if args.verbose and library.timings:
+        timings = ", ".join(
+            f"{stage} {duration}ms" for stage, duration in library.timings.items())
+        print(f"{server} timings: {timings}")
     combined_library.extend(library)
 
+# Hosts can serve the same content (e.g. from mirrored urls) under different
+# ids, which extend() doesn't catch.
+collapsed_count = combined_library.collapse(
+    args.collapse_similarity, args.collapse_per_url)
+if args.verbose and collapsed_count:
+    print(f"Collapsed {collapsed_count} duplicate bits")
+
 sliced_library = combined_library.slice(context_count)
 
 sources = [info.url for info in sliced_library.unique_infos]